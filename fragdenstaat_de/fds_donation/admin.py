@@ -1,7 +1,6 @@
+import hashlib
 import tempfile
 import unicodedata
-import uuid
-from collections import defaultdict
 from decimal import Decimal
 
 from django import forms
@@ -9,7 +8,9 @@ from django.conf import settings
 from django.contrib import admin, messages
 from django.contrib.admin import helpers
 from django.contrib.admin.models import CHANGE, LogEntry
+from django.contrib.admin.options import IncorrectLookupParameters
 from django.contrib.admin.views.main import ChangeList
+from django.core.cache import cache
 from django.core.exceptions import PermissionDenied
 from django.db import transaction
 from django.db.models import (
@@ -25,15 +26,20 @@ from django.db.models import (
     Value,
 )
 from django.db.models.functions import Concat
+from django.http import JsonResponse
 from django.shortcuts import redirect
 from django.template.response import TemplateResponse
 from django.urls import path, reverse
 from django.utils import formats, timezone
+from django.utils.decorators import method_decorator
 from django.utils.html import format_html
+from django.utils.http import urlencode
 from django.utils.safestring import mark_safe
 from django.utils.translation import gettext_lazy as _
+from django.views.decorators.gzip import gzip_page
 
 from adminsortable2.admin import SortableAdminMixin
+from django_countries import countries
 from flowcontrol.engine import create_flowrun
 from flowcontrol.models import Flow
 from froide_payment.models import PaymentStatus
@@ -55,6 +61,7 @@ from fragdenstaat_de.fds_mailing.models import MailingMessage
 from fragdenstaat_de.fds_mailing.utils import SetupMailingMixin
 from fragdenstaat_de.fds_newsletter.admin_utils import make_subscriber_tagger
 from fragdenstaat_de.theme.admin import make_tag_autocomplete_admin
+from fragdenstaat_de.theme.csv_export import export_queryset_csv
 
 from .admin_utils import (
     ActiveRecurrencesListFilter,
@@ -78,6 +85,9 @@ from .models import (
     DonorEvent,
     DonorTag,
     Recurrence,
+    StatementImport,
+    find_transaction_id,
+    get_amount_in_year,
 )
 from .services import send_donation_gift_order_shipped
 
@@ -90,6 +100,9 @@ def median(field):
     )
 
 
+DONATION_STATS_KEY = "fds_donation:donation_stats:{}"
+DONATION_STATS_TIMEOUT = 60 * 5
+
 DONOR_TAG_AUTOCOMPLETE = make_tag_autocomplete_admin(
     DonorTag, "fds_donation-donortag-autocomplete"
 )
@@ -104,26 +117,51 @@ class DonorAdminForm(forms.ModelForm):
         }
 
 
+# Stored donor aggregates that are annotated per project when filtered
+PROJECT_DONATION_STATS = ("amount_total", "donation_count", "last_donation")
+
+
 class DonorChangeList(ChangeList):
+    @property
+    def is_project_filtered(self):
+        return "project_amount_total" in self.root_queryset.query.annotations
+
+    def get_donation_stat(self, name):
+        """
+        Returns the stored donor aggregate or the annotation
+        over donations of the filtered projects.
+        """
+        if self.is_project_filtered and name in PROJECT_DONATION_STATS:
+            return "project_{}".format(name)
+        return name
+
+    def get_ordering_field(self, field_name):
+        order_field = super().get_ordering_field(field_name)
+        if isinstance(order_field, str):
+            return self.get_donation_stat(order_field)
+        return order_field
+
     def get_results(self, *args, **kwargs):
         ret = super().get_results(*args, **kwargs)
 
         last_year = timezone.now().year - 1
+        amount_total = self.get_donation_stat("amount_total")
         q = self.queryset.aggregate(
-            amount_total_sum=Sum("amount_total"),
+            amount_total_sum=Sum(amount_total),
             amount_last_year_sum=Sum("amount_last_year"),
-            amount_total_median=median("amount_total"),
-            amount_total_avg=Avg("amount_total"),
+            amount_total_median=median(amount_total),
+            amount_total_avg=Avg(amount_total),
             amount_last_year_avg=Avg("amount_last_year"),
             recurring_total=Sum("recurring_amount"),
-            duplicates=Count(
-                "duplicate",
-                distinct=True,
-                filter=Q(
-                    duplicate__isnull=False,
-                    donations__received_timestamp__year=last_year,
-                ),
-            ),
+        )
+        # Separate query, joining donations would repeat donor amounts
+        donations_last_year = Donation.objects.filter(
+            donor_id=OuterRef("pk"), received_timestamp__year=last_year
+        )
+        duplicates = (
+            self.queryset.filter(duplicate__isnull=False)
+            .filter(Exists(donations_last_year))
+            .aggregate(duplicates=Count("duplicate", distinct=True))
         )
         self.amount_total_sum = q["amount_total_sum"]
         self.amount_total_avg = (
@@ -141,7 +179,7 @@ class DonorChangeList(ChangeList):
             else "-"
         )
         self.total_amount_recurring = q["recurring_total"]
-        self.duplicates = q["duplicates"] or 0
+        self.duplicates = duplicates["duplicates"] or 0
         return ret
 
 
@@ -310,36 +348,41 @@ class DonorAdmin(SetupMailingMixin, admin.ModelAdmin):
                 self.admin_site.admin_view(self.merge_donor_view),
                 name="fds_donation-donor-merge_donor",
             ),
+            path(
+                "detect-duplicates/",
+                self.admin_site.admin_view(self.detect_all_duplicates_view),
+                name="fds_donation-donor-detect_duplicates",
+            ),
         ]
         return my_urls + urls
 
     def get_queryset(self, request):
         qs = super().get_queryset(request).select_related("subscriber")
-        donations_filter = Q(donations__received_timestamp__isnull=False)
+        last_year = timezone.now().year - 1
 
         donation_projects = request.GET.get(DonorProjectFilter.parameter_name)
-        any_donation = {}
-        if donation_projects:
-            values = donation_projects.split(",")
-            project_q = DonorProjectFilter.get_q(values, "project__in")
-            donations_filter &= project_q
-            any_donation = {"any_donation": Count("donations", filter=project_q)}
-
-        last_year = timezone.now().year - 1
-        qs = qs.annotate(
-            amount_total=Sum("donations__amount", filter=donations_filter),
+        if not donation_projects:
+            # Use stored donor aggregates
+            return qs.annotate(amount_last_year=get_amount_in_year(last_year))
+
+        # Stored aggregates are over all projects, sum up project donations
+        values = donation_projects.split(",")
+        project_q = DonorProjectFilter.get_q(values, "project__in")
+        donations_filter = Q(donations__received_timestamp__isnull=False) & project_q
+        return qs.annotate(
+            project_amount_total=Sum("donations__amount", filter=donations_filter),
             amount_last_year=Sum(
                 "donations__amount",
                 filter=donations_filter
                 & Q(donations__received_timestamp__year=last_year),
             ),
-            donation_count=Count("donations", filter=donations_filter),
-            last_donation=Max("donations__timestamp", filter=donations_filter),
-            **any_donation,
-        )
-        if donation_projects:
-            qs = qs.filter(any_donation__gt=0)
-        return qs
+            project_donation_count=Count("donations", filter=donations_filter),
+            project_last_donation=Max("donations__timestamp", filter=donations_filter),
+            any_donation=Count("donations", filter=project_q),
+        ).filter(any_donation__gt=0)
+
+    def get_donation_stat(self, obj, name):
+        return getattr(obj, "project_{}".format(name), getattr(obj, name))
 
     def view_on_site(self, obj):
         return reverse("fds_donation:donor-legacy", kwargs={"token": obj.uuid})
@@ -352,11 +395,12 @@ class DonorAdmin(SetupMailingMixin, admin.ModelAdmin):
 
     @admin.display(ordering="donation_count", description=_("Donation count"))
     def donation_count(self, obj):
-        return obj.donation_count
+        return self.get_donation_stat(obj, "donation_count")
 
     @admin.display(ordering="amount_total", description=_("Amount total"))
     def amount_total(self, obj):
-        return formats.number_format(obj.amount_total or 0, decimal_pos=2)
+        amount_total = self.get_donation_stat(obj, "amount_total")
+        return formats.number_format(amount_total or 0, decimal_pos=2)
 
     @admin.display(ordering="amount_last_year", description=_("Amount last year"))
     def amount_last_year(self, obj):
@@ -364,7 +408,7 @@ class DonorAdmin(SetupMailingMixin, admin.ModelAdmin):
 
     @admin.display(ordering="last_donation", description=_("Last donation"))
     def last_donation(self, obj):
-        return obj.last_donation
+        return self.get_donation_stat(obj, "last_donation")
 
     @admin.display(
         ordering=Concat("first_name", Value(" "), "last_name"), description=_("Name")
@@ -423,64 +467,37 @@ class DonorAdmin(SetupMailingMixin, admin.ModelAdmin):
     @admin.action(description=_("Clear duplicate flag on donors"))
     def clear_duplicates(self, request, queryset):
         # Clear order of queryset to avoid ordering on non-existing annotation columns
-        queryset.order_by().update(duplicate=None)
+        queryset.order_by().update(duplicate=None, duplicate_score=None)
         self.message_user(request, _("Duplicate flags cleared."))
 
     @admin.action(description=_("Detect duplicate donors"))
     def detect_duplicates(self, request, queryset):
-        key_funcs = {
-            "email": lambda obj: (
-                obj.email if obj.email and obj.email_confirmed else None
-            ),
-            "name_addres": lambda obj: (
-                (
-                    obj.get_full_name(),
-                    obj.address,
-                    obj.postcode,
-                    obj.city,
-                )
-                if obj.address and obj.get_full_name()
-                else None
-            ),
-            "iban": lambda obj: (
-                obj.attributes.get("iban")
-                if obj.attributes and obj.attributes.get("iban")
-                else None
-            ),
-        }
-        dupe_lists = {key: defaultdict(list) for key in key_funcs.keys()}
-        id_sets = defaultdict(set)
-
-        for obj in queryset:
-            for key_name, key_func in key_funcs.items():
-                key = key_func(obj)
-                if key:
-                    dupe_lists[key_name][key].append(obj.id)
-
-        for _key, dupe_dict in dupe_lists.items():
-            for id_list in dupe_dict.values():
-                if len(id_list) > 1:
-                    id_set = set()
-                    for donor_id in id_list:
-                        if donor_id in id_sets:
-                            id_set.update(id_sets[donor_id])
-                        id_set.add(donor_id)
-                        id_sets[donor_id] = id_set
-        already = set()
-        count = 0
-        for donor_id, id_set in id_sets.items():
-            if donor_id in already:
-                continue
-            already.update(id_set)
-            Donor.objects.filter(id__in=id_set).update(duplicate=uuid.uuid4())
-            count += 1
+        from .tasks import detect_duplicate_donors_task
+
+        donor_ids = list(queryset.order_by().values_list("id", flat=True))
+        detect_duplicate_donors_task.delay(donor_ids, user_id=request.user.id)
         self.message_user(
             request,
-            _("Detected {dup} duplicate sets with {donors} donors").format(
-                dup=count, donors=len(already)
-            ),
+            _("Duplicate detection will start in background."),
+            level=messages.INFO,
         )
 
+    def detect_all_duplicates_view(self, request):
+        from .tasks import detect_duplicate_donors_task
+
+        if not request.method == "POST":
+            raise PermissionDenied
+        if not self.has_change_permission(request):
+            raise PermissionDenied
+
+        detect_duplicate_donors_task.delay(user_id=request.user.id)
+        self.message_user(
+            request,
+            _("Duplicate detection will start in background."),
+            level=messages.INFO,
+        )
+        return redirect("admin:fds_donation_donor_changelist")
+
     @admin.action(description=_("Update invalid addresses"))
     def mark_invalid_addresses(self, request, queryset):
         with transaction.atomic():
@@ -527,10 +544,11 @@ class DonorAdmin(SetupMailingMixin, admin.ModelAdmin):
                 received_timestamp__year=last_year, donor_id=OuterRef("pk")
             )
 
+            # Review the strongest matches first
             first_donor = (
                 Donor.objects.filter(duplicate__isnull=False)
                 .filter(Exists(donations))
-                .order_by("?")
+                .order_by(F("duplicate_score").desc(nulls_last=True), "duplicate")
                 .first()
             )
             if not first_donor:
@@ -561,15 +579,8 @@ class DonorAdmin(SetupMailingMixin, admin.ModelAdmin):
                 return
 
         last_year = timezone.now().year - 1
-        donations_filter = Q(donations__received_timestamp__isnull=False)
         candidates = queryset.order_by("-id").annotate(
-            amount_total=Sum("donations__amount", filter=donations_filter),
-            amount_last_year=Sum(
-                "donations__amount",
-                filter=donations_filter
-                & Q(donations__received_timestamp__year=last_year),
-            ),
-            donation_count=Count("donations", filter=donations_filter),
+            amount_last_year=get_amount_in_year(last_year)
         )
         candidate_ids = [x.id for x in candidates]
         if len(candidate_ids) < 2:
@@ -582,7 +593,7 @@ class DonorAdmin(SetupMailingMixin, admin.ModelAdmin):
         if request.POST and "salutation" in request.POST:
             donor = None
             if request.POST.get("cancel"):
-                candidates.update(duplicate=None)
+                candidates.update(duplicate=None, duplicate_score=None)
             else:
                 donor_form = MergeDonorForm(data=request.POST)
                 if donor_form.is_valid():
@@ -711,78 +722,55 @@ class DonorAdmin(SetupMailingMixin, admin.ModelAdmin):
             count=count
         )
 
+    @method_decorator(gzip_page)
     def export_donor_csv(self, request, queryset):
-        def get_donor_row(queryset):
-            for donor in queryset:
-                yield {
-                    "id": donor.id,
-                    "email": donor.email,
-                    "first_name": donor.first_name,
-                    "last_name": donor.last_name,
-                    "company_name": donor.company_name,
-                    "address": donor.address,
-                    "postcode": donor.postcode,
-                    "location": donor.city,
-                    "country": donor.country.name,
-                    "salutation": donor.get_salutation(),
-                    "iban": donor.attributes.get("iban", "")
-                    if donor.attributes
-                    else "",
-                }
-
-        donor_data = list(get_donor_row(queryset))
-        return export_csv_response(dict_to_csv_stream(donor_data))
+        def get_salutation(row):
+            donor = Donor(
+                salutation=row["salutation"],
+                first_name=row["first_name"],
+                last_name=row["last_name"],
+                company_name=row["company_name"],
+            )
+            return donor.get_salutation()
+
+        def get_iban(row):
+            if row["attributes"]:
+                return row["attributes"].get("iban", "")
+            return ""
+
+        fields = (
+            "id",
+            "email",
+            "salutation",
+            "first_name",
+            "last_name",
+            "company_name",
+            "address",
+            "postcode",
+            "city",
+            "country",
+            "attributes",
+        )
+        columns = {
+            "id": "id",
+            "email": "email",
+            "first_name": "first_name",
+            "last_name": "last_name",
+            "company_name": "company_name",
+            "address": "address",
+            "postcode": "postcode",
+            "location": "city",
+            "country": lambda row: countries.name(row["country"]),
+            "salutation": get_salutation,
+            "iban": get_iban,
+        }
+        return export_queryset_csv(queryset, fields, columns, filename="donors.csv")
 
 
 class DonationChangeList(ChangeList):
     def get_results(self, *args, **kwargs):
         ret = super().get_results(*args, **kwargs)
-        agg = self.queryset.aggregate(
-            amount_sum=Sum("amount"),
-            amount_avg=Avg("amount"),
-            amount_received_sum=Sum("amount_received"),
-            donor_count=Count("donor_id", distinct=True),
-            amount_median=median("amount"),
-        )
-        donor_agg = (
-            Donor.objects.filter(donations__in=self.queryset)
-            .distinct()
-            .aggregate(recurring_donor_amount=Sum("recurring_amount"))
-        )
-        self.amount_sum = agg["amount_sum"]
-        self.amount_avg = (
-            round(agg["amount_avg"]) if agg["amount_avg"] is not None else "-"
-        )
-        self.amount_median = (
-            round(agg["amount_median"]) if agg["amount_median"] is not None else "-"
-        )
-        self.amount_received_sum = agg["amount_received_sum"]
-        self.donor_count = agg["donor_count"]
-        self.recurring_donor_amount = donor_agg["recurring_donor_amount"]
-        recurrence_agg = (
-            Recurrence.objects.filter(donations__in=self.queryset)
-            .distinct()
-            .aggregate(
-                recurring_count=Count("id"),
-                cancel_count=Count("id", filter=Q(cancel_date__isnull=False)),
-                monthly_amount=Sum(F("amount") / F("interval")),
-                monthly_active_amount=Sum(
-                    F("amount") / F("interval"), filter=Q(cancel_date__isnull=True)
-                ),
-            )
-        )
-        self.recurring_count = recurrence_agg["recurring_count"]
-        self.cancel_count = recurrence_agg["cancel_count"]
-        self.recurring_monthly_amount = (
-            round(recurrence_agg["monthly_amount"])
-            if recurrence_agg["monthly_amount"] is not None
-            else "-"
-        )
-        self.recurring_monthly_active_amount = (
-            round(recurrence_agg["monthly_active_amount"])
-            if recurrence_agg["monthly_active_amount"] is not None
-            else "-"
-        )
+        # Summary statistics are loaded from the donation stats view
         self.DONATION_PROJECTS = DONATION_PROJECTS
         return ret
 
@@ -950,7 +938,7 @@ class DonationAdmin(admin.ModelAdmin):
         my_urls = [
             path(
                 "export-csv/",
-                self.admin_site.admin_view(self.export_csv),
+                self.admin_site.admin_view(gzip_page(self.export_csv)),
                 name="%s-%s-export_csv" % info,
             ),
             path(
@@ -963,6 +951,11 @@ class DonationAdmin(admin.ModelAdmin):
                 self.admin_site.admin_view(self.import_paypal),
                 name="%s-%s-import_paypal" % info,
             ),
+            path(
+                "stats/",
+                self.admin_site.admin_view(self.donation_stats),
+                name="%s-%s-stats" % info,
+            ),
         ]
         return my_urls + urls
 
@@ -993,30 +986,23 @@ class DonationAdmin(admin.ModelAdmin):
                 return None
             return timezone.localtime(date).isoformat()
 
-        def make_dicts(queryset):
-            for donation in queryset.select_related("donor", "payment"):
-                yield {
-                    "id": donation.id,
-                    "timestamp": to_local(donation.timestamp),
-                    "amount": donation.amount,
-                    "amount_received": donation.amount_received,
-                    "received_timestamp": to_local(donation.received_timestamp),
-                    "purpose": donation.purpose,
-                    "reference": donation.reference,
-                    "project": donation.project,
-                    "keyword": donation.keyword,
-                    "recurring": donation.recurring,
-                    "method": donation.method,
-                    "transaction_id": donation.get_transaction_id(),
-                    "first_recurring": donation.first_recurring,
-                    "donor_id": donation.donor_id,
-                    "number": donation.number,
-                    "name": donation.donor.get_full_name(),
-                    "email": donation.donor.email,
-                    "city": donation.donor.city,
-                    "country": donation.donor.country,
-                    "postcode": donation.donor.postcode,
-                }
+        def get_full_name(row):
+            name = "{} {}".format(row["donor__first_name"], row["donor__last_name"])
+            name = name.strip()
+            if row["donor__company_name"] and not name:
+                return row["donor__company_name"]
+            return name
+
+        def get_transaction_id(row):
+            if row["identifier"]:
+                return row["identifier"]
+            return find_transaction_id(
+                row["method"],
+                row["identifier"],
+                payment_id=row["payment_id"],
+                transaction_id=row["payment__transaction_id"],
+                extra_data=row["payment__extra_data"],
+            )
 
         response = self.changelist_view(request)
         try:
@@ -1024,7 +1010,75 @@ class DonationAdmin(admin.ModelAdmin):
         except (AttributeError, KeyError):
             return response
 
-        return export_csv_response(dict_to_csv_stream(make_dicts(queryset)))
+        fields = (
+            "id",
+            "timestamp",
+            "amount",
+            "amount_received",
+            "received_timestamp",
+            "purpose",
+            "reference",
+            "project",
+            "keyword",
+            "recurring",
+            "method",
+            "identifier",
+            "first_recurring",
+            "donor_id",
+            "number",
+            "payment_id",
+            "payment__transaction_id",
+            "payment__extra_data",
+            "donor__first_name",
+            "donor__last_name",
+            "donor__company_name",
+            "donor__email",
+            "donor__city",
+            "donor__country",
+            "donor__postcode",
+        )
+        columns = {
+            "id": "id",
+            "timestamp": lambda row: to_local(row["timestamp"]),
+            "amount": "amount",
+            "amount_received": "amount_received",
+            "received_timestamp": lambda row: to_local(row["received_timestamp"]),
+            "purpose": "purpose",
+            "reference": "reference",
+            "project": "project",
+            "keyword": "keyword",
+            "recurring": "recurring",
+            "method": "method",
+            "transaction_id": get_transaction_id,
+            "first_recurring": "first_recurring",
+            "donor_id": "donor_id",
+            "number": "number",
+            "name": get_full_name,
+            "email": "donor__email",
+            "city": "donor__city",
+            "country": "donor__country",
+            "postcode": "donor__postcode",
+        }
+        return export_queryset_csv(queryset, fields, columns, filename="donations.csv")
+
+    def donation_stats(self, request):
+        from .utils import get_donation_stats
+
+        if not self.has_view_permission(request):
+            raise PermissionDenied
+        query = urlencode(sorted(request.GET.lists()), doseq=True)
+        cache_key = DONATION_STATS_KEY.format(
+            hashlib.sha256(query.encode("utf-8")).hexdigest()
+        )
+        stats = cache.get(cache_key)
+        if stats is None:
+            try:
+                cl = self.get_changelist_instance(request)
+            except IncorrectLookupParameters:
+                return JsonResponse({}, status=400)
+            stats = get_donation_stats(cl.queryset)
+            cache.set(cache_key, stats, DONATION_STATS_TIMEOUT)
+        return JsonResponse(stats)
 
     @admin.action(description=_("Match planned to received banktransfer"))
     def match_banktransfer(self, request, queryset):
@@ -1133,26 +1187,33 @@ class DonationAdmin(admin.ModelAdmin):
             level=messages.SUCCESS,
         )
 
-    def import_banktransfers(self, request):
-        from .tasks import import_banktransfers_task
+    def start_statement_import(self, request, kind, project=""):
+        from .tasks import run_statement_import_task
 
         if not request.method == "POST":
             raise PermissionDenied
         if not self.has_change_permission(request):
             raise PermissionDenied
 
-        xls_file_obj = request.FILES.get("file")
-        project = request.POST["project"]
-        if xls_file_obj is None:
+        uploaded_file = request.FILES.get("file")
+        if uploaded_file is None:
             self.message_user(request, _("No file provided."), level=messages.ERROR)
             return redirect("admin:fds_donation_donation_changelist")
 
         # Create a named temporary file for background task to read
         file_obj = tempfile.NamedTemporaryFile(delete=False)
-        file_obj.write(xls_file_obj.read())
+        file_obj.write(uploaded_file.read())
         file_obj.close()
 
-        import_banktransfers_task.delay(file_obj.name, project, user_id=request.user.id)
+        statement_import = StatementImport.objects.create(
+            kind=kind,
+            project=project,
+            dry_run=bool(request.POST.get("dry_run")),
+            user=request.user,
+            filename=uploaded_file.name,
+            filepath=file_obj.name,
+        )
+        run_statement_import_task.delay(statement_import.id)
 
         self.message_user(
             request,
@@ -1160,35 +1221,19 @@ class DonationAdmin(admin.ModelAdmin):
             level=messages.INFO,
         )
 
-        return redirect("admin:fds_donation_donation_changelist")
-
-    def import_paypal(self, request):
-        from .tasks import import_paypal_task
-
-        if not request.method == "POST":
-            raise PermissionDenied
-        if not self.has_change_permission(request):
-            raise PermissionDenied
-
-        csv_file = request.FILES.get("file")
-        if csv_file is None:
-            self.message_user(request, _("No file provided."), level=messages.ERROR)
-            return redirect("admin:fds_donation_donation_changelist")
-
-        # Create a named temporary file for background task to read
-        file_obj = tempfile.NamedTemporaryFile(delete=False)
-        file_obj.write(csv_file.read())
-        file_obj.close()
-
-        import_paypal_task.delay(file_obj.name, user_id=request.user.id)
+        return redirect(
+            "admin:fds_donation_statementimport_change", statement_import.id
+        )
 
-        self.message_user(
+    def import_banktransfers(self, request):
+        return self.start_statement_import(
             request,
-            _("Import will start in background."),
-            level=messages.INFO,
+            StatementImport.Kind.BANKTRANSFER,
+            project=request.POST.get("project", ""),
         )
 
-        return redirect("admin:fds_donation_donation_changelist")
+    def import_paypal(self, request):
+        return self.start_statement_import(request, StatementImport.Kind.PAYPAL)
 
 
 @admin.register(DonationGift)
@@ -1690,3 +1735,76 @@ class DonorEventAdmin(admin.ModelAdmin):
 
     def get_queryset(self, request):
         return super().get_queryset(request).select_related("donor")
+
+
+@admin.register(StatementImport)
+class StatementImportAdmin(admin.ModelAdmin):
+    list_display = (
+        "timestamp",
+        "kind",
+        "project",
+        "filename",
+        "dry_run",
+        "status",
+        "rows",
+        "rows_total",
+        "matched",
+        "created",
+        "skipped",
+        "ambiguous",
+        "rows_per_second",
+    )
+    list_filter = ("kind", "status", "dry_run")
+    date_hierarchy = "timestamp"
+    raw_id_fields = ("user",)
+    readonly_fields = (
+        "kind",
+        "project",
+        "dry_run",
+        "status",
+        "user",
+        "filename",
+        "timestamp",
+        "started",
+        "updated",
+        "finished",
+        "rows_total",
+        "rows",
+        "matched",
+        "created",
+        "donors_created",
+        "direct_debits",
+        "skipped",
+        "ambiguous",
+        "rows_per_second",
+        "last_key",
+        "error",
+    )
+    exclude = ("filepath", "started_rows")
+    actions = ["resume_imports"]
+
+    def has_add_permission(self, request):
+        return False
+
+    @admin.display(description=_("rows per second"))
+    def rows_per_second(self, obj):
+        return obj.rows_per_second
+
+    @admin.action(description=_("Resume failed or interrupted imports"))
+    def resume_imports(self, request, queryset):
+        from .tasks import run_statement_import_task
+
+        statement_imports = StatementImport.objects.get_resumable().filter(
+            id__in=queryset.values("id")
+        )
+        count = 0
+        for statement_import in statement_imports:
+            statement_import.status = StatementImport.Status.PENDING
+            statement_import.save(update_fields=["status"])
+            run_statement_import_task.delay(statement_import.id)
+            count += 1
+        self.message_user(
+            request,
+            _("Resuming {count} imports.").format(count=count),
+            level=messages.INFO,
+        )
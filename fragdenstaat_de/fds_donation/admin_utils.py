@@ -9,7 +9,13 @@ from django.utils.translation import gettext_lazy as _
 
 from froide.helper.admin_utils import MultiFilterMixin, TaggitListFilter
 
-from .models import DONATION_PROJECTS, Donation, Recurrence, TaggedDonor
+from .models import (
+    DONATION_PROJECTS,
+    Donation,
+    Recurrence,
+    TaggedDonor,
+    get_amount_in_year,
+)
 
 
 class DonorProjectFilter(MultiFilterMixin, SimpleListFilter):
@@ -86,20 +92,23 @@ class DonorTotalAmountPerYearFilter(SimpleListFilter):
         qs = queryset
 
         if amount_str and year:
-            donations_filter = Q(donations__received_timestamp__year=year)
             donation_projects = self.request.GET.get(DonorProjectFilter.parameter_name)
             if donation_projects:
                 values = donation_projects.split(",")
                 project_q = DonorProjectFilter.get_q(values, "project__in")
-                donations_filter &= project_q
-
-            # Annotate donors with total donation amount for specified year
-            qs = queryset.annotate(
-                amount_in_year=Sum(
-                    "donations__amount",
-                    filter=donations_filter,
-                ),
-            )
+                donations_filter = (
+                    Q(donations__received_timestamp__year=year) & project_q
+                )
+                # Annotate donors with total donation amount for specified year
+                qs = queryset.annotate(
+                    amount_in_year=Sum(
+                        "donations__amount",
+                        filter=donations_filter,
+                    ),
+                )
+            else:
+                # Use stored amounts per year
+                qs = queryset.annotate(amount_in_year=get_amount_in_year(year))
 
             # Parse amount range: supports "min-max", "min-", "-max", or exact value
             val = amount_str.strip()
@@ -24,6 +24,8 @@ class FdsDonationConfig(AppConfig):
     default = True
 
     def ready(self):
+        from django.db.models.signals import post_delete
+
         from froide_payment.signals import (
             sepa_notification,
             subscription_cancel_feedback,
@@ -41,23 +43,27 @@ class FdsDonationConfig(AppConfig):
         from froide.account.export import registry
 
         from fragdenstaat_de.fds_mailing import gather_mailing_preview_context
-        from fragdenstaat_de.fds_newsletter import tag_subscriber
+        from fragdenstaat_de.fds_newsletter import tag_sources_changed, tag_subscribers
 
         from . import actions  # noqa: F401
         from .listeners import (
             activate_user,
             cancel_user,
+            donation_deleted,
+            donor_tag_sources_changed,
             export_user_data,
             merge_user,
             payment_status_changed,
             remove_newsletter_subscriber,
             save_subscription_cancel_feedback,
             sepa_payment_processing,
+            statement_import_delete_file,
             subscription_was_canceled,
             subscription_was_modified,
-            tag_subscriber_donor,
+            tag_subscribers_donor,
             user_email_changed,
         )
+        from .models import Donation, StatementImport
 
         status_changed.connect(payment_status_changed)
         subscription_canceled.connect(subscription_was_canceled)
@@ -70,7 +76,10 @@ class FdsDonationConfig(AppConfig):
         account_merged.connect(merge_user)
         unsubscribed.connect(remove_newsletter_subscriber)
         registry.register(export_user_data)
-        tag_subscriber.connect(tag_subscriber_donor)
+        tag_subscribers.connect(tag_subscribers_donor)
+        tag_sources_changed.connect(donor_tag_sources_changed)
+        post_delete.connect(donation_deleted, sender=Donation)
+        post_delete.connect(statement_import_delete_file, sender=StatementImport)
         gather_mailing_preview_context.connect(
             mailing_donation_preview_context_listener
         )
@@ -150,6 +150,7 @@ class RemoteDonationFormPlugin(CMSPluginBase):
 class DonorLogicMixin:
     module = _("Donations")
     cache = False
+    context_branching = True
     allow_children = True
     render_template = "fds_donation/cms_plugins/donor_logic.html"
 
@@ -173,6 +174,9 @@ class DonorLogicMixin:
     def should_render(self):
         raise NotImplementedError
 
+    def get_context_branch(self, context, instance):
+        return bool(self.should_render(self.add_to_context(dict(context))))
+
     def render_text(self, context, instance):
         from fragdenstaat_de.fds_mailing.utils import render_plugin_text
 
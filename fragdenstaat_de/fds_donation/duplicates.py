@@ -0,0 +1,321 @@
+"""
+Detection of duplicate donors.
+
+Donors are only compared within blocks of donors that share a blocking
+key: their confirmed email, their IBAN, the Cologne phonetic code of
+their last name with their postcode or their normalized street and
+house number with their postcode. Blocks too large to compare all pairs
+are sorted by name and street and only neighbours are compared.
+Candidate pairs are scored by trigram similarity of name and street
+like ``pg_trgm`` plus a matching postcode, the same confirmed email or
+IBAN scores highest. Pairs scoring above a threshold are
+joined into duplicate groups, which are written with bulk updates.
+Every donor of a group gets the best pair score of the group, so the
+strongest matches can be reviewed first.
+"""
+
+import logging
+import re
+import unicodedata
+import uuid
+from collections import defaultdict
+from dataclasses import dataclass, field
+from itertools import combinations
+
+from django.db import transaction
+
+from .models import Donor
+
+logger = logging.getLogger(__name__)
+
+DUPLICATE_THRESHOLD = 0.75
+# Larger blocks are too unspecific to compare all their pairs,
+# their donors are compared with this many neighbours instead
+MAX_BLOCK_SIZE = 50
+DUPLICATE_CHUNK_SIZE = 2000
+
+NAME_WEIGHT = 0.5
+STREET_WEIGHT = 0.3
+POSTCODE_WEIGHT = 0.2
+
+DONOR_FIELDS = (
+    "id",
+    "first_name",
+    "last_name",
+    "company_name",
+    "email",
+    "email_confirmed",
+    "address",
+    "postcode",
+    "attributes__iban",
+)
+
+HOUSENUMBER_PATTERN = re.compile(r"\s*(\d+\s*[a-z]?)$")
+
+# Cologne phonetics
+PHONETIC_CODES = {
+    **dict.fromkeys("aeijouy", "0"),
+    "b": "1",
+    **dict.fromkeys("fvw", "3"),
+    **dict.fromkeys("gkq", "4"),
+    "l": "5",
+    **dict.fromkeys("mn", "6"),
+    "r": "7",
+    **dict.fromkeys("sz", "8"),
+}
+C_HARD_FOLLOWERS = set("ahkoqux")
+C_HARD_FOLLOWERS_START = C_HARD_FOLLOWERS | set("lr")
+
+
+def normalize_text(value):
+    value = (value or "").lower().replace("ß", "ss")
+    value = unicodedata.normalize("NFKD", value)
+    value = "".join(c for c in value if not unicodedata.combining(c))
+    return " ".join(re.sub(r"[^a-z0-9]+", " ", value).split())
+
+
+def normalize_street(address):
+    """
+    Returns street name and house number of the first address line
+    with common abbreviations expanded.
+    """
+    street = normalize_text((address or "").split("\n")[0])
+    street = re.sub(r"str\b", "strasse", street)
+    housenumber = ""
+    match = HOUSENUMBER_PATTERN.search(street)
+    if match:
+        housenumber = match.group(1).replace(" ", "")
+        street = street[: match.start()]
+    return "{} {}".format(street, housenumber).strip()
+
+
+def get_phonetic_code(letter, previous, following, is_start):
+    if letter == "c":
+        if is_start:
+            return "4" if following in C_HARD_FOLLOWERS_START else "8"
+        if previous in ("s", "z"):
+            return "8"
+        return "4" if following in C_HARD_FOLLOWERS else "8"
+    if letter in ("d", "t"):
+        return "8" if following in ("c", "s", "z") else "2"
+    if letter == "p":
+        return "3" if following == "h" else "1"
+    if letter == "x":
+        return "8" if previous in ("c", "k", "q") else "48"
+    return PHONETIC_CODES.get(letter, "")
+
+
+def cologne_phonetic(word):
+    """
+    Returns the Cologne phonetic code of a normalized word.
+    """
+    letters = [c for c in word if "a" <= c <= "z"]
+    codes = []
+    for i, letter in enumerate(letters):
+        previous = letters[i - 1] if i > 0 else ""
+        following = letters[i + 1] if i + 1 < len(letters) else ""
+        code = get_phonetic_code(letter, previous, following, i == 0)
+        for digit in code:
+            if not codes or codes[-1] != digit:
+                codes.append(digit)
+    if not codes:
+        return ""
+    return codes[0] + "".join(c for c in codes[1:] if c != "0")
+
+
+def get_trigrams(text):
+    trigrams = set()
+    for word in text.split():
+        padded = "  {} ".format(word)
+        trigrams.update(padded[i : i + 3] for i in range(len(padded) - 2))
+    return frozenset(trigrams)
+
+
+def get_similarity(trigrams, other_trigrams):
+    if not trigrams or not other_trigrams:
+        return 0.0
+    return len(trigrams & other_trigrams) / len(trigrams | other_trigrams)
+
+
+@dataclass
+class DonorRecord:
+    id: int
+    email: str
+    iban: str
+    postcode: str
+    street: str
+    name_code: str
+    name_trigrams: frozenset
+    street_trigrams: frozenset
+    keys: list = field(default_factory=list)
+
+    @classmethod
+    def from_values(cls, values):
+        (
+            donor_id,
+            first_name,
+            last_name,
+            company_name,
+            email,
+            email_confirmed,
+            address,
+            postcode,
+            iban,
+        ) = values
+        name = normalize_text("{} {}".format(first_name, last_name))
+        if not name:
+            name = normalize_text(company_name)
+        street = normalize_street(address)
+        if email_confirmed is None:
+            # Unconfirmed emails may belong to someone else
+            email = ""
+        record = cls(
+            id=donor_id,
+            email=(email or "").strip().lower(),
+            iban=(iban or "").replace(" ", "").upper(),
+            postcode=(postcode or "").replace(" ", "").upper(),
+            street=street,
+            name_code=cologne_phonetic(name.split()[-1]) if name else "",
+            name_trigrams=get_trigrams(name),
+            street_trigrams=get_trigrams(street),
+        )
+        record.keys = record.get_blocking_keys()
+        return record
+
+    def get_blocking_keys(self):
+        keys = []
+        if self.email:
+            keys.append(("email", self.email))
+        if self.iban:
+            keys.append(("iban", self.iban))
+        if self.postcode:
+            if self.name_code:
+                keys.append(("name", self.name_code, self.postcode))
+            if self.street:
+                keys.append(("street", self.street, self.postcode))
+        return keys
+
+
+def score_pair(record, other):
+    if record.email and record.email == other.email:
+        return 1.0
+    if record.iban and record.iban == other.iban:
+        return 1.0
+    score = NAME_WEIGHT * get_similarity(record.name_trigrams, other.name_trigrams)
+    score += STREET_WEIGHT * get_similarity(
+        record.street_trigrams, other.street_trigrams
+    )
+    if record.postcode and record.postcode == other.postcode:
+        score += POSTCODE_WEIGHT
+    return round(score, 3)
+
+
+def get_neighbour_pairs(records, members):
+    members = sorted(
+        members, key=lambda index: (records[index].name_code, records[index].street)
+    )
+    for position, index in enumerate(members):
+        for other_index in members[position + 1 : position + 1 + MAX_BLOCK_SIZE]:
+            yield min(index, other_index), max(index, other_index)
+
+
+def get_candidate_pairs(records):
+    blocks = defaultdict(list)
+    for index, record in enumerate(records):
+        for key in record.keys:
+            blocks[key].append(index)
+    pairs = set()
+    for key, members in blocks.items():
+        if len(members) < 2:
+            continue
+        if len(members) <= MAX_BLOCK_SIZE:
+            pairs.update(combinations(members, 2))
+            continue
+        logger.info(
+            "Comparing %d donors sharing a %s key with their neighbours only",
+            len(members),
+            key[0],
+        )
+        pairs.update(get_neighbour_pairs(records, members))
+    return pairs
+
+
+def find_duplicate_groups(records, threshold=DUPLICATE_THRESHOLD):
+    """
+    Returns groups of duplicate donor ids with their best pair score,
+    best scores first.
+    """
+    parents = {}
+
+    def find(index):
+        root = index
+        while parents.get(root, root) != root:
+            root = parents[root]
+        while index != root:
+            parents[index], index = root, parents.get(index, index)
+        return root
+
+    best_scores = {}
+    for index, other_index in get_candidate_pairs(records):
+        score = score_pair(records[index], records[other_index])
+        if score < threshold:
+            continue
+        root, other_root = find(index), find(other_index)
+        if root != other_root:
+            parents[other_root] = root
+        best_scores[root] = max(
+            score,
+            best_scores.pop(root, 0.0),
+            best_scores.pop(other_root, 0.0),
+        )
+
+    groups = defaultdict(list)
+    for index in parents:
+        groups[find(index)].append(records[index].id)
+    for root in best_scores:
+        groups[root].append(records[root].id)
+    return sorted(
+        (
+            (sorted(set(donor_ids)), best_scores[root])
+            for root, donor_ids in groups.items()
+        ),
+        key=lambda group: (-group[1], group[0]),
+    )
+
+
+def load_donor_records(donor_ids=None):
+    donors = Donor.objects.order_by()
+    if donor_ids is not None:
+        donors = donors.filter(id__in=donor_ids)
+    return [
+        DonorRecord.from_values(values)
+        for values in donors.values_list(*DONOR_FIELDS).iterator(
+            chunk_size=DUPLICATE_CHUNK_SIZE
+        )
+    ]
+
+
+def write_duplicate_groups(groups):
+    donors = []
+    for donor_ids, score in groups:
+        duplicate = uuid.uuid4()
+        donors.extend(
+            Donor(id=donor_id, duplicate=duplicate, duplicate_score=score)
+            for donor_id in donor_ids
+        )
+    with transaction.atomic():
+        Donor.objects.bulk_update(
+            donors,
+            ["duplicate", "duplicate_score"],
+            batch_size=DUPLICATE_CHUNK_SIZE,
+        )
+    return len(donors)
+
+
+def detect_duplicate_donors(donor_ids=None, threshold=DUPLICATE_THRESHOLD):
+    """
+    Marks duplicate groups among the given or all donors and returns
+    the number of groups and donors in them.
+    """
+    groups = find_duplicate_groups(load_donor_records(donor_ids), threshold)
+    return len(groups), write_duplicate_groups(groups)
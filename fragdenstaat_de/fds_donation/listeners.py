@@ -3,7 +3,8 @@ from datetime import timedelta
 from decimal import Decimal
 
 from django.db import transaction
-from django.db.models import Max, Q, Sum
+from django.db.models import Q, Sum
+from django.db.models.functions import Lower
 from django.utils import timezone
 
 from froide_payment.models import PaymentStatus
@@ -11,7 +12,13 @@ from froide_payment.models import PaymentStatus
 from fragdenstaat_de.fds_newsletter.models import Subscriber
 
 from .forms import SubscriptionCancelFeedbackForm
-from .models import Donation, Donor, DonorEvent, Recurrence
+from .models import (
+    Donation,
+    Donor,
+    DonorEvent,
+    Recurrence,
+    update_donor_aggregates,
+)
 from .services import (
     create_donation_from_payment,
     detect_recurring_on_donor,
@@ -228,30 +235,57 @@ def remove_newsletter_subscriber(sender: Subscriber, **kwargs):
     Donor.objects.filter(subscriber=sender).update(subscriber=None)
 
 
-def tag_subscriber_donor(sender: Subscriber, email=None, **kwargs):
-    add_tags = set()
-    remove_tags = set()
-    roughly_year = timedelta(days=370)
-    high_value = 120
-    a_year_ago = timezone.now() - roughly_year
-    donor = (
-        Donor.objects.filter(
-            Q(subscriber=sender) | Q(email__iexact=email, email_confirmed__isnull=False)
+DONOR_TAG_PERIOD = timedelta(days=370)
+DONOR_HIGH_VALUE = 120
+
+
+def tag_subscribers_donor(sender, subscribers=None, **kwargs):
+    a_year_ago = timezone.now() - DONOR_TAG_PERIOD
+    subscriber_emails = {
+        s.id: s.get_email().lower() for s in subscribers if s.get_email()
+    }
+    donors = (
+        Donor.objects.annotate(email_lower=Lower("email"))
+        .filter(
+            Q(subscriber_id__in=[s.id for s in subscribers])
+            | Q(
+                email_lower__in=set(subscriber_emails.values()),
+                email_confirmed__isnull=False,
+            )
         )
         .annotate(
-            last_donation=Max(
-                "donations__timestamp",
-                filter=Q(donations__received_timestamp__isnull=False),
-            ),
             amount_last_year=Sum(
                 "donations__amount",
                 filter=Q(donations__received_timestamp__gte=a_year_ago),
             ),
         )
-        .first()
     )
-    if not donor:
-        return add_tags, remove_tags
+    # Donors are ordered by -id, keep the first match like a single lookup would
+    donors_by_subscriber = {}
+    donors_by_email = {}
+    for donor in donors:
+        if donor.subscriber_id is not None:
+            donors_by_subscriber.setdefault(donor.subscriber_id, donor)
+        if donor.email_confirmed is not None:
+            donors_by_email.setdefault(donor.email_lower, donor)
+
+    result = {}
+    for subscriber in subscribers:
+        candidates = [
+            donors_by_subscriber.get(subscriber.id),
+            donors_by_email.get(subscriber_emails.get(subscriber.id)),
+        ]
+        candidates = [d for d in candidates if d is not None]
+        if not candidates:
+            continue
+        donor = max(candidates, key=lambda d: d.id)
+        result[subscriber.id] = get_donor_tags(donor, a_year_ago)
+    return result
+
+
+def get_donor_tags(donor, a_year_ago):
+    add_tags = set()
+    remove_tags = set()
 
     add_tags.add("donor")
 
@@ -260,7 +294,10 @@ def tag_subscriber_donor(sender: Subscriber, email=None, **kwargs):
     else:
         remove_tags.add("donor:recurring")
 
-    if donor.amount_last_year is not None and donor.amount_last_year >= high_value:
+    if (
+        donor.amount_last_year is not None
+        and donor.amount_last_year >= DONOR_HIGH_VALUE
+    ):
         add_tags.add("donor:highvalue")
     else:
         remove_tags.add("donor:highvalue")
@@ -277,9 +314,34 @@ def tag_subscriber_donor(sender: Subscriber, email=None, **kwargs):
     return add_tags, remove_tags
 
 
+def donor_tag_sources_changed(sender, since=None, **kwargs):
+    boundary = timezone.now() - DONOR_TAG_PERIOD
+    # New donations, confirmed donors and donations leaving the tag period
+    donor_ids = Donation.objects.filter(
+        Q(timestamp__gt=since)
+        | Q(received_timestamp__gt=since)
+        | Q(
+            received_timestamp__gt=since - DONOR_TAG_PERIOD,
+            received_timestamp__lte=boundary,
+        )
+    ).values("donor_id")
+    donors = Donor.objects.filter(Q(id__in=donor_ids) | Q(email_confirmed__gt=since))
+    return Q(id__in=donors.values("subscriber_id")) | Q(
+        email__in=donors.filter(email_confirmed__isnull=False).values("email")
+    )
+
+
 def save_subscription_cancel_feedback(sender, data=None, **kwargs):
     if data is None:
         return
     form = SubscriptionCancelFeedbackForm(data=data)
     if form.is_valid():
         form.save(subscription=sender)
+
+
+def donation_deleted(sender, instance, **kwargs):
+    update_donor_aggregates([instance.donor_id])
+
+
+def statement_import_delete_file(sender, instance, **kwargs):
+    instance.delete_file(save=False)
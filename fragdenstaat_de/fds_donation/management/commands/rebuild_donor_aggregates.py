@@ -0,0 +1,20 @@
+from itertools import batched
+
+from django.core.management.base import BaseCommand
+
+from ...models import Donor, update_donor_aggregates
+
+
+class Command(BaseCommand):
+    help = "Recalculate stored donation aggregates of donors"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, batch_size, **kwargs):
+        donor_ids = Donor.objects.order_by("id").values_list("id", flat=True)
+        count = 0
+        for id_batch in batched(donor_ids.iterator(), batch_size):
+            update_donor_aggregates(id_batch)
+            count += len(id_batch)
+        self.stdout.write("Updated aggregates of {} donors.".format(count))
@@ -0,0 +1,78 @@
+# Generated by Django 5.2.15 on 2026-10-17 17:10
+
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+BACKFILL_SQL = """
+UPDATE fds_donation_donor AS donor
+SET amount_total = agg.amount_total,
+    donation_count = agg.donation_count,
+    last_donation = agg.last_donation,
+    amount_by_year = agg.amount_by_year
+FROM (
+    SELECT donor_id,
+        SUM(amount_sum) AS amount_total,
+        SUM(donation_count) AS donation_count,
+        MAX(last_donation) AS last_donation,
+        jsonb_object_agg(year::text, amount_sum::text) AS amount_by_year
+    FROM (
+        SELECT donor_id,
+            EXTRACT(YEAR FROM received_timestamp AT TIME ZONE %s)::int AS year,
+            SUM(amount) AS amount_sum,
+            COUNT(*) AS donation_count,
+            MAX("timestamp") AS last_donation
+        FROM fds_donation_donation
+        WHERE donor_id IS NOT NULL AND received_timestamp IS NOT NULL
+        GROUP BY 1, 2
+    ) AS years
+    GROUP BY donor_id
+) AS agg
+WHERE donor.id = agg.donor_id
+"""
+
+
+def backfill_donor_aggregates(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(BACKFILL_SQL, [settings.TIME_ZONE])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fds_donation', '0079_recentlydonatedactionconfig'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='donor',
+            name='amount_by_year',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name='donor',
+            name='amount_total',
+            field=models.DecimalField(db_index=True, decimal_places=2, default=0, max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='donor',
+            name='donation_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='donor',
+            name='last_donation',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='donor',
+            name='first_donation',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now),
+        ),
+        migrations.AlterField(
+            model_name='donor',
+            name='recurring_amount',
+            field=models.DecimalField(db_index=True, decimal_places=2, default=0, max_digits=12),
+        ),
+        migrations.RunPython(backfill_donor_aggregates, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.2.15 on 2026-10-17 18:02
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fds_donation', '0080_donor_aggregates'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StatementImport',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('banktransfer', 'bank transfers'), ('paypal', 'PayPal')], max_length=20)),
+                ('project', models.CharField(blank=True, max_length=40)),
+                ('dry_run', models.BooleanField(default=False)),
+                ('status', models.CharField(choices=[('pending', 'pending'), ('running', 'running'), ('failed', 'failed'), ('done', 'done')], default='pending', max_length=20)),
+                ('filename', models.CharField(blank=True, max_length=255)),
+                ('filepath', models.CharField(blank=True, max_length=1024)),
+                ('timestamp', models.DateTimeField(default=django.utils.timezone.now)),
+                ('started', models.DateTimeField(blank=True, null=True)),
+                ('updated', models.DateTimeField(blank=True, null=True)),
+                ('finished', models.DateTimeField(blank=True, null=True)),
+                ('rows_total', models.PositiveIntegerField(default=0)),
+                ('rows', models.PositiveIntegerField(default=0, verbose_name='rows read')),
+                ('started_rows', models.PositiveIntegerField(default=0)),
+                ('matched', models.PositiveIntegerField(default=0)),
+                ('created', models.PositiveIntegerField(default=0)),
+                ('donors_created', models.PositiveIntegerField(default=0)),
+                ('direct_debits', models.PositiveIntegerField(default=0)),
+                ('skipped', models.PositiveIntegerField(default=0)),
+                ('ambiguous', models.PositiveIntegerField(default=0)),
+                ('last_key', models.CharField(blank=True, max_length=1024)),
+                ('error', models.TextField(blank=True)),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'statement import',
+                'verbose_name_plural': 'statement imports',
+                'ordering': ('-timestamp',),
+            },
+        ),
+    ]
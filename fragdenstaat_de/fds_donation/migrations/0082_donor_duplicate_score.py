@@ -0,0 +1,18 @@
+# Generated by Django 5.2.15 on 2026-10-17 18:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fds_donation', '0081_statementimport'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='donor',
+            name='duplicate_score',
+            field=models.FloatField(blank=True, db_index=True, editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.15 on 2026-10-17 21:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fds_donation', '0082_donor_duplicate_score'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='donation',
+            index=models.Index(fields=['recurrence', 'timestamp'], name='fds_donatio_recurre_862009_idx'),
+        ),
+    ]
@@ -1,7 +1,10 @@
 import decimal
 import json
+import os
 import re
 import uuid
+from collections import defaultdict
+from dataclasses import asdict
 from datetime import date, datetime, timedelta
 from typing import Any
 from urllib.parse import urlencode
@@ -10,7 +13,8 @@ from django.conf import settings
 from django.contrib.postgres.fields import HStoreField
 from django.core.exceptions import ValidationError
 from django.db import connection, models
-from django.db.models.functions import RowNumber
+from django.db.models.fields.json import KT
+from django.db.models.functions import Cast, ExtractYear, RowNumber
 from django.urls import reverse
 from django.utils import formats, timezone
 from django.utils.formats import date_format, number_format
@@ -87,6 +91,14 @@ SALUTATION_DICT = dict(SALUTATION_CHOICES)
 DONATION_PROJECTS = getattr(settings, "DONATION_PROJECTS", [("", _("Default"))])
 DEFAULT_DONATION_PROJECT = DONATION_PROJECTS[0][0]
 
+DONOR_AGGREGATE_FIELDS = (
+    "amount_total",
+    "amount_by_year",
+    "donation_count",
+    "first_donation",
+    "last_donation",
+)
+
 PAYMENT_METHOD_ICONS = {
     "creditcard": "creditcard.svg",
     "sepa": "sepa.svg",
@@ -128,7 +140,7 @@ class Donor(models.Model):
     attributes = HStoreField(null=True, blank=True)
 
     active = models.BooleanField(default=False)
-    first_donation = models.DateTimeField(default=timezone.now)
+    first_donation = models.DateTimeField(default=timezone.now, db_index=True)
 
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.SET_NULL
@@ -148,11 +160,29 @@ class Donor(models.Model):
     )
 
     recurring_amount = models.DecimalField(
-        max_digits=12, decimal_places=settings.DEFAULT_DECIMAL_PLACES, default=0
+        max_digits=12,
+        decimal_places=settings.DEFAULT_DECIMAL_PLACES,
+        default=0,
+        db_index=True,
     )
     recurrence_streak_start = models.DateTimeField(null=True, blank=True)
     invalid = models.BooleanField(default=False)
     duplicate = models.UUIDField(editable=False, null=True, blank=True)
+    # Best pair score of the duplicate group, see fds_donation.duplicates
+    duplicate_score = models.FloatField(
+        editable=False, null=True, blank=True, db_index=True
+    )
+
+    # Aggregates of received donations, see update_donor_aggregates
+    amount_total = models.DecimalField(
+        max_digits=12,
+        decimal_places=settings.DEFAULT_DECIMAL_PLACES,
+        default=0,
+        db_index=True,
+    )
+    amount_by_year = models.JSONField(default=dict, blank=True)
+    donation_count = models.IntegerField(default=0)
+    last_donation = models.DateTimeField(null=True, blank=True, db_index=True)
 
     note = models.TextField(blank=True)
     tags = TaggableManager(through=TaggedDonor, blank=True)
@@ -166,6 +196,16 @@ class Donor(models.Model):
     def __str__(self):
         return "{} ({})".format(self.get_full_name(), self.email)
 
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get("update_fields") is None:
+            # Don't overwrite aggregates that changed since this donor was loaded
+            kwargs["update_fields"] = [
+                f.name
+                for f in self._meta.concrete_fields
+                if not f.primary_key and f.name not in DONOR_AGGREGATE_FIELDS
+            ]
+        return super().save(*args, **kwargs)
+
     def get_full_name(self):
         name = "{} {}".format(self.first_name, self.last_name).strip()
         if self.company_name and not name:
@@ -281,12 +321,6 @@ class Donor(models.Model):
             "country": self.country,
         }
 
-    @cached_property
-    def last_donation(self):
-        return self.donations.filter(received_timestamp__isnull=False).aggregate(
-            last_donation=models.Max("timestamp")
-        )["last_donation"]
-
     def update_last_login(self):
         self.last_login = timezone.now()
         self.save(update_fields=["last_login"])
@@ -307,30 +341,9 @@ class Donor(models.Model):
         Returns the start date of the current recurrence streak.
         If there are no recurrences, returns None.
         """
-        recurrences = self.recurrences.all().order_by("start_date")
-        if not recurrences:
-            return None
-        first_recurrence = recurrences[0]
-        if first_recurrence.cancel_date is None:
-            # If the first recurrence is still active, we can use its start date
-            return first_recurrence.start_date
-        if len(recurrences) == 1:
-            return None
-
-        start_date = first_recurrence.start_date
-        last_date = first_recurrence.cancel_date
-        last_interval = first_recurrence.interval
-
-        for recurrence in recurrences[1:]:
-            delta = recurrence.start_date - last_date
-            if delta > timedelta(days=int(31 * (last_interval * 1.5))):
-                start_date = recurrence.start_date
-            if recurrence.cancel_date is None:
-                return start_date
-            last_date = recurrence.cancel_date
-            last_interval = recurrence.interval
-
-        return None
+        return get_recurrence_streak_start(
+            self.recurrences.all().order_by("start_date")
+        )
 
     @cached_property
     def recently_donated(self):
@@ -365,7 +378,7 @@ class Donor(models.Model):
         """
         return self.incomplete_donations().order_by("-timestamp").first()
 
-    def get_email_context(self):
+    def get_email_context(self, donation_aggregate=None):
         context = {
             "first_name": self.first_name,
             "last_name": self.last_name,
@@ -388,17 +401,15 @@ class Donor(models.Model):
         donations = Donation.objects.filter(
             donor=self, received_timestamp__isnull=False
         )
-        aggregate = donations.aggregate(
-            amount_total=models.Sum("amount"),
-            amount_last_year=models.Sum(
-                "amount", filter=models.Q(received_timestamp__year=last_year)
-            ),
-        )
+        if donation_aggregate is None:
+            donation_aggregate = donations.aggregate(
+                **get_donation_aggregate_kwargs(last_year)
+            )
 
         context.update(
             {
-                "amount_total": aggregate["amount_total"],
-                "amount_last_year": aggregate["amount_last_year"],
+                "amount_total": donation_aggregate["amount_total"],
+                "amount_last_year": donation_aggregate["amount_last_year"],
                 "last_year": last_year,
                 "donations": donations,
             }
@@ -407,18 +418,148 @@ class Donor(models.Model):
         return context
 
 
+def get_recurrence_streak_start(recurrences):
+    """
+    Returns the start date of the current streak of recurrences
+    ordered by start date or None.
+    """
+    if not recurrences:
+        return None
+    first_recurrence = recurrences[0]
+    if first_recurrence.cancel_date is None:
+        # If the first recurrence is still active, we can use its start date
+        return first_recurrence.start_date
+    if len(recurrences) == 1:
+        return None
+
+    start_date = first_recurrence.start_date
+    last_date = first_recurrence.cancel_date
+    last_interval = first_recurrence.interval
+
+    for recurrence in recurrences[1:]:
+        delta = recurrence.start_date - last_date
+        if delta > timedelta(days=int(31 * (last_interval * 1.5))):
+            start_date = recurrence.start_date
+        if recurrence.cancel_date is None:
+            return start_date
+        last_date = recurrence.cancel_date
+        last_interval = recurrence.interval
+
+    return None
+
+
+def get_donation_aggregate_kwargs(last_year):
+    return {
+        "amount_total": models.Sum("amount"),
+        "amount_last_year": models.Sum(
+            "amount", filter=models.Q(received_timestamp__year=last_year)
+        ),
+    }
+
+
+def get_donation_aggregates(donor_ids):
+    """
+    Returns donation aggregates as used in the donor email context
+    for many donors in one query.
+    """
+    last_year = timezone.now().year - 1
+    aggregates = (
+        Donation.objects.filter(
+            donor_id__in=donor_ids, received_timestamp__isnull=False
+        )
+        .order_by()
+        .values("donor_id")
+        .annotate(**get_donation_aggregate_kwargs(last_year))
+    )
+    result = {
+        donor_id: {"amount_total": None, "amount_last_year": None}
+        for donor_id in donor_ids
+    }
+    for aggregate in aggregates:
+        result[aggregate.pop("donor_id")] = aggregate
+    return result
+
+
+def get_amount_in_year(year):
+    """
+    Expression for the stored donation amount of a donor in a year.
+    """
+    return Cast(
+        KT("amount_by_year__{}".format(int(year))),
+        models.DecimalField(
+            max_digits=12, decimal_places=settings.DEFAULT_DECIMAL_PLACES
+        ),
+    )
+
+
+def update_donor_aggregates(donor_ids):
+    """
+    Recalculates stored donation aggregates of the given donors.
+    """
+    donor_ids = {donor_id for donor_id in donor_ids if donor_id is not None}
+    if not donor_ids:
+        return
+    received = Donation.objects.filter(
+        donor_id__in=donor_ids, received_timestamp__isnull=False
+    ).order_by()
+    totals = {
+        row.pop("donor_id"): row
+        for row in received.values("donor_id").annotate(
+            amount_total=models.Sum("amount"),
+            donation_count=models.Count("id"),
+            last_donation=models.Max("timestamp"),
+        )
+    }
+    by_year = defaultdict(dict)
+    years = (
+        received.annotate(year=ExtractYear("received_timestamp"))
+        .values("donor_id", "year")
+        .annotate(amount=models.Sum("amount"))
+        .values_list("donor_id", "year", "amount")
+    )
+    for donor_id, year, amount in years:
+        by_year[donor_id][str(year)] = str(amount)
+    first_donations = dict(
+        Donation.objects.filter(donor_id__in=donor_ids)
+        .order_by()
+        .values("donor_id")
+        .annotate(first_donation=models.Min("timestamp"))
+        .values_list("donor_id", "first_donation")
+    )
+
+    donors = list(Donor.objects.filter(id__in=donor_ids).only("id", "first_donation"))
+    for donor in donors:
+        total = totals.get(donor.id, {})
+        donor.amount_total = total.get("amount_total") or decimal.Decimal(0)
+        donor.amount_by_year = by_year[donor.id]
+        donor.donation_count = total.get("donation_count", 0)
+        donor.last_donation = total.get("last_donation")
+        donor.first_donation = first_donations.get(donor.id, donor.first_donation)
+    Donor.objects.bulk_update(donors, DONOR_AGGREGATE_FIELDS)
+
+
 def update_donation_numbers(donor_id):
-    donations = Donation.objects.filter(donor_id=donor_id, completed=True).annotate(
-        new_number=models.Window(
-            expression=RowNumber(),
-            order_by=models.F("timestamp").asc(),
+    update_donors_donation_numbers([donor_id])
+
+
+def update_donors_donation_numbers(donor_ids):
+    donations = (
+        Donation.objects.filter(donor_id__in=donor_ids, completed=True)
+        .annotate(
+            new_number=models.Window(
+                expression=RowNumber(),
+                partition_by=models.F("donor_id"),
+                order_by=models.F("timestamp").asc(),
+            )
         )
+        .only("id", "number")
     )
-    # Can't call .update() directly due to Django
-    # ORM limitations, loop and update:
+    changed = []
     for d in donations:
         if d.number != d.new_number:
-            Donation.objects.filter(id=d.id).update(number=d.new_number)
+            d.number = d.new_number
+            changed.append(d)
+    Donation.objects.bulk_update(changed, ["number"])
 
 
 def get_project_choices():
@@ -656,6 +797,32 @@ class DonationManager(models.Manager):
         )
 
 
+def find_transaction_id(
+    method, identifier, payment_id=None, transaction_id=None, extra_data=None
+):
+    """
+    Finds the transaction id of a donation from the fields of the
+    donation and its payment, so exports can use ``values()`` rows.
+    """
+    if method == "paypal":
+        if payment_id:
+            if transaction_id:
+                return transaction_id
+            data = json.loads(extra_data)
+            if "paypal_resource" in data:
+                return data["paypal_resource"]["id"]
+            else:
+                return data["response"]["purchase_units"][0]["payments"]["captures"][0][
+                    "id"
+                ]
+        else:
+            return identifier
+    elif method in ("creditcard", "sepa"):
+        if payment_id:
+            return transaction_id
+    return identifier
+
+
 def get_donor_event_kinds():
     return DonorEvent.Kind.choices
 
@@ -749,14 +916,27 @@ class Donation(models.Model):
         get_latest_by = "timestamp"
         verbose_name = _("donation")
         verbose_name_plural = _("donations")
+        indexes = [
+            models.Index(fields=["recurrence", "timestamp"]),
+        ]
 
     def __str__(self):
         return "{} ({} - {})".format(self.amount, self.timestamp, self.donor)
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_donor_id = instance.__dict__.get("donor_id")
+        return instance
+
     def save(self, *args, **kwargs):
         ret = super().save(*args, **kwargs)
 
         update_donation_numbers(self.donor_id)
+        update_donor_aggregates(
+            {self.donor_id, getattr(self, "_loaded_donor_id", None)}
+        )
+        self._loaded_donor_id = self.donor_id
 
         return ret
 
@@ -813,23 +993,14 @@ class Donation(models.Model):
         return ident
 
     def find_transaction_id(self):
-        if self.method == "paypal":
-            if self.payment:
-                if self.payment.transaction_id:
-                    return self.payment.transaction_id
-                data = json.loads(self.payment.extra_data)
-                if "paypal_resource" in data:
-                    return data["paypal_resource"]["id"]
-                else:
-                    return data["response"]["purchase_units"][0]["payments"][
-                        "captures"
-                    ][0]["id"]
-            else:
-                return self.identifier
-        elif self.method in ("creditcard", "sepa"):
-            if self.payment:
-                return self.payment.transaction_id
-        return self.identifier
+        payment = self.payment
+        return find_transaction_id(
+            self.method,
+            self.identifier,
+            payment_id=self.payment_id if payment else None,
+            transaction_id=payment.transaction_id if payment else None,
+            extra_data=payment.extra_data if payment else None,
+        )
 
     @cached_property
     def payment_method_details(self) -> Any | None:
@@ -1043,6 +1214,122 @@ class DonationGiftOrder(models.Model):
             return (self.donation_gift.name, self.donation_gift.download_url)
 
 
+# Running imports without progress for this long were interrupted
+STATEMENT_IMPORT_STALE_AFTER = timedelta(minutes=30)
+# Statement files of unfinished imports are removed after this time
+STATEMENT_IMPORT_FILE_MAX_AGE = timedelta(days=7)
+
+
+class StatementImportManager(models.Manager):
+    def get_resumable(self):
+        stale = timezone.now() - STATEMENT_IMPORT_STALE_AFTER
+        return (
+            self.get_queryset()
+            .exclude(filepath="")
+            .filter(
+                models.Q(status=StatementImport.Status.FAILED)
+                | models.Q(status=StatementImport.Status.RUNNING, updated__lt=stale)
+            )
+        )
+
+    def get_expired_files(self):
+        expired = timezone.now() - STATEMENT_IMPORT_FILE_MAX_AGE
+        return (
+            self.get_queryset()
+            .exclude(filepath="")
+            .filter(
+                models.Q(updated__lt=expired)
+                | models.Q(updated__isnull=True, timestamp__lt=expired)
+            )
+        )
+
+
+class StatementImport(models.Model):
+    class Kind(models.TextChoices):
+        BANKTRANSFER = "banktransfer", _("bank transfers")
+        PAYPAL = "paypal", _("PayPal")
+
+    class Status(models.TextChoices):
+        PENDING = "pending", _("pending")
+        RUNNING = "running", _("running")
+        FAILED = "failed", _("failed")
+        DONE = "done", _("done")
+
+    kind = models.CharField(max_length=20, choices=Kind.choices)
+    project = models.CharField(max_length=40, blank=True)
+    dry_run = models.BooleanField(default=False)
+    status = models.CharField(
+        max_length=20, choices=Status.choices, default=Status.PENDING
+    )
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.SET_NULL
+    )
+    filename = models.CharField(max_length=255, blank=True)
+    filepath = models.CharField(max_length=1024, blank=True)
+    timestamp = models.DateTimeField(default=timezone.now)
+    started = models.DateTimeField(null=True, blank=True)
+    updated = models.DateTimeField(null=True, blank=True)
+    finished = models.DateTimeField(null=True, blank=True)
+
+    rows_total = models.PositiveIntegerField(default=0)
+    rows = models.PositiveIntegerField(_("rows read"), default=0)
+    # Rows read when the current run started
+    started_rows = models.PositiveIntegerField(default=0)
+    matched = models.PositiveIntegerField(default=0)
+    created = models.PositiveIntegerField(default=0)
+    donors_created = models.PositiveIntegerField(default=0)
+    direct_debits = models.PositiveIntegerField(default=0)
+    skipped = models.PositiveIntegerField(default=0)
+    ambiguous = models.PositiveIntegerField(default=0)
+    last_key = models.CharField(max_length=1024, blank=True)
+    error = models.TextField(blank=True)
+
+    objects = StatementImportManager()
+
+    class Meta:
+        verbose_name = _("statement import")
+        verbose_name_plural = _("statement imports")
+        ordering = ("-timestamp",)
+
+    def __str__(self):
+        return "{} {} ({})".format(
+            self.get_kind_display(), self.filename, self.get_status_display()
+        )
+
+    @property
+    def rows_per_second(self):
+        if self.started is None or self.updated is None:
+            return None
+        seconds = ((self.finished or self.updated) - self.started).total_seconds()
+        if seconds <= 0:
+            return None
+        return round((self.rows - self.started_rows) / seconds, 1)
+
+    def save_progress(self, stats, last_key):
+        for name, value in asdict(stats).items():
+            setattr(self, name, value)
+        self.last_key = last_key
+        self.updated = timezone.now()
+        self.save(update_fields=[*asdict(stats), "last_key", "updated"])
+
+    @property
+    def is_stale(self):
+        if self.status != self.Status.RUNNING or self.updated is None:
+            return False
+        return self.updated < timezone.now() - STATEMENT_IMPORT_STALE_AFTER
+
+    def delete_file(self, save=True):
+        if not self.filepath:
+            return
+        try:
+            os.remove(self.filepath)
+        except FileNotFoundError:
+            pass
+        self.filepath = ""
+        if save:
+            self.save(update_fields=["filepath"])
+
+
 class DonationGiftFormCMSPlugin(CMSPlugin):
     category = models.SlugField()
     next_url = models.CharField(max_length=255, blank=True)
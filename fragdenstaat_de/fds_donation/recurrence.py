@@ -1,18 +1,56 @@
+import logging
+import time
 from collections import defaultdict
 from dataclasses import dataclass
 from datetime import date, datetime, timedelta
+from decimal import Decimal
 from functools import reduce
 from typing import Optional
 
-from django.db.models import Count, Max, Q
+from django.db import transaction
+from django.db.models import Count, Exists, F, OuterRef, Q, Sum
 from django.utils import timezone
 
 from dateutil.relativedelta import relativedelta
 from froide_payment.models import Subscription
 
-from .models import RECURRING_INTERVAL_CHOICES, Donation, Donor, Recurrence
+from .models import (
+    RECURRING_INTERVAL_CHOICES,
+    Donation,
+    Donor,
+    Recurrence,
+    get_recurrence_streak_start,
+)
+from .recurrence_detection import PATTERN_RANGES, detect_streaks
 from .triggers import run_recurrence_created_trigger
 
+logger = logging.getLogger(__name__)
+
+RECURRENCE_BATCH_SIZE = 500
+RECURRENCE_TASK_SIZE = 5000
+RECURRENCE_TIME_BUDGET = timedelta(minutes=10)
+RECURRENCE_CHUNK_SIZE = 2000
+
+SUBSCRIPTION_RECURRENCE_FIELDS = (
+    "donor",
+    "active",
+    "start_date",
+    "interval",
+    "amount",
+    "method",
+    "project",
+    "cancel_date",
+)
+STREAK_RECURRENCE_FIELDS = (
+    "start_date",
+    "active",
+    "amount",
+    "project",
+    "interval",
+    "method",
+    "cancel_date",
+)
+
 
 @dataclass
 class DonationStreak:
@@ -95,6 +133,41 @@ def find_donation_streaks(
     return all_streaks
 
 
+def find_donation_streaks_batch(
+    donations: list[Donation],
+    current_date: datetime | None = None,
+) -> dict[int, list[DonationStreak]]:
+    """
+    Finds donation streaks of many donors at once with the vectorized
+    detector. Returns the same streaks as ``find_donation_streaks`` on
+    the donations of each donor, keyed by donor id.
+    """
+    donations = list(donations)
+    if current_date is None:
+        current_date = timezone.now()
+
+    streaks = detect_streaks(
+        [donation.donor_id for donation in donations],
+        [donation.amount for donation in donations],
+        [donation.method for donation in donations],
+        [donation.project for donation in donations],
+        [donation.received_timestamp for donation in donations],
+    )
+    donor_streaks = defaultdict(list)
+    for _donor_id, interval, indices in streaks:
+        streak = [donations[i] for i in indices]
+        donor_streaks[streak[0].donor_id].append(
+            DonationStreak(
+                donations=streak,
+                interval=interval,
+                project=streak[0].project,
+                method=streak[0].method,
+                canceled=get_cancel_date(streak, interval, current_date),
+            )
+        )
+    return donor_streaks
+
+
 def get_cancel_date(
     donations: list[Donation], interval: int, now: datetime
 ) -> Optional[datetime]:
@@ -129,19 +202,11 @@ def identify_recurring_patterns(
     if len(transactions) < 2:
         return {}
 
-    # Define acceptable ranges for different recurring patterns (in days)
-    # Order matters - we'll try patterns from most frequent to least frequent
-    pattern_ranges = [
-        (1, (25, 35)),  # Around 30 days
-        (3, (80, 100)),  # Around 90 days
-        (6, (170, 190)),  # Around 180 days
-        (12, (350, 380)),  # Around 365 days
-    ]
-
     # Find all possible streaks for each pattern type
+    # Order matters - we'll try patterns from most frequent to least frequent
     all_possible_streaks = {}
 
-    for pattern_type, (min_days, max_days) in pattern_ranges:
+    for pattern_type, (min_days, max_days) in PATTERN_RANGES:
         streaks = find_streaks_for_pattern(transactions, min_days, max_days)
         if streaks:
             all_possible_streaks[pattern_type] = streaks
@@ -154,7 +219,8 @@ def identify_recurring_patterns(
     for pattern_type, streaks in all_possible_streaks.items():
         selected_patterns[pattern_type] = []
 
-        # Sort streaks by length (longer streaks are preferred)
+        # Sort streaks by length (longer streaks are preferred),
+        # stable so earlier streaks win on equal length
         streaks = sorted(streaks, key=lambda s: len(s), reverse=True)
 
         for streak in streaks:
@@ -170,9 +236,9 @@ def identify_recurring_patterns(
 
 def find_streaks_for_pattern(
     transactions: list[Donation], min_days: int, max_days: int
-) -> set[list[Donation]]:
+) -> list[tuple[Donation, ...]]:
     """Find all possible streaks that match a specific pattern interval."""
-    streaks = set()
+    streaks = []
 
     # Try starting from each transaction
     for start_idx in range(len(transactions)):
@@ -194,107 +260,243 @@ def find_streaks_for_pattern(
 
         # Only keep streaks with at least 2 transactions
         if len(current_streak) >= 2:
-            streaks.add(tuple(current_streak))
+            streaks.append(tuple(current_streak))
 
     return streaks
 
 
 def process_recurrence_on_donor(donor: Donor, current_date: datetime | None = None):
-    # Includes completed but pending donations
-    donations = Donation.objects.filter(
-        donor=donor, completed=True, order__subscription__isnull=False
-    ).order_by("received_timestamp", "timestamp")
-    if donations:
-        process_subscription_donations(donor, donations, current_date)
-
-    donations = Donation.objects.filter(
-        donor=donor,
-        completed=True,
-        received_timestamp__isnull=False,
-    ).filter(Q(method="banktransfer") | Q(method="paypal", order__isnull=True))
-    if donations:
-        process_donations(donor, donations, current_date)
-
-    update_fields = []
-    recurring_amount = donor.calculate_recurring_amount()
-    if recurring_amount != donor.recurring_amount:
-        donor.recurring_amount = recurring_amount
-        update_fields.append("recurring_amount")
-    streak_start = donor.get_recurrence_streak_start_date()
-    if streak_start != donor.recurrence_streak_start:
-        donor.recurrence_streak_start = streak_start
-        update_fields.append("recurrence_streak_start")
-    if update_fields:
-        donor.save(update_fields=update_fields)
-        run_recurrence_created_trigger(obj=donor)
-
-
-def process_subscription_donations(
-    donor: Donor, donations, current_date: datetime | None = None
-):
-    subscriptions = defaultdict(list)
-    for donation in donations:
-        subscriptions[donation.order.subscription].append(donation)
+    RecurrenceReconciler([donor.id], current_date=current_date).run()
+    donor.refresh_from_db(fields=["recurring_amount", "recurrence_streak_start"])
 
-    for subscription, subscription_donations in subscriptions.items():
-        recurrence = create_recurrence_for_subscription(
-            donor, subscription, subscription_donations, current_date
-        )
-        Donation.objects.filter(
-            id__in=[donation.id for donation in subscription_donations]
-        ).update(recurrence=recurrence)
-
-
-def process_donations(donor: Donor, donations, current_date: datetime | None = None):
-    streaks = find_donation_streaks(donations, current_date)
-
-    streak_donations = set()
-
-    for streak in streaks:
-        existing_recurrences = set()
-        missing_recurrences = set()
-        streak_donations |= set(streak.donations)
-        for donation in streak.donations:
-            if donation.recurrence:
-                existing_recurrences.add(donation.recurrence)
-            else:
-                missing_recurrences.add(donation)
-        # Determine the correct recurrence for the streak
-        if not existing_recurrences:
-            recurrence = create_recurrence_for_streak(streak)
-        elif len(existing_recurrences) == 1:
-            # Get the single element from set
-            recurrence = next(iter(existing_recurrences))
-        else:
-            # Multiple recurrences found, we need to create a new one
-            recurrence, other_recurrences = combine_existing_recurrences(
-                existing_recurrences
+
+def get_recurrence_donations(donor_ids):
+    """
+    Donations of subscriptions and donations for streak detection
+    in one query. Includes completed but pending donations.
+    """
+    return (
+        Donation.objects.filter(donor_id__in=donor_ids, completed=True)
+        .filter(
+            Q(order__subscription__isnull=False)
+            | (
+                Q(received_timestamp__isnull=False)
+                & (Q(method="banktransfer") | Q(method="paypal", order__isnull=True))
             )
-            Donation.objects.filter(
-                id__in=[donation.id for donation in streak.donations]
-            ).filter(recurrence__in=other_recurrences).update(recurrence=recurrence)
-
-        if existing_recurrences:
-            update_recurrence(recurrence, streak)
-
-        if missing_recurrences:
-            Donation.objects.filter(
-                id__in=[donation.id for donation in streak.donations]
-            ).update(recurrence=recurrence)
-
-    # Remove recurrence from selected donations not detected as streaks if they don't have a subscription
-    donations.filter(
-        recurrence__isnull=False, order__subscription__isnull=True
-    ).exclude(id__in=[donation.id for donation in streak_donations]).update(
-        recurrence=None
+        )
+        .select_related("order__subscription__plan")
+        .order_by("received_timestamp", "timestamp", "id")
     )
-    # Remove recurrences that have no donations associated
-    Recurrence.objects.filter(donor=donor).annotate(
-        donation_count=Count("donations", distinct=True)
-    ).filter(donation_count=0).delete()
 
 
-def update_recurrence(recurrence: Recurrence, streak: DonationStreak):
+def get_subscription(donation: Donation) -> Subscription | None:
+    if donation.order_id is None:
+        return None
+    return donation.order.subscription
+
+
+def is_streak_candidate(donation: Donation) -> bool:
+    if donation.received_timestamp is None:
+        return False
+    return donation.method == "banktransfer" or (
+        donation.method == "paypal" and donation.order_id is None
+    )
+
+
+class RecurrenceReconciler:
+    """
+    Detects recurrences of a batch of donors and writes the changes in
+    bulk. Recurrences of subscriptions are updated first, then streaks
+    of bank transfers and PayPal donations are matched to recurrences.
+    """
+
+    def __init__(self, donor_ids, current_date: datetime | None = None):
+        self.donor_ids = list(donor_ids)
+        if current_date is None:
+            current_date = timezone.now()
+        self.current_date = current_date
+        self.donations = []
+        # Recurrence id of each donation after reconciling
+        self.recurrence_ids = {}
+
+    def run(self):
+        with transaction.atomic():
+            self.donations = list(
+                get_recurrence_donations(self.donor_ids).iterator(
+                    chunk_size=RECURRENCE_CHUNK_SIZE
+                )
+            )
+            self.recurrence_ids = {d.id: d.recurrence_id for d in self.donations}
+            self.reconcile_subscriptions()
+            streak_donor_ids = self.reconcile_streaks()
+            self.save_donations()
+            if streak_donor_ids:
+                # Remove recurrences that have no donations associated
+                Recurrence.objects.filter(donor_id__in=streak_donor_ids).annotate(
+                    donation_count=Count("donations", distinct=True)
+                ).filter(donation_count=0).delete()
+            changed_donors = self.update_donors()
+        for donor in changed_donors:
+            run_recurrence_created_trigger(obj=donor)
+
+    def reconcile_subscriptions(self):
+        subscription_donations = defaultdict(list)
+        subscriptions = {}
+        for donation in self.donations:
+            subscription = get_subscription(donation)
+            if subscription is not None:
+                key = (donation.donor_id, subscription.id)
+                subscription_donations[key].append(donation)
+                subscriptions[subscription.id] = subscription
+        if not subscriptions:
+            return
+
+        recurrences = {
+            recurrence.subscription_id: recurrence
+            for recurrence in Recurrence.objects.filter(
+                subscription_id__in=subscriptions
+            )
+        }
+        existing = list(recurrences.values())
+        new_recurrences = []
+        for (donor_id, subscription_id), donations in subscription_donations.items():
+            recurrence = recurrences.get(subscription_id)
+            if recurrence is None:
+                recurrence = Recurrence(subscription_id=subscription_id)
+                recurrences[subscription_id] = recurrence
+                new_recurrences.append(recurrence)
+            defaults = get_subscription_recurrence_defaults(
+                subscriptions[subscription_id], donations, self.current_date
+            )
+            recurrence.donor_id = donor_id
+            for key, value in defaults.items():
+                setattr(recurrence, key, value)
+
+        Recurrence.objects.bulk_create(new_recurrences)
+        Recurrence.objects.bulk_update(existing, SUBSCRIPTION_RECURRENCE_FIELDS)
+        for (_donor_id, subscription_id), donations in subscription_donations.items():
+            for donation in donations:
+                self.recurrence_ids[donation.id] = recurrences[subscription_id].id
+
+    def reconcile_streaks(self) -> set[int]:
+        """
+        Returns ids of donors with donations for streak detection.
+        """
+        donations = [d for d in self.donations if is_streak_candidate(d)]
+        if not donations:
+            return set()
+
+        recurrences = Recurrence.objects.in_bulk(
+            {self.recurrence_ids[d.id] for d in donations} - {None}
+        )
+        streak_donation_ids = set()
+        new_streaks = []
+        changed = {}
+        for streaks in find_donation_streaks_batch(
+            donations, self.current_date
+        ).values():
+            for streak in streaks:
+                streak_donation_ids |= {d.id for d in streak.donations}
+                existing_ids = {self.recurrence_ids[d.id] for d in streak.donations} - {
+                    None
+                }
+                if not existing_ids:
+                    new_streaks.append(
+                        (Recurrence(**get_streak_recurrence_kwargs(streak)), streak)
+                    )
+                    continue
+                # Combine multiple recurrences into the oldest one
+                recurrence = recurrences[min(existing_ids)]
+                if apply_streak_to_recurrence(recurrence, streak):
+                    changed[recurrence.id] = recurrence
+                for donation in streak.donations:
+                    self.recurrence_ids[donation.id] = recurrence.id
+
+        Recurrence.objects.bulk_create([recurrence for recurrence, _s in new_streaks])
+        for recurrence, streak in new_streaks:
+            for donation in streak.donations:
+                self.recurrence_ids[donation.id] = recurrence.id
+        Recurrence.objects.bulk_update(changed.values(), STREAK_RECURRENCE_FIELDS)
+
+        # Remove recurrence from donations not detected as streaks
+        # if they don't have a subscription
+        for donation in donations:
+            if donation.id in streak_donation_ids:
+                continue
+            if get_subscription(donation) is None:
+                self.recurrence_ids[donation.id] = None
+        return {d.donor_id for d in donations}
+
+    def save_donations(self):
+        changed = []
+        for donation in self.donations:
+            recurrence_id = self.recurrence_ids[donation.id]
+            if donation.recurrence_id != recurrence_id:
+                donation.recurrence_id = recurrence_id
+                changed.append(donation)
+        Donation.objects.bulk_update(changed, ["recurrence"])
+
+    def update_donors(self) -> list[Donor]:
+        recurring_amounts = dict(
+            Recurrence.objects.filter(
+                donor_id__in=self.donor_ids, cancel_date__isnull=True
+            )
+            .order_by()
+            .values("donor_id")
+            .annotate(total=Sum(F("amount") / F("interval")))
+            .values_list("donor_id", "total")
+        )
+        donor_recurrences = defaultdict(list)
+        for recurrence in Recurrence.objects.filter(
+            donor_id__in=self.donor_ids
+        ).order_by("start_date"):
+            donor_recurrences[recurrence.donor_id].append(recurrence)
+
+        changed = []
+        for donor in Donor.objects.filter(id__in=self.donor_ids):
+            recurring_amount = recurring_amounts.get(donor.id) or Decimal("0.00")
+            streak_start = get_recurrence_streak_start(donor_recurrences[donor.id])
+            if (
+                recurring_amount != donor.recurring_amount
+                or streak_start != donor.recurrence_streak_start
+            ):
+                donor.recurring_amount = recurring_amount
+                donor.recurrence_streak_start = streak_start
+                changed.append(donor)
+        Donor.objects.bulk_update(
+            changed, ["recurring_amount", "recurrence_streak_start"]
+        )
+        return changed
+
+
+def process_recurrence_batches(
+    donor_ids,
+    current_date: datetime | None = None,
+    batch_size=RECURRENCE_BATCH_SIZE,
+    time_budget: timedelta | None = RECURRENCE_TIME_BUDGET,
+) -> list[int]:
+    """
+    Reconciles recurrences of donors in batches. Returns the donor ids
+    that were not processed because the time budget ran out.
+    """
+    donor_ids = list(donor_ids)
+    deadline = None
+    if time_budget is not None:
+        deadline = time.monotonic() + time_budget.total_seconds()
+    for start in range(0, len(donor_ids), batch_size):
+        if deadline is not None and time.monotonic() > deadline:
+            logger.info("Recurrence reconciliation stopped after time budget")
+            return donor_ids[start:]
+        batch = donor_ids[start : start + batch_size]
+        RecurrenceReconciler(batch, current_date=current_date).run()
+    return []
+
+
+def apply_streak_to_recurrence(recurrence: Recurrence, streak: DonationStreak):
+    """
+    Updates recurrence attributes from the streak and returns
+    the changed fields.
+    """
     changed = []
     if recurrence.start_date != streak.donations[0].received_timestamp:
         recurrence.start_date = streak.donations[0].received_timestamp
@@ -317,12 +519,10 @@ def update_recurrence(recurrence: Recurrence, streak: DonationStreak):
     if recurrence.cancel_date != streak.canceled:
         recurrence.cancel_date = streak.canceled
         changed.append("cancel_date")
-    if changed:
-        recurrence.save(update_fields=changed)
+    return changed
 
 
-def create_recurrence_for_subscription(
-    donor: Donor,
+def get_subscription_recurrence_defaults(
     subscription: Subscription,
     donations: list[Donation],
     current_date: datetime | None = None,
@@ -340,27 +540,18 @@ def create_recurrence_for_subscription(
         if cancel_date and cancel_date < subscription.created:
             cancel_date = subscription.created
 
-    recurrence, _updated = Recurrence.objects.update_or_create(
-        subscription=subscription,
-        defaults={
-            "donor": donor,
-            "active": active,
-            "start_date": subscription.created,
-            "interval": subscription.plan.interval,
-            "amount": subscription.plan.amount,
-            "method": method,
-            "project": donations[0].project,
-            "cancel_date": subscription.canceled or cancel_date,
-        },
-    )
-    return recurrence
+    return {
+        "active": active,
+        "start_date": subscription.created,
+        "interval": subscription.plan.interval,
+        "amount": subscription.plan.amount,
+        "method": method,
+        "project": donations[0].project,
+        "cancel_date": subscription.canceled or cancel_date,
+    }
 
 
-def create_recurrence_for_streak(streak: DonationStreak):
-    """
-    Create a recurrence for the given donation streak.
-    This function should be implemented to handle the creation logic.
-    """
+def get_streak_recurrence_kwargs(streak: DonationStreak):
     first_donation = streak.donations[0]
     last_donation = streak.donations[-1]
     cancel_date = (
@@ -368,29 +559,15 @@ def create_recurrence_for_streak(streak: DonationStreak):
         if streak.canceled
         else None
     )
-    return Recurrence.objects.create(
-        donor=first_donation.donor,
-        method=streak.method,
-        project=streak.project,
-        start_date=first_donation.received_timestamp,
-        interval=streak.interval,
-        amount=last_donation.amount,
-        cancel_date=cancel_date,
-    )
-
-
-def combine_existing_recurrences(
-    duplicate_recurrences: set[Recurrence],
-) -> tuple[Recurrence, list[Recurrence]]:
-    """
-    Combine multiple existing recurrences into one.
-    """
-
-    recurrences = list(duplicate_recurrences)
-    first_recurrence = recurrences[0]
-    other_recurrences = recurrences[1:]
-
-    return first_recurrence, other_recurrences
+    return {
+        "donor_id": first_donation.donor_id,
+        "method": streak.method,
+        "project": streak.project,
+        "start_date": first_donation.received_timestamp,
+        "interval": streak.interval,
+        "amount": last_donation.amount,
+        "cancel_date": cancel_date,
+    }
 
 
 def get_known_until_date(now=None) -> date:
@@ -405,32 +582,47 @@ def get_late_recurrences(now=None):
     if now is None:
         now = timezone.now()
     known_until = get_known_until_date(now)
-    # Check if last donation was before the known until date
-    # minus the interval.
+    received_donations = Donation.objects.filter(
+        recurrence=OuterRef("pk"), received_timestamp__isnull=False
+    )
+    # Late if there is no donation after the known until date
+    # minus the interval, uses the donation recurrence timestamp index.
     queries = [
-        Q(last_date__date__lt=known_until - relativedelta(months=interval))
-        & Q(interval=interval)
+        Q(interval=interval)
+        & ~Exists(
+            received_donations.filter(
+                timestamp__gte=timezone.make_aware(
+                    datetime.combine(
+                        known_until - relativedelta(months=interval),
+                        datetime.min.time(),
+                    )
+                )
+            )
+        )
         for interval, _ in RECURRING_INTERVAL_CHOICES
     ]
     query = reduce(lambda a, b: a | b, queries)
 
     return (
         Recurrence.objects.filter(cancel_date__isnull=True)
-        .annotate(
-            last_date=Max(
-                "donations__timestamp",
-                filter=Q(donations__received_timestamp__isnull=False),
-            )
-        )
+        .filter(Exists(received_donations))
         .filter(query)
     )
 
 
+def get_late_donor_ids(now=None) -> list[int]:
+    return list(
+        get_late_recurrences(now)
+        .filter(donor__isnull=False)
+        .order_by()
+        .values_list("donor_id", flat=True)
+        .distinct()
+    )
+
+
 def check_late_recurring_donors(now=None):
     if now is None:
         now = timezone.now()
-    late_donors = Donor.objects.filter(
-        recurrences__in=get_late_recurrences(now)
-    ).distinct()
-    for donor in late_donors:
-        process_recurrence_on_donor(donor, current_date=now)
+    process_recurrence_batches(
+        get_late_donor_ids(now), current_date=now, time_budget=None
+    )
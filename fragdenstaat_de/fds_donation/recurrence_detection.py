@@ -0,0 +1,262 @@
+"""
+Vectorized detection of recurring donation streaks.
+
+Works on flat arrays of (donor, amount, method, project, received
+timestamp) so that the donations of many donors are processed in one
+batch. Donations are grouped by donor, amount, method and project and
+sorted by received timestamp. For every interval pattern each donation
+links to the first later donation of its group at least the minimum
+number of days apart, if that donation is within the maximum. A streak
+is the path along these links, which is what ``find_streaks_for_pattern``
+builds by scanning forward from each donation.
+
+Streaks are selected greedily per group like
+``identify_recurring_patterns``: patterns from shortest to longest
+interval, longer streaks first, earlier starts first on equal length and
+no donation in more than one streak. Only a donation without an unused
+predecessor can start a selected streak and streaks ending in the same
+donation overlap, so the selection reduces to picking the best such
+start for every path end.
+"""
+
+from dataclasses import dataclass
+from datetime import UTC, datetime, timedelta
+
+import numpy as np
+
+# Interval in months and acceptable days between donations.
+# Order matters, shorter intervals are selected first.
+PATTERN_RANGES = (
+    (1, (25, 35)),
+    (3, (80, 100)),
+    (6, (170, 190)),
+    (12, (350, 380)),
+)
+
+DAY_MICROSECONDS = 24 * 60 * 60 * 1_000_000
+EPOCH = datetime(1970, 1, 1, tzinfo=UTC)
+ONE_MICROSECOND = timedelta(microseconds=1)
+
+
+@dataclass
+class StreakArrays:
+    """
+    Detected streaks in output order.
+
+    Donations of streak ``i`` are ``indices[offsets[i]:offsets[i + 1]]``
+    as positions in the input arrays.
+    """
+
+    donor_ids: np.ndarray
+    intervals: np.ndarray
+    offsets: np.ndarray
+    indices: np.ndarray
+
+    def __len__(self):
+        return len(self.intervals)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield (
+                self.donor_ids[i],
+                int(self.intervals[i]),
+                self.indices[self.offsets[i] : self.offsets[i + 1]],
+            )
+
+
+def to_microseconds(timestamps) -> np.ndarray:
+    """
+    Converts aware datetimes or a datetime64 array to microseconds
+    since the epoch.
+    """
+    if isinstance(timestamps, np.ndarray) and timestamps.dtype.kind == "M":
+        return timestamps.astype("datetime64[us]").astype(np.int64)
+    return np.fromiter(
+        ((ts - EPOCH) // ONE_MICROSECOND for ts in timestamps),
+        dtype=np.int64,
+        count=len(timestamps),
+    )
+
+
+def factorize(values) -> np.ndarray:
+    return np.unique(np.asarray(values), return_inverse=True)[1].reshape(-1)
+
+
+def get_groups(keys: list[np.ndarray]) -> np.ndarray:
+    """
+    Returns group numbers of rows sorted by ``keys``.
+    """
+    changed = np.zeros(len(keys[0]), dtype=bool)
+    changed[0] = True
+    for key in keys:
+        changed[1:] |= key[1:] != key[:-1]
+    return np.cumsum(changed) - 1
+
+
+def find_next(
+    timestamps: np.ndarray, group_ends: np.ndarray, min_days: int, max_days: int
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Links each donation to the first donation of its group at least
+    ``min_days`` later. The link is valid if that donation is less than
+    ``max_days + 1`` days later, matching the whole days of a timedelta.
+    Rows must be sorted by group and timestamp, ``group_ends`` holds the
+    end position of each row's group.
+    """
+    n = len(timestamps)
+    targets = timestamps + min_days * DAY_MICROSECONDS
+    # Binary search within the group of every row at once
+    low = np.arange(1, n + 1)
+    high = group_ends.copy()
+    active = np.flatnonzero(low < high)
+    while len(active):
+        middle = (low[active] + high[active]) // 2
+        before = timestamps[middle] < targets[active]
+        low[active[before]] = middle[before] + 1
+        high[active[~before]] = middle[~before]
+        active = active[low[active] < high[active]]
+
+    valid = low < group_ends
+    candidate = np.minimum(low, n - 1)
+    valid &= timestamps[candidate] - timestamps < (max_days + 1) * DAY_MICROSECONDS
+    return np.where(valid, low, np.arange(n)), valid
+
+
+def follow_paths(
+    next_index: np.ndarray, valid: np.ndarray, used: np.ndarray
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Returns path end, number of donations and whether a used donation
+    is on the path for every donation by pointer doubling.
+    """
+    jump = next_index.copy()
+    steps = valid.astype(np.int64)
+    blocked = used.copy()
+    while True:
+        next_jump = jump[jump]
+        if np.array_equal(next_jump, jump):
+            break
+        # Ranges [i, jump[i]) and [jump[i], jump[jump[i]]) are disjoint
+        blocked = blocked | blocked[jump]
+        steps = steps + steps[jump]
+        jump = next_jump
+    blocked |= used[jump]
+    return jump, steps + 1, blocked
+
+
+def select_streaks(
+    next_index: np.ndarray, valid: np.ndarray, used: np.ndarray
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Greedily selects non-overlapping streaks of one pattern.
+    Returns start and length of the selected streaks.
+    """
+    n = len(next_index)
+    ends, lengths, blocked = follow_paths(next_index, valid, used)
+    has_predecessor = np.zeros(n, dtype=bool)
+    has_predecessor[next_index[valid & ~used]] = True
+    starts = np.flatnonzero(valid & ~used & ~has_predecessor & ~blocked)
+    if not len(starts):
+        return starts, starts
+    # Best start per path end: longest path, then earliest start
+    order = np.lexsort((starts, -lengths[starts], ends[starts]))
+    starts = starts[order]
+    best = np.ones(len(starts), dtype=bool)
+    best[1:] = ends[starts][1:] != ends[starts][:-1]
+    starts = starts[best]
+    return starts, lengths[starts]
+
+
+def detect_streaks(donor_ids, amounts, methods, projects, received) -> StreakArrays:
+    """
+    Finds recurring donation streaks of all donors in one batch.
+
+    Arguments are sequences of equal length, ``received`` holds aware
+    datetimes or a datetime64 array. Streaks are ordered per donor like
+    ``identify_recurring_patterns`` results within
+    ``find_donation_streaks``: by first appearance of their amount
+    group, pattern, length and start.
+    """
+    n = len(donor_ids)
+    donor_ids = np.asarray(donor_ids)
+    if n == 0:
+        empty = np.zeros(0, dtype=np.int64)
+        return StreakArrays(donor_ids[:0], empty, np.zeros(1, dtype=np.int64), empty)
+
+    timestamps = to_microseconds(received)
+    keys = [
+        factorize(donor_ids),
+        factorize(amounts),
+        factorize(methods),
+        factorize(projects),
+    ]
+    # Stable by input position on equal timestamps like sorted()
+    order = np.lexsort((np.arange(n), timestamps, *reversed(keys)))
+    groups = get_groups([key[order] for key in keys])
+    timestamps = timestamps[order]
+
+    group_ends = np.searchsorted(groups, groups, side="right")
+    used = np.zeros(n, dtype=bool)
+    links = {}
+    selected_starts = []
+    selected_lengths = []
+    selected_ranks = []
+    for rank, (_interval, (min_days, max_days)) in enumerate(PATTERN_RANGES):
+        next_index, valid = find_next(timestamps, group_ends, min_days, max_days)
+        starts, lengths = select_streaks(next_index, valid, used)
+        if not len(starts):
+            continue
+        links[rank] = next_index, valid
+        selected_starts.append(starts)
+        selected_lengths.append(lengths)
+        selected_ranks.append(np.full(len(starts), rank))
+        # Mark donations of selected streaks as used
+        current = starts
+        while len(current):
+            used[current] = True
+            current = next_index[current[valid[current]]]
+
+    if not links:
+        empty = np.zeros(0, dtype=np.int64)
+        return StreakArrays(donor_ids[:0], empty, np.zeros(1, dtype=np.int64), empty)
+
+    starts = np.concatenate(selected_starts)
+    lengths = np.concatenate(selected_lengths)
+    ranks = np.concatenate(selected_ranks)
+
+    # Groups of a donor are ordered by their first donation
+    first = np.searchsorted(groups, groups[starts], side="left")
+    streak_order = np.lexsort(
+        (
+            starts,
+            -lengths,
+            ranks,
+            order[first],
+            timestamps[first],
+            keys[0][order][starts],
+        )
+    )
+    starts = starts[streak_order]
+    lengths = lengths[streak_order]
+    ranks = ranks[streak_order]
+
+    offsets = np.zeros(len(starts) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    indices = np.empty(offsets[-1], dtype=np.int64)
+    for rank, (next_index, valid) in links.items():
+        mask = ranks == rank
+        current = starts[mask]
+        position = offsets[:-1][mask]
+        while len(current):
+            indices[position] = current
+            more = valid[current]
+            current = next_index[current[more]]
+            position = position[more] + 1
+
+    intervals = np.array([interval for interval, _days in PATTERN_RANGES])
+    return StreakArrays(
+        donor_ids=donor_ids[order][starts],
+        intervals=intervals[ranks],
+        offsets=offsets,
+        indices=order[indices],
+    )
@@ -1,6 +1,7 @@
 import logging
 from datetime import timedelta
 from decimal import Decimal
+from itertools import batched
 from typing import Optional, Tuple
 from urllib.parse import urlencode
 
@@ -21,7 +22,8 @@ from froide.helper.utils import update_query_params
 from fragdenstaat_de.fds_newsletter.utils import subscribe_to_default_newsletter
 
 from .models import Donation, Donor
-from .tasks import process_recurrence_task
+from .recurrence import RECURRENCE_TASK_SIZE
+from .tasks import process_recurrence_batch_task, process_recurrence_task
 from .utils import (
     get_email_change_token,
     merge_donor_list,
@@ -462,6 +464,14 @@ def detect_recurring_on_donor(donor):
     transaction.on_commit(lambda: process_recurrence_task.delay(donor.id))
 
 
+def detect_recurring_on_donors(donor_ids):
+    donor_ids = sorted(donor_ids)
+    for batch in batched(donor_ids, RECURRENCE_TASK_SIZE):
+        transaction.on_commit(
+            lambda batch=batch: process_recurrence_batch_task.delay(list(batch))
+        )
+
+
 def send_donation_reminder_email(donation):
     if donation.received_timestamp:
         return
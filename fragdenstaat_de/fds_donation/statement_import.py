@@ -0,0 +1,677 @@
+"""
+Bulk import of bank transfer and PayPal statements.
+
+Statement rows are normalized with vectorized pandas operations. The
+donations, payments and donors that rows can match are loaded for the
+whole statement with IN queries on transfer identifiers, transfer codes,
+IBANs, sale ids and emails and indexed in memory. Rows are matched
+against these indexes in statement order, new donors and donations are
+written with bulk inserts and changed ones with bulk updates.
+
+Statements are imported in chunks of rows with one transaction per
+chunk. Progress of an import run is stored on a ``StatementImport``
+after every chunk, so a failed run can resume after its last chunk.
+"""
+
+import math
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass, fields
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+import pandas as pd
+from froide_payment.models import Payment, PaymentStatus
+from froide_payment.provider.banktransfer import find_transfer_code
+
+from .models import (
+    Donation,
+    Donor,
+    StatementImport,
+    update_donor_aggregates,
+    update_donors_donation_numbers,
+)
+from .services import create_donation_from_payment, detect_recurring_on_donors
+
+BLOCK_LIST = {"Stripe Payments UK Ltd", "Stripe Technology Europe Ltd", "Stripe"}
+DEBIT_PATTERN = r" \(P(\d+)\)"
+PAYPAL_PAYMENT_BUFFER = timedelta(minutes=5)
+IMPORT_CHUNK_SIZE = 1000
+
+BANKTRANSFER_COLUMNS = {
+    "Betrag": "amount",
+    "Datum": "date_received",
+    "Wertstellung": "date",
+    "Name": "name",
+    "Verwendungszweck": "reference",
+    "Konto": "iban",
+    "Bank": "bic",
+    "Purpose": "purpose",
+}
+PAYPAL_COLUMNS = {
+    "Transaktionscode": "sale_id",
+    "Zugehöriger Transaktionscode": "subscription_id",
+    "Name": "name",
+    "Ländervorwahl": "country",
+    "Adresszeile 1": "address",
+    "Adresszusatz": "address2",
+    "Ort": "city",
+    "PLZ": "postcode",
+    "Hinweis": "note",
+    "Absender E-Mail-Adresse": "paypal_email",
+}
+PAYPAL_EMPTY_COLUMNS = (
+    "country",
+    "address",
+    "address2",
+    "city",
+    "note",
+    "postcode",
+    "subscription_id",
+)
+BANKTRANSFER_DONATION_FIELDS = [
+    "project",
+    "identifier",
+    "amount",
+    "amount_received",
+    "received_timestamp",
+    "purpose",
+    "method",
+    "completed",
+]
+
+
+@dataclass
+class ImportStats:
+    rows: int = 0
+    matched: int = 0
+    created: int = 0
+    donors_created: int = 0
+    direct_debits: int = 0
+    skipped: int = 0
+    ambiguous: int = 0
+
+
+def to_decimal(series):
+    return series.astype(str).map(Decimal)
+
+
+def split_name(name):
+    names = name.strip().rsplit(" ", 1)
+    return " ".join(names[:-1]), " ".join(names[-1:])
+
+
+def set_donor_iban(donor, iban, reference):
+    """
+    Records ``iban`` and the transfer ``reference`` in the donor's
+    attributes without saving.
+    """
+    if not donor.attributes:
+        donor.attributes = donor.attributes or {}
+    if "ibans" not in donor.attributes:
+        donor.attributes["ibans"] = []
+    elif not isinstance(donor.attributes["ibans"], list):
+        donor.attributes["ibans"] = [donor.attributes["ibans"]]
+    if "iban" in donor.attributes:
+        if donor.attributes["iban"] not in donor.attributes["ibans"]:
+            donor.attributes["ibans"].append(donor.attributes["iban"])
+    if pd.notnull(iban):
+        if iban not in donor.attributes["ibans"]:
+            donor.attributes["ibans"].append(iban)
+        donor.attributes["iban"] = iban
+    donor.attributes["banktransfer_reference"] = reference
+
+
+def normalize_banktransfers(df):
+    df = df.rename(columns=BANKTRANSFER_COLUMNS)
+    df = df.dropna(subset=["date_received"])
+    df["reference"] = df["reference"].fillna("").astype(str)
+    if "purpose" in df.columns:
+        df["purpose"] = df["purpose"].fillna("")
+    else:
+        df["purpose"] = ""
+    df["date_received"] = df["date_received"].dt.tz_localize(settings.TIME_ZONE)
+    if "date" in df.columns:
+        df["date"] = df["date"].dt.tz_localize(settings.TIME_ZONE)
+    else:
+        df["date"] = pd.NaT
+    # Statement date, reference, IBAN and row number identify a transfer
+    df["transfer_ident"] = (
+        df["date_received"].dt.strftime("%Y-%m-%d")
+        + "-"
+        + df["reference"]
+        + "-"
+        + df["iban"].map(str)
+        + "-"
+        + df.index.to_series().astype(str)
+    )
+    df["iban"] = df["iban"].astype(object).where(df["iban"].notnull(), None)
+    df["date"] = df["date"].astype(object).where(df["date"].notnull(), None)
+    df["amount"] = to_decimal(df["amount"])
+    df["blocked"] = df["name"].isin(BLOCK_LIST)
+    df["debit_payment_id"] = pd.to_numeric(
+        df["reference"].str.extract(DEBIT_PATTERN, expand=False)
+    )
+    df["transfer_code"] = df["reference"].map(find_transfer_code)
+    return df
+
+
+def read_banktransfers(xls_file):
+    return normalize_banktransfers(pd.read_excel(xls_file))
+
+
+def normalize_paypal(df):
+    df["date"] = pd.to_datetime(
+        df["Datum"] + " " + df["Uhrzeit"], format="%d.%m.%Y %H:%M:%S"
+    ).dt.tz_localize(settings.TIME_ZONE)
+    df["amount"] = pd.to_numeric(
+        df["Brutto"].str.replace(".", "").str.replace(",", ".")
+    )
+    df["amount_received"] = pd.to_numeric(
+        df["Netto"].str.replace(".", "").str.replace(",", ".")
+    )
+    df = df.rename(columns=PAYPAL_COLUMNS)
+    df = df.query('`Auswirkung auf Guthaben` == "Haben"').copy()
+    for column in PAYPAL_EMPTY_COLUMNS:
+        df[column] = df[column].fillna("")
+    df["address"] = (
+        df["address"].astype(str) + " " + df["address2"].astype(str)
+    ).str.strip()
+    df["postcode"] = df["postcode"].astype(str)
+    df["amount"] = to_decimal(df["amount"])
+    df["amount_received"] = to_decimal(df["amount_received"])
+    return df
+
+
+def read_paypal(csv_file):
+    return normalize_paypal(pd.read_csv(csv_file))
+
+
+class StatementImporter:
+    """
+    Imports a normalized statement in chunks of rows.
+
+    Every chunk is matched against indexes that grow with each chunk and
+    is written in its own transaction. Rows are identified by their
+    transfer identifier or sale id, so running a chunk again matches the
+    donations it created and an import can resume after the last chunk
+    that was reported to ``progress``. With ``dry_run`` rows are only
+    matched and counted.
+    """
+
+    key_column = None
+
+    def __init__(self, dry_run=False, chunk_size=IMPORT_CHUNK_SIZE, progress=None):
+        self.dry_run = dry_run
+        self.chunk_size = chunk_size
+        self.progress = progress
+        self.stats = ImportStats()
+        self.donors = {}
+        self.reset()
+
+    def reset(self):
+        self.changed_donors = {}
+        self.new_donors = []
+        self.new_donations = []
+        self.changed_donations = {}
+
+    def run(self, df):
+        for start in range(0, len(df), self.chunk_size):
+            chunk = df.iloc[start : start + self.chunk_size]
+            self.import_chunk(chunk)
+            if self.progress is not None:
+                self.progress(self.stats, chunk[self.key_column].iloc[-1])
+        return self.stats
+
+    def import_chunk(self, df):
+        self.stats.rows += len(df)
+        with transaction.atomic():
+            self.import_rows(df)
+            if not self.dry_run:
+                self.write()
+        self.reset()
+
+    def import_rows(self, df):
+        raise NotImplementedError
+
+    def get_donor(self, donor):
+        """
+        Returns one shared instance per donor, so that changes from
+        different rows end up on the same object.
+        """
+        if donor is None or donor.id is None:
+            return donor
+        return self.donors.setdefault(donor.id, donor)
+
+    def add_donor(self, **kwargs):
+        donor = Donor(
+            active=True,
+            salutation="",
+            company_name="",
+            contact_allowed=False,
+            become_user=False,
+            receipt=False,
+            **kwargs,
+        )
+        self.new_donors.append(donor)
+        self.stats.donors_created += 1
+        return donor
+
+    def write(self):
+        Donor.objects.bulk_create(self.new_donors)
+        Donor.objects.bulk_update(self.changed_donors.values(), ["attributes"])
+        Donation.objects.bulk_create(self.new_donations)
+        self.write_donations()
+        donor_ids = {
+            donation.donor_id
+            for donation in self.new_donations + list(self.changed_donations.values())
+            if donation.donor_id is not None
+        }
+        update_donors_donation_numbers(donor_ids)
+        update_donor_aggregates(donor_ids)
+        detect_recurring_on_donors(donor_ids)
+
+    def write_donations(self):
+        pass
+
+
+class BankTransferImporter(StatementImporter):
+    key_column = "transfer_ident"
+
+    def __init__(self, project, **kwargs):
+        self.project = project
+        self.donations_by_ident = {}
+        self.open_donations = {}
+        self.donations_by_code = {}
+        self.loaded_codes = set()
+        self.iban_donors = {}
+        self.loaded_ibans = set()
+        super().__init__(**kwargs)
+
+    def reset(self):
+        super().reset()
+        self.unconfirmed_payments = {}
+        self.debit_payments = []
+
+    def load_donations(self, df):
+        donations = Donation.objects.filter(
+            identifier__in=df["transfer_ident"].tolist()
+        ).select_related("donor", "payment")
+        for donation in donations:
+            donation.donor = self.get_donor(donation.donor)
+            self.donations_by_ident.setdefault(donation.identifier, donation)
+        codes = set(df["transfer_code"].dropna()) - self.loaded_codes
+        self.loaded_codes |= codes
+        first_payments = {}
+        for payment in Payment.objects.filter(transaction_id__in=codes):
+            first_payments.setdefault(payment.transaction_id, payment.id)
+        donations = Donation.objects.filter(
+            payment__transaction_id__in=codes
+        ).select_related("donor", "payment")
+        for donation in donations:
+            code = donation.payment.transaction_id
+            # Latest donation of the transfer code
+            self.donations_by_code.setdefault(code, donation)
+            if donation.payment_id == first_payments[code] and not donation.identifier:
+                self.open_donations.setdefault(code, donation)
+            donation.donor = self.get_donor(donation.donor)
+
+    def load_donors(self, df):
+        ibans = {iban for iban in df["iban"].unique() if iban} - self.loaded_ibans
+        self.loaded_ibans |= ibans
+        donors = Donor.objects.filter(
+            Q(identifier__in=ibans) | Q(attributes__iban__in=ibans)
+        )
+        for donor in donors:
+            donor = self.get_donor(donor)
+            for iban in {donor.identifier, (donor.attributes or {}).get("iban")}:
+                if iban:
+                    self.iban_donors.setdefault(iban, []).append(donor)
+
+    def find_iban_donor(self, iban):
+        donors = [
+            donor
+            for donor in self.iban_donors.get(iban, ())
+            if donor.identifier == iban or (donor.attributes or {}).get("iban") == iban
+        ]
+        if not donors:
+            return None
+        # Like the highest id first ordering of donors, new donors last
+        return max(donors, key=lambda donor: donor.id or math.inf)
+
+    def update_donor_iban(self, donor, row):
+        set_donor_iban(donor, row.iban, row.reference)
+        if donor.id is not None:
+            self.changed_donors[donor.id] = donor
+        if row.iban:
+            self.iban_donors.setdefault(row.iban, []).append(donor)
+
+    def find_donation(self, row):
+        donation = self.donations_by_ident.get(row.transfer_ident)
+        if donation is not None:
+            return donation
+        if pd.isnull(row.transfer_code):
+            return None
+        donation = self.open_donations.pop(row.transfer_code, None)
+        if donation is not None and donation.donor is not None:
+            self.update_donor_iban(donation.donor, row)
+        return donation
+
+    def get_or_create_donor(self, row):
+        if row.iban:
+            donor = self.find_iban_donor(row.iban)
+            if donor is not None:
+                return donor
+        if pd.notnull(row.transfer_code):
+            donation = self.donations_by_code.get(row.transfer_code)
+            if donation is not None and donation.donor is not None:
+                self.update_donor_iban(donation.donor, row)
+                return donation.donor
+
+        first_name, last_name = split_name(row.name)
+        attrs = {"banktransfer_reference": row.reference}
+        if row.iban is not None:
+            attrs["iban"] = row.iban
+        donor = self.add_donor(
+            first_name=first_name,
+            last_name=last_name,
+            address="",
+            postcode="",
+            city="",
+            country=row.iban[:2] if row.iban is not None else "",
+            email="",
+            identifier=row.iban or "",
+            attributes=attrs,
+        )
+        if row.iban:
+            self.iban_donors.setdefault(row.iban, []).append(donor)
+        return donor
+
+    def import_rows(self, df):
+        self.stats.skipped += int(df["blocked"].sum())
+        df = df[~df["blocked"]]
+        is_debit = df["debit_payment_id"].notnull()
+        self.import_direct_debits(df[is_debit])
+        self.import_transfers(df[~is_debit])
+
+    def import_transfers(self, df):
+        self.load_donations(df)
+        self.load_donors(df)
+        for row in df.itertuples():
+            donation = self.find_donation(row)
+            if donation is None:
+                donation = Donation(
+                    donor=self.get_or_create_donor(row),
+                    timestamp=row.date or row.date_received,
+                )
+                self.new_donations.append(donation)
+                self.stats.created += 1
+            else:
+                if donation.id is not None:
+                    self.changed_donations[donation.id] = donation
+                self.stats.matched += 1
+
+            donation.project = self.project
+            donation.identifier = row.transfer_ident
+            donation.amount = row.amount
+            donation.amount_received = row.amount
+            donation.received_timestamp = row.date_received
+            if row.purpose:
+                donation.purpose = row.purpose
+            donation.method = "banktransfer"
+            donation.completed = True
+            self.donations_by_ident[row.transfer_ident] = donation
+
+            payment = donation.payment
+            if payment is not None and payment.status != PaymentStatus.CONFIRMED:
+                self.unconfirmed_payments[payment.id] = donation
+
+    def import_direct_debits(self, df):
+        payments = Payment.objects.in_bulk(df["debit_payment_id"].astype(int).tolist())
+        for row in df.itertuples():
+            payment = payments.get(int(row.debit_payment_id))
+            if payment is None:
+                self.stats.skipped += 1
+                continue
+            payment.captured_amount = row.amount
+            payment.received_amount = row.amount
+            payment.received_timestamp = row.date_received
+            self.debit_payments.append(payment)
+            self.stats.direct_debits += 1
+
+    def write(self):
+        super().write()
+        # Status changes update the donation from the saved payment
+        for donation in self.unconfirmed_payments.values():
+            payment = donation.payment
+            payment.captured_amount = donation.amount
+            payment.received_amount = donation.amount
+            payment.received_timestamp = donation.received_timestamp
+            payment.change_status_and_save(PaymentStatus.CONFIRMED)
+        for payment in self.debit_payments:
+            payment.change_status_and_save(PaymentStatus.CONFIRMED)
+
+    def write_donations(self):
+        Donation.objects.bulk_update(
+            self.changed_donations.values(), BANKTRANSFER_DONATION_FIELDS
+        )
+
+
+class PaypalImporter(StatementImporter):
+    key_column = "sale_id"
+
+    def __init__(self, **kwargs):
+        self.payments_by_id = {}
+        self.payments = []
+        self.payment_times = []
+        self.donations_by_sale_id = {}
+        self.email_donors = {}
+        self.loaded_emails = set()
+        super().__init__(**kwargs)
+
+    def reset(self):
+        super().reset()
+        self.changed_payments = {}
+        self.matched_payments = {}
+
+    def load_payments(self, df):
+        if df.empty:
+            return
+        payments = Payment.objects.filter(
+            variant="paypal",
+            status=PaymentStatus.CONFIRMED,
+            received_timestamp__gte=df["date"].min() - PAYPAL_PAYMENT_BUFFER,
+            received_timestamp__lte=df["date"].max() + PAYPAL_PAYMENT_BUFFER,
+        ).select_related("order")
+        for payment in payments:
+            self.payments_by_id.setdefault(payment.id, payment)
+        self.payments = sorted(
+            self.payments_by_id.values(),
+            key=lambda payment: payment.received_timestamp,
+        )
+        self.payment_times = [payment.received_timestamp for payment in self.payments]
+
+    def find_payments(self, row):
+        start = bisect_left(self.payment_times, row.date - PAYPAL_PAYMENT_BUFFER)
+        end = bisect_right(self.payment_times, row.date + PAYPAL_PAYMENT_BUFFER)
+        ids = [row.sale_id]
+        if row.subscription_id:
+            ids.append(row.subscription_id)
+        return [
+            payment
+            for payment in self.payments[start:end]
+            if any(ident in payment.extra_data for ident in ids)
+        ]
+
+    def load_donations(self, df):
+        donations = Donation.objects.filter(
+            method="paypal", identifier__in=df["sale_id"].tolist()
+        )
+        for donation in donations:
+            self.donations_by_sale_id.setdefault(donation.identifier, donation)
+
+    def load_donors(self, df):
+        emails = set(df["paypal_email"].dropna()) - self.loaded_emails
+        self.loaded_emails |= emails
+        donors = Donor.objects.filter(
+            Q(attributes__paypal_email__in=emails)
+            | Q(email__in=emails, email_confirmed__isnull=False)
+        ).order_by("id")
+        for donor in donors:
+            paypal_email = (donor.attributes or {}).get("paypal_email")
+            if paypal_email:
+                self.email_donors.setdefault(paypal_email, donor)
+            if donor.email_confirmed:
+                self.email_donors.setdefault(donor.email, donor)
+
+    def get_or_create_donor(self, row):
+        donor = self.email_donors.get(row.paypal_email)
+        if donor is not None:
+            return donor
+        first_name, last_name = split_name(row.name)
+        donor = self.add_donor(
+            first_name=first_name,
+            last_name=last_name,
+            address=row.address,
+            postcode=row.postcode,
+            city=row.city,
+            country=row.country,
+            email=row.paypal_email,
+            attributes={"paypal_email": row.paypal_email},
+        )
+        self.email_donors[row.paypal_email] = donor
+        return donor
+
+    def import_payment(self, payment, row):
+        if not payment.received_amount:
+            payment.received_amount = row.amount_received
+            self.changed_payments[payment.id] = payment
+        if not payment.received_timestamp:
+            payment.received_timestamp = row.date
+            self.changed_payments[payment.id] = payment
+        self.matched_payments[payment.id] = payment
+
+    def import_rows(self, df):
+        self.load_payments(df)
+        self.load_donations(df)
+        self.load_donors(df)
+        for row in df.itertuples():
+            payments = self.find_payments(row)
+            if len(payments) > 1:
+                self.stats.ambiguous += 1
+                continue
+            if payments:
+                self.import_payment(payments[0], row)
+                self.stats.matched += 1
+                continue
+            if row.sale_id in self.donations_by_sale_id:
+                self.stats.matched += 1
+                continue
+
+            donation = Donation(
+                donor=self.get_or_create_donor(row),
+                identifier=row.sale_id,
+                completed=True,
+                received_timestamp=row.date,
+                timestamp=row.date,
+                method="paypal",
+                amount=row.amount,
+                amount_received=row.amount_received,
+                note=row.note,
+                recurring=bool(row.subscription_id),
+            )
+            self.new_donations.append(donation)
+            self.donations_by_sale_id[row.sale_id] = donation
+            self.stats.created += 1
+
+    def write_donations(self):
+        Payment.objects.bulk_update(
+            self.changed_payments.values(),
+            ["received_amount", "received_timestamp"],
+        )
+        payments = self.matched_payments
+        donations = Donation.objects.filter(
+            Q(payment_id__in=payments)
+            | Q(order_id__in=[payment.order_id for payment in payments.values()])
+        ).values_list("payment_id", "order_id")
+        with_donation = set()
+        for payment_id, order_id in donations:
+            with_donation.update((("payment", payment_id), ("order", order_id)))
+        # Make sure matched payments have a donation
+        for payment in payments.values():
+            if ("payment", payment.id) in with_donation:
+                continue
+            if ("order", payment.order_id) in with_donation:
+                continue
+            create_donation_from_payment(payment)
+
+
+def read_statement(statement_import):
+    if statement_import.kind == StatementImport.Kind.PAYPAL:
+        return read_paypal(statement_import.filepath)
+    return read_banktransfers(statement_import.filepath)
+
+
+def get_importer(statement_import, **kwargs):
+    if statement_import.kind == StatementImport.Kind.PAYPAL:
+        return PaypalImporter(**kwargs)
+    return BankTransferImporter(statement_import.project, **kwargs)
+
+
+def get_resume_stats(statement_import, df, key_column):
+    """
+    Returns the stats to continue ``statement_import`` with. The run
+    starts over if it is a dry run or if the statement row before the
+    resume position is not the last reported row.
+    """
+    stats = ImportStats(
+        **{
+            field.name: getattr(statement_import, field.name)
+            for field in fields(ImportStats)
+        }
+    )
+    if statement_import.dry_run or not stats.rows:
+        return ImportStats()
+    if stats.rows > len(df):
+        return ImportStats()
+    if str(df[key_column].iloc[stats.rows - 1]) != statement_import.last_key:
+        return ImportStats()
+    return stats
+
+
+def run_statement_import(statement_import, chunk_size=IMPORT_CHUNK_SIZE):
+    """
+    Runs ``statement_import`` or resumes it after the last chunk of its
+    previous run.
+    """
+    df = read_statement(statement_import)
+    importer = get_importer(
+        statement_import,
+        dry_run=statement_import.dry_run,
+        chunk_size=chunk_size,
+        progress=lambda stats, key: statement_import.save_progress(stats, str(key)),
+    )
+    importer.stats = get_resume_stats(statement_import, df, importer.key_column)
+    for field in fields(ImportStats):
+        setattr(statement_import, field.name, getattr(importer.stats, field.name))
+
+    now = timezone.now()
+    statement_import.status = StatementImport.Status.RUNNING
+    statement_import.rows_total = len(df)
+    statement_import.started_rows = importer.stats.rows
+    statement_import.started = now
+    statement_import.updated = now
+    statement_import.finished = None
+    statement_import.error = ""
+    statement_import.save()
+
+    stats = importer.run(df.iloc[importer.stats.rows :])
+
+    statement_import.status = StatementImport.Status.DONE
+    statement_import.finished = timezone.now()
+    statement_import.save(update_fields=["status", "finished"])
+    return stats
@@ -0,0 +1,14 @@
+;(function () {
+  var container = document.querySelector('[data-donationstats]')
+  if (!container) {
+    return
+  }
+  fetch(container.dataset.donationstats, { credentials: 'same-origin' })
+    .then((response) => response.json())
+    .then((stats) => {
+      container.querySelectorAll('[data-stat]').forEach((el) => {
+        var value = stats[el.dataset.stat]
+        el.textContent = value === null || value === undefined ? '-' : value
+      })
+    })
+})()
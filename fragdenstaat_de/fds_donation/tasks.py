@@ -1,5 +1,6 @@
-import os
+from dataclasses import asdict
 from datetime import timedelta
+from itertools import batched
 
 from django.conf import settings
 from django.contrib.auth import get_user_model
@@ -134,45 +135,97 @@ def backup_jzwb_pdf_task(donor_id, year, ignore_receipt_date=None):
     backup_jzwb(donor, year, ignore_receipt_date=ignore_receipt_date)
 
 
-@celery_app.task(name="fragdenstaat_de.fds_donation.import_banktransfers")
-def import_banktransfers_task(filepath, project, user_id=None):
-    from .external import import_banktransfers
+def format_import_stats(stats):
+    return _(
+        "Rows: {rows}\nMatched: {matched}\nNew: {created}\n"
+        "New donors: {donors_created}\nDirect debits: {direct_debits}\n"
+        "Skipped: {skipped}\nAmbiguous: {ambiguous}"
+    ).format(**asdict(stats))
 
-    try:
-        count, new_count = import_banktransfers(filepath, project)
-    finally:
-        os.remove(filepath)
 
-    if user_id is not None:
-        user = get_user_model().objects.get(id=user_id)
-        user.send_mail(
-            _("Bank transfers imported for {project}").format(project=project),
-            _("Count: {count}\nNew: {new}").format(count=count, new=new_count),
+def get_import_subject(statement_import):
+    if statement_import.kind == statement_import.Kind.PAYPAL:
+        subject = _("Paypal imported")
+    else:
+        subject = _("Bank transfers imported for {project}").format(
+            project=statement_import.project
         )
+    if statement_import.dry_run:
+        return _("Dry run: {subject}").format(subject=subject)
+    return subject
 
 
-@celery_app.task(name="fragdenstaat_de.fds_donation.import_paypal")
-def import_paypal_task(filepath, user_id=None):
-    from .external import import_paypal
+@celery_app.task(name="fragdenstaat_de.fds_donation.run_statement_import")
+def run_statement_import_task(statement_import_id):
+    from .models import StatementImport
+    from .statement_import import run_statement_import
+
+    # Claim the import, so it is only run by one worker at a time
+    claimed = StatementImport.objects.filter(
+        id=statement_import_id, status=StatementImport.Status.PENDING
+    ).update(status=StatementImport.Status.RUNNING, updated=timezone.now())
+    if not claimed:
+        return
+    statement_import = StatementImport.objects.get(id=statement_import_id)
 
     try:
-        count, new_count = import_paypal(filepath)
-    finally:
-        os.remove(filepath)
+        stats = run_statement_import(statement_import)
+    except Exception as e:
+        # Keep the file, so the import can be resumed
+        statement_import.status = StatementImport.Status.FAILED
+        statement_import.error = str(e)
+        statement_import.save(update_fields=["status", "error"])
+        raise
+
+    statement_import.delete_file()
+
+    if statement_import.user is not None:
+        statement_import.user.send_mail(
+            get_import_subject(statement_import), format_import_stats(stats)
+        )
+
+
+@celery_app.task(name="fragdenstaat_de.fds_donation.cleanup_statement_imports")
+def cleanup_statement_imports_task():
+    from .models import StatementImport
+
+    # Statements contain names and IBANs, don't keep them for failed imports
+    for statement_import in StatementImport.objects.get_expired_files():
+        statement_import.delete_file()
+
+
+@celery_app.task(name="fragdenstaat_de.fds_donation.detect_duplicate_donors")
+def detect_duplicate_donors_task(donor_ids=None, user_id=None):
+    from .duplicates import detect_duplicate_donors
+
+    group_count, donor_count = detect_duplicate_donors(donor_ids=donor_ids)
 
     if user_id is not None:
         user = get_user_model().objects.get(id=user_id)
         user.send_mail(
-            _("Paypal imported"),
-            _("Count: {count}\nNew: {new}").format(count=count, new=new_count),
+            _("Duplicate donors detected"),
+            _("Detected {dup} duplicate sets with {donors} donors").format(
+                dup=group_count, donors=donor_count
+            ),
         )
 
 
 @celery_app.task(name="fragdenstaat_de.fds_donation.check_late_recurring_donors_task")
 def check_late_recurring_donors_task():
-    from .recurrence import check_late_recurring_donors
+    from .recurrence import RECURRENCE_TASK_SIZE, get_late_donor_ids
+
+    for donor_ids in batched(get_late_donor_ids(), RECURRENCE_TASK_SIZE):
+        process_recurrence_batch_task.delay(list(donor_ids))
+
+
+@celery_app.task(name="fragdenstaat_de.fds_donation.process_recurrence_batch_task")
+def process_recurrence_batch_task(donor_ids):
+    from .recurrence import process_recurrence_batches
 
-    check_late_recurring_donors()
+    remaining = process_recurrence_batches(donor_ids)
+    if remaining:
+        # Continue in a new task to keep task runtime bounded
+        process_recurrence_batch_task.delay(remaining)
 
 
 @celery_app.task(name="fragdenstaat_de.fds_donation.process_recurrence_task")
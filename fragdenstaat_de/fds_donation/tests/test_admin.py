@@ -1,9 +1,14 @@
+import csv
+import gzip
+import uuid
 from datetime import datetime
+from io import StringIO
 
 from django.contrib.admin.sites import AdminSite
 from django.contrib.messages import get_messages
 from django.contrib.messages.storage.fallback import FallbackStorage
 from django.contrib.sessions.middleware import SessionMiddleware
+from django.core.management import call_command
 from django.test import RequestFactory
 from django.utils import timezone
 
@@ -12,7 +17,8 @@ import pytest
 from froide.account.factories import UserFactory
 
 from ..admin import DonorAdmin, DonorTotalAmountPerYearFilter
-from ..models import Donation, Donor
+from ..models import Donation, Donor, Recurrence
+from ..utils import get_donation_stats
 
 
 @pytest.fixture
@@ -166,3 +172,175 @@ def test_invalid_amount_shows_error(
     messages_list = list(get_messages(request))
     assert len(messages_list) == 1
     assert "abc" in str(messages_list[0])
+
+
+@pytest.mark.django_db
+def test_donor_aggregates(donors_with_donations):
+    donor1, donor2, _donor3 = donors_with_donations
+    donor1.refresh_from_db()
+    assert donor1.amount_total == 1500
+    assert donor1.donation_count == 1
+    assert donor1.amount_by_year == {"2024": "1500.00"}
+
+    stale_donor1 = Donor.objects.get(id=donor1.id)
+    donation = Donation.objects.create(
+        donor=donor1,
+        amount=100,
+        received_timestamp=timezone.make_aware(datetime(2025, 2, 1)),
+    )
+    # Saving a donor loaded earlier keeps the new aggregates
+    stale_donor1.note = "note"
+    stale_donor1.save()
+    donor1.refresh_from_db()
+    assert donor1.note == "note"
+    assert donor1.amount_total == 1600
+    assert donor1.donation_count == 2
+    assert donor1.last_donation == donation.timestamp
+    assert donor1.amount_by_year == {"2024": "1500.00", "2025": "100.00"}
+
+    # Moving a donation updates both donors
+    donation = Donation.objects.get(id=donation.id)
+    donation.donor = donor2
+    donation.save()
+    donor1.refresh_from_db()
+    donor2.refresh_from_db()
+    assert donor1.amount_total == 1500
+    assert donor2.amount_total == 900
+    assert donor2.amount_by_year == {"2024": "800.00", "2025": "100.00"}
+
+    donation.delete()
+    donor2.refresh_from_db()
+    assert donor2.amount_total == 800
+    assert donor2.donation_count == 1
+
+    Donor.objects.update(amount_total=0, donation_count=0, amount_by_year={})
+    call_command("rebuild_donor_aggregates", stdout=StringIO())
+    donor2.refresh_from_db()
+    assert donor2.amount_total == 800
+    assert donor2.amount_by_year == {"2024": "800.00"}
+
+
+@pytest.mark.django_db
+def test_donation_stats(donors_with_donations):
+    donor1, donor2, _donor3 = donors_with_donations
+    Donor.objects.filter(id=donor1.id).update(recurring_amount=10)
+    recurrence = Recurrence.objects.create(
+        donor=donor1, start_date=timezone.now(), interval=3, amount=30
+    )
+    Recurrence.objects.create(
+        donor=donor2,
+        start_date=timezone.now(),
+        interval=1,
+        amount=5,
+        cancel_date=timezone.now(),
+    )
+    Donation.objects.filter(donor=donor1).update(recurrence=recurrence)
+
+    stats = get_donation_stats(Donation.objects.filter(amount__gte=500))
+    assert stats["amount_sum"] == 2300
+    assert stats["amount_avg"] == 1150
+    assert stats["amount_median"] == 1150
+    assert stats["donor_count"] == 2
+    assert stats["recurring_donor_amount"] == 10
+    assert stats["recurring_count"] == 1
+    assert stats["cancel_count"] == 0
+    assert stats["recurring_monthly_amount"] == 10
+    assert stats["recurring_monthly_active_amount"] == 10
+
+    stats = get_donation_stats(Donation.objects.none())
+    assert stats["amount_sum"] is None
+    assert stats["amount_avg"] == "-"
+    assert stats["recurring_count"] == 0
+
+
+def test_export_donor_csv(
+    donors_with_donations, rf, dummy_user, django_assert_num_queries
+):
+    donor1, _donor2, _donor3 = donors_with_donations
+    Donor.objects.filter(id=donor1.id).update(
+        attributes={"iban": "DE02120300000000202051"}, country="DE"
+    )
+    donor1.refresh_from_db()
+    request = rf.get("/", HTTP_ACCEPT_ENCODING="gzip")
+    request.user = dummy_user
+    donor_admin = DonorAdmin(Donor, AdminSite())
+
+    response = donor_admin.export_donor_csv(request, Donor.objects.order_by("id"))
+    assert response.streaming
+    assert response["Content-Encoding"] == "gzip"
+    with django_assert_num_queries(1):
+        content = gzip.decompress(b"".join(response.streaming_content))
+
+    rows = list(csv.DictReader(StringIO(content.decode("utf-8"))))
+    assert len(rows) == 3
+    assert rows[0]["email"] == "donor1@example.com"
+    assert rows[0]["iban"] == "DE02120300000000202051"
+    assert rows[0]["country"] == donor1.country.name
+    assert rows[0]["salutation"] == donor1.get_salutation()
+    assert rows[1]["iban"] == ""
+
+
+@pytest.mark.django_db
+def test_donor_changelist_totals(rf):
+    last_year = timezone.now().year - 1
+    duplicate = uuid.uuid4()
+    donor1 = Donor.objects.create(email="donor1@example.com", duplicate=duplicate)
+    donor2 = Donor.objects.create(email="donor2@example.com", duplicate=duplicate)
+    for month in (1, 2, 3):
+        Donation.objects.create(
+            donor=donor1,
+            amount=100,
+            received_timestamp=timezone.make_aware(datetime(last_year, month, 1)),
+        )
+    Donation.objects.create(
+        donor=donor2,
+        amount=50,
+        received_timestamp=timezone.make_aware(datetime(last_year, 5, 1)),
+    )
+
+    request = rf.get("/")
+    request.user = UserFactory(is_superuser=True, is_staff=True)
+    donor_admin = DonorAdmin(Donor, AdminSite())
+    changelist = donor_admin.get_changelist_instance(request)
+
+    # Multiple donations of a donor do not inflate the donor totals
+    assert changelist.amount_total_sum == 350
+    assert changelist.amount_total_avg == 175
+    assert changelist.amount_total_median == 175
+    assert changelist.amount_last_year_sum == 350
+    assert changelist.amount_last_year_avg == 175
+    assert changelist.duplicates == 1
+
+
+@pytest.mark.django_db
+def test_donor_changelist_project_totals(rf):
+    last_year = timezone.now().year - 1
+    received = timezone.make_aware(datetime(last_year, 1, 1))
+    donor1 = Donor.objects.create(email="donor1@example.com")
+    donor2 = Donor.objects.create(email="donor2@example.com")
+    donor3 = Donor.objects.create(email="donor3@example.com")
+    for project, donor, amount in (
+        ("FDS", donor1, 100),
+        ("FDS", donor1, 100),
+        ("CFG", donor1, 40),
+        ("CFG", donor2, 50),
+        ("FDS", donor3, 10),
+    ):
+        Donation.objects.create(
+            donor=donor, project=project, amount=amount, received_timestamp=received
+        )
+
+    request = rf.get("/", {"project": "CFG"})
+    request.user = UserFactory(is_superuser=True, is_staff=True)
+    donor_admin = DonorAdmin(Donor, AdminSite())
+    changelist = donor_admin.get_changelist_instance(request)
+
+    # Amounts only include donations to the filtered project
+    donors = {donor.id: donor for donor in changelist.result_list}
+    assert set(donors) == {donor1.id, donor2.id}
+    assert donors[donor1.id].amount_total == 240
+    assert donor_admin.get_donation_stat(donors[donor1.id], "amount_total") == 40
+    assert donor_admin.donation_count(donors[donor1.id]) == 1
+    assert changelist.amount_total_sum == 90
+    assert changelist.amount_last_year_sum == 90
+    assert changelist.get_ordering_field("amount_total") == "project_amount_total"
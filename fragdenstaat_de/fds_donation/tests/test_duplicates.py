@@ -0,0 +1,111 @@
+from django.utils import timezone
+
+import pytest
+
+from ..duplicates import (
+    MAX_BLOCK_SIZE,
+    DonorRecord,
+    cologne_phonetic,
+    detect_duplicate_donors,
+    find_duplicate_groups,
+    get_candidate_pairs,
+    normalize_street,
+)
+from ..models import Donor
+from .factories import DonorFactory
+
+
+def test_cologne_phonetic():
+    assert cologne_phonetic("wikipedia") == "3412"
+    assert cologne_phonetic("muller") == cologne_phonetic("mueller") == "657"
+    assert cologne_phonetic("meier") == cologne_phonetic("mayer") == "67"
+    assert cologne_phonetic("schmidt") == cologne_phonetic("schmitt") == "862"
+
+
+def test_normalize_street():
+    assert normalize_street("Musterstraße 12 a") == "musterstrasse 12a"
+    assert normalize_street("Musterstr. 12a") == "musterstrasse 12a"
+
+
+def make_record(
+    donor_id, first_name, last_name, address, postcode, email="", confirmed=True
+):
+    email_confirmed = timezone.now() if confirmed else None
+    return DonorRecord.from_values(
+        (
+            donor_id,
+            first_name,
+            last_name,
+            "",
+            email,
+            email_confirmed,
+            address,
+            postcode,
+            None,
+        )
+    )
+
+
+def test_find_duplicate_groups():
+    records = [
+        make_record(1, "Jane", "Müller", "Musterstraße 12", "10115"),
+        make_record(2, "Jane", "Mueller", "Musterstr. 12", "10115"),
+        make_record(3, "Max", "Other", "", "", email="jane@example.org"),
+        make_record(4, "Jane", "Müller", "", "", email="Jane@example.org "),
+        make_record(5, "Erika", "Muster", "Allee 3", "30000"),
+        make_record(6, "Anna", "Muster", "Allee 9", "30000"),
+        # Unconfirmed emails don't make donors duplicates
+        make_record(
+            7, "Erik", "Else", "", "", email="jane@example.org", confirmed=False
+        ),
+    ]
+    groups = find_duplicate_groups(records)
+
+    assert groups[0] == ([3, 4], 1.0)
+    assert groups[1][0] == [1, 2]
+    assert 0.75 < groups[1][1] < 1.0
+    assert len(groups) == 2
+
+
+def test_find_duplicate_groups_large_block():
+    # All donors share a blocking key, duplicates are still found
+    records = [
+        make_record(i, "Person", "Name{}".format(i), "", "", email="team@example.org")
+        for i in range(MAX_BLOCK_SIZE * 2)
+    ]
+    records.append(make_record(1000, "Jane", "Müller", "Musterstraße 12", "10115"))
+    records.append(make_record(1001, "Jane", "Mueller", "Musterstr. 12", "10115"))
+    pairs = get_candidate_pairs(records)
+    assert len(pairs) < len(records) * (len(records) - 1) / 2
+
+    groups = find_duplicate_groups(records)
+    assert groups[0] == (list(range(MAX_BLOCK_SIZE * 2)), 1.0)
+    assert groups[1][0] == [1000, 1001]
+
+
+@pytest.mark.django_db
+def test_detect_duplicate_donors():
+    donor = DonorFactory.create(
+        first_name="Jane",
+        last_name="Müller",
+        address="Musterstraße 12",
+        postcode="10115",
+    )
+    other_donor = DonorFactory.create(
+        first_name="Jane",
+        last_name="Mueller",
+        address="Musterstr. 12",
+        postcode="10115",
+    )
+    unrelated = DonorFactory.create(
+        first_name="Max", last_name="Other", address="Weg 1", postcode="20000"
+    )
+
+    assert detect_duplicate_donors() == (1, 2)
+
+    donor.refresh_from_db()
+    other_donor.refresh_from_db()
+    assert donor.duplicate is not None
+    assert donor.duplicate == other_donor.duplicate
+    assert donor.duplicate_score == other_donor.duplicate_score
+    assert Donor.objects.get(id=unrelated.id).duplicate is None
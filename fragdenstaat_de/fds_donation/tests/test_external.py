@@ -1,16 +1,48 @@
+from datetime import datetime, timedelta
 from decimal import Decimal
+from io import StringIO
 
 from django.conf import settings
 from django.utils import timezone
 
+import pandas as pd
 import pytest
 from froide_payment.models import Order, Payment, PaymentStatus
 from froide_payment.provider.banktransfer import generate_transfer_code
 
-from ..external import find_donation, import_banktransfer
+from ..models import (
+    STATEMENT_IMPORT_FILE_MAX_AGE,
+    STATEMENT_IMPORT_STALE_AFTER,
+    Donation,
+    Donor,
+    StatementImport,
+)
+from ..statement_import import (
+    BankTransferImporter,
+    PaypalImporter,
+    normalize_banktransfers,
+    normalize_paypal,
+    run_statement_import,
+)
+from ..tasks import cleanup_statement_imports_task, run_statement_import_task
 from .factories import DonationFactory, DonorFactory, make_banktransfer_donation
 
 
+def make_statement(reference, iban, amount, date, **columns):
+    return normalize_banktransfers(
+        pd.DataFrame(
+            {
+                "Betrag": [amount],
+                "Datum": [pd.Timestamp(date)],
+                "Name": ["Jane Doe"],
+                "Verwendungszweck": [reference],
+                "Konto": [iban],
+                **{column: [value] for column, value in columns.items()},
+            }
+        )
+    )
+
+
 @pytest.mark.django_db
 def test_import_banktransfer_new_iban():
     transfer_code = generate_transfer_code()
@@ -23,36 +55,29 @@ def test_import_banktransfer_new_iban():
     )
 
     iban = "DE1"
-    row = {
-        "reference": transfer_code,
-        "iban": iban,
-    }
-    found_donation = find_donation("no-ident", row)
-    assert found_donation == donation
-    donor = found_donation.donor
+    statement = make_statement(transfer_code, iban, 5.0, "2024-03-01 12:00")
+    stats = BankTransferImporter(settings.DONATION_PROJECTS[0][0]).run(statement)
+
+    assert stats.matched == 1
+    assert stats.created == 0
+    donation.refresh_from_db()
+    assert donation.identifier == statement["transfer_ident"].iloc[0]
     donor.refresh_from_db()
     assert donor.attributes["iban"] == iban
     assert iban in donor.attributes["ibans"]
+    assert "DE0" in donor.attributes["ibans"]
 
 
 @pytest.mark.django_db
 def test_import_banktransfer_subscription_active():
     donor = DonorFactory.create()
-    now = timezone.now()
-    first_date = now
     amount = Decimal("10.00")
+    first_date = timezone.make_aware(datetime(2024, 3, 1, 12, 0))
     donation = make_banktransfer_donation(donor, amount, first_date)
     transfer_code = donation.payment.transaction_id
 
-    iban = "DE1"
-    row = {
-        "reference": transfer_code,
-        "iban": iban,
-        "amount": amount,
-        "date": first_date,
-        "date_received": first_date,
-    }
-    import_banktransfer(transfer_code, row, settings.DONATION_PROJECTS[0][0])
+    statement = make_statement(transfer_code, "DE1", 10.0, "2024-03-01 12:00")
+    BankTransferImporter(settings.DONATION_PROJECTS[0][0]).run(statement)
 
     payment = donation.payment
     payment.refresh_from_db()
@@ -68,24 +93,16 @@ def test_import_banktransfer_subscription_active():
 
 @pytest.mark.django_db
 def test_import_banktransfer_purpose(donor):
-    now = timezone.now()
-    first_date = now
     amount = Decimal("10.00")
-    donation = make_banktransfer_donation(donor, amount, first_date)
+    donation = make_banktransfer_donation(donor, amount, timezone.now())
     transfer_code = donation.payment.transaction_id
 
     assert donation.purpose == ""
 
-    iban = "DE1"
-    row = {
-        "reference": transfer_code,
-        "iban": iban,
-        "amount": amount,
-        "date": first_date,
-        "date_received": first_date,
-        "purpose": "TEST-PURP",
-    }
-    import_banktransfer(transfer_code, row, settings.DONATION_PROJECTS[0][0])
+    statement = make_statement(
+        transfer_code, "DE1", 10.0, "2024-03-01 12:00", Purpose="TEST-PURP"
+    )
+    BankTransferImporter(settings.DONATION_PROJECTS[0][0]).run(statement)
 
     payment = donation.payment
     payment.refresh_from_db()
@@ -97,3 +114,227 @@ def test_import_banktransfer_purpose(donor):
     subscription = payment.order.subscription
     subscription.refresh_from_db()
     assert subscription.active is True
+
+
+@pytest.mark.django_db
+def test_import_banktransfer_statement():
+    project = settings.DONATION_PROJECTS[0][0]
+    donor = DonorFactory.create()
+    amount = Decimal("10.00")
+    donation = make_banktransfer_donation(donor, amount, timezone.now())
+    transfer_code = donation.payment.transaction_id
+    received = pd.Timestamp("2024-03-01 12:00")
+    statement = pd.DataFrame(
+        {
+            "Betrag": [10.0, 5.5, 5.5, 100.0],
+            "Datum": [received] * 4,
+            "Name": ["Known Donor", "Jane Doe", "Jane Doe", "Stripe"],
+            "Verwendungszweck": [transfer_code, "Spende", "Spende", "Payout"],
+            "Konto": ["DE1", "DE99", "DE99", "DE42"],
+        }
+    )
+
+    progress = []
+    importer = BankTransferImporter(
+        project, chunk_size=2, progress=lambda stats, key: progress.append(key)
+    )
+    stats = importer.run(normalize_banktransfers(statement))
+
+    assert len(progress) == 2
+    assert stats.rows == 4
+    assert stats.matched == 1
+    assert stats.created == 2
+    assert stats.donors_created == 1
+    assert stats.skipped == 1
+
+    donation.refresh_from_db()
+    assert donation.identifier.startswith("2024-03-01-{}-DE1-".format(transfer_code))
+    assert donation.payment.status == PaymentStatus.CONFIRMED
+    donor.refresh_from_db()
+    assert donor.attributes["iban"] == "DE1"
+
+    new_donor = Donor.objects.get(identifier="DE99")
+    assert new_donor.first_name == "Jane"
+    assert new_donor.last_name == "Doe"
+    new_donations = Donation.objects.filter(donor=new_donor).order_by("number")
+    assert [d.number for d in new_donations] == [1, 2]
+    assert all(d.amount == Decimal("5.5") for d in new_donations)
+    assert not Donor.objects.filter(identifier="DE42").exists()
+
+    # Importing the statement again matches all transfers
+    stats = BankTransferImporter(project).run(normalize_banktransfers(statement))
+    assert stats.matched == 3
+    assert stats.created == 0
+    assert Donation.objects.filter(donor=new_donor).count() == 2
+
+
+PAYPAL_CSV = """Datum,Uhrzeit,Name,Brutto,Netto,Auswirkung auf Guthaben,Transaktionscode,Zugehöriger Transaktionscode,Absender E-Mail-Adresse,Adresszeile 1,Adresszusatz,Ort,PLZ,Ländervorwahl,Hinweis
+01.03.2024,10:00:00,Jane Doe,"10,00","9,50",Haben,SALE1,,jane@example.org,Street 1,,Berlin,10115,DE,
+02.03.2024,10:00:00,Jane Doe,"10,00","9,50",Haben,SALE2,,jane@example.org,Street 1,,Berlin,10115,DE,
+02.03.2024,11:00:00,Fee,"-1,00","-1,00",Soll,FEE1,,,,,,,,
+03.03.2024,10:00:00,John Doe,"5,00","4,50",Haben,SALE3,,john@example.org,,,,,,
+"""
+
+
+@pytest.mark.django_db
+def test_statement_import_resume_and_dry_run(tmp_path):
+    path = tmp_path / "paypal.csv"
+    path.write_text(PAYPAL_CSV)
+    donor = DonorFactory.create(email="jane@example.org")
+    DonationFactory.create(donor=donor, method="paypal", identifier="SALE1")
+    # The first chunk was imported before the run failed
+    statement_import = StatementImport.objects.create(
+        kind=StatementImport.Kind.PAYPAL,
+        filepath=str(path),
+        status=StatementImport.Status.FAILED,
+        rows=1,
+        created=1,
+        donors_created=1,
+        last_key="SALE1",
+    )
+
+    stats = run_statement_import(statement_import, chunk_size=1)
+
+    assert stats.rows == 3
+    assert stats.created == 3
+    assert stats.matched == 0
+    statement_import.refresh_from_db()
+    assert statement_import.status == StatementImport.Status.DONE
+    assert statement_import.rows_total == 3
+    assert statement_import.last_key == "SALE3"
+    assert statement_import.created == 3
+    assert Donation.objects.filter(method="paypal").count() == 3
+
+    dry_run = StatementImport.objects.create(
+        kind=StatementImport.Kind.PAYPAL, filepath=str(path), dry_run=True
+    )
+    stats = run_statement_import(dry_run, chunk_size=2)
+
+    assert stats.rows == 3
+    assert stats.matched == 3
+    assert stats.created == 0
+    assert Donation.objects.filter(method="paypal").count() == 3
+
+
+@pytest.mark.django_db
+def test_statement_import_stale_and_cleanup(tmp_path):
+    path = tmp_path / "paypal.csv"
+    path.write_text(PAYPAL_CSV)
+    now = timezone.now()
+    # Worker was killed while running the import
+    stale = StatementImport.objects.create(
+        kind=StatementImport.Kind.PAYPAL,
+        filepath=str(path),
+        status=StatementImport.Status.RUNNING,
+        updated=now - STATEMENT_IMPORT_STALE_AFTER * 2,
+    )
+    running = StatementImport.objects.create(
+        kind=StatementImport.Kind.PAYPAL,
+        filepath=str(path),
+        status=StatementImport.Status.RUNNING,
+        updated=now,
+    )
+    assert stale.is_stale
+    assert not running.is_stale
+    assert list(StatementImport.objects.get_resumable()) == [stale]
+
+    # Only pending imports are run, so a running import is not run twice
+    run_statement_import_task(running.id)
+    running.refresh_from_db()
+    assert running.status == StatementImport.Status.RUNNING
+    assert running.rows == 0
+
+    failed_path = tmp_path / "failed.csv"
+    failed_path.write_text(PAYPAL_CSV)
+    failed = StatementImport.objects.create(
+        kind=StatementImport.Kind.PAYPAL,
+        filepath=str(failed_path),
+        status=StatementImport.Status.FAILED,
+        updated=now - STATEMENT_IMPORT_FILE_MAX_AGE * 2,
+    )
+    cleanup_statement_imports_task()
+    failed.refresh_from_db()
+    assert failed.filepath == ""
+    assert not failed_path.exists()
+    assert path.exists()
+
+    running.delete()
+    assert not path.exists()
+
+
+PAYPAL_MATCH_CSV = """Datum,Uhrzeit,Name,Brutto,Netto,Auswirkung auf Guthaben,Transaktionscode,Zugehöriger Transaktionscode,Absender E-Mail-Adresse,Adresszeile 1,Adresszusatz,Ort,PLZ,Ländervorwahl,Hinweis
+01.03.2024,10:00:00,Jane Doe,"10,00","9,50",Haben,SALE1,,jane@example.org,,,,,,
+01.03.2024,11:00:00,Jane Doe,"10,00","9,50",Haben,SALE2,,jane@example.org,,,,,,
+01.03.2024,12:00:00,John Doe,"5,00","4,50",Haben,SALE3,,john@example.org,,,,,,
+01.03.2024,13:00:00,Anna Doe,"5,00","4,50",Haben,SALE4,,anna@paypal.example,,,,,,
+01.03.2024,14:00:00,Max Doe,"5,00","4,50",Haben,SALE5,,max@example.org,,,,,,
+"""
+
+
+def make_paypal_payment(sale_id, timestamp):
+    order = Order.objects.create(
+        user_email="jane@example.org",
+        total_net=Decimal("10.00"),
+        total_gross=Decimal("10.00"),
+        is_donation=True,
+    )
+    return Payment.objects.create(
+        order=order,
+        variant="paypal",
+        status=PaymentStatus.CONFIRMED,
+        received_timestamp=timestamp,
+        extra_data='{{"sale_id": "{}"}}'.format(sale_id),
+    )
+
+
+@pytest.mark.django_db
+def test_import_paypal_statement():
+    date = timezone.make_aware(datetime(2024, 3, 1, 10, 0))
+    matched_payment = make_paypal_payment("SALE1", date + timedelta(minutes=1))
+    # Two payments with the same sale id can't be told apart
+    make_paypal_payment("SALE2", date + timedelta(hours=1))
+    make_paypal_payment("SALE2", date + timedelta(hours=1, minutes=2))
+    # Payment of another sale outside of the buffer is not matched
+    make_paypal_payment("SALE3", date - timedelta(hours=1))
+    email_donor = DonorFactory.create(
+        email="john@example.org", email_confirmed=timezone.now()
+    )
+    paypal_donor = DonorFactory.create(
+        email="anna@example.org", attributes={"paypal_email": "anna@paypal.example"}
+    )
+    unconfirmed_donor = DonorFactory.create(
+        email="max@example.org", email_confirmed=None
+    )
+
+    stats = PaypalImporter().run(
+        normalize_paypal(pd.read_csv(StringIO(PAYPAL_MATCH_CSV)))
+    )
+
+    assert stats.rows == 5
+    assert stats.matched == 1
+    assert stats.ambiguous == 1
+    assert stats.created == 3
+    assert stats.donors_created == 1
+
+    matched_payment.refresh_from_db()
+    assert matched_payment.received_amount == Decimal("9.50")
+    # Matched payments get a donation
+    donation = Donation.objects.get(payment=matched_payment)
+    assert donation.method == "paypal"
+    assert not Donation.objects.filter(identifier="SALE1").exists()
+    assert not Donation.objects.filter(identifier="SALE2").exists()
+
+    assert Donation.objects.get(identifier="SALE3").donor == email_donor
+    assert Donation.objects.get(identifier="SALE4").donor == paypal_donor
+    new_donor = Donation.objects.get(identifier="SALE5").donor
+    assert new_donor != unconfirmed_donor
+    assert new_donor.first_name == "Max"
+    assert new_donor.attributes["paypal_email"] == "max@example.org"
+
+    # Importing the statement again doesn't create donations again
+    stats = PaypalImporter().run(
+        normalize_paypal(pd.read_csv(StringIO(PAYPAL_MATCH_CSV)))
+    )
+    assert stats.matched == 4
+    assert stats.created == 0
+    assert Donation.objects.filter(payment=matched_payment).count() == 1
@@ -1,4 +1,4 @@
-from datetime import timedelta
+from datetime import datetime, timedelta
 from decimal import Decimal
 
 from django.utils import timezone
@@ -9,7 +9,9 @@ from dateutil.relativedelta import relativedelta
 from ..models import Donation, Donor, Recurrence
 from ..recurrence import (
     check_late_recurring_donors,
+    get_known_until_date,
     get_late_recurrences,
+    process_recurrence_batches,
     process_recurrence_on_donor,
 )
 from ..services import merge_donor_list
@@ -346,6 +348,48 @@ def test_late_recurrence_check():
     assert recurrence.cancel_date.date() == second_date.date()
 
 
+@pytest.mark.django_db
+def test_late_recurrences_by_interval():
+    now = timezone.now()
+    known_until = timezone.make_aware(
+        datetime.combine(get_known_until_date(now), datetime.min.time())
+    )
+    donor = DonorFactory.create()
+
+    def make_recurrence(interval, *dates, received=True, **kwargs):
+        recurrence = Recurrence.objects.create(
+            donor=donor,
+            method="banktransfer",
+            interval=interval,
+            amount=Decimal("10.00"),
+            start_date=dates[0],
+            **kwargs,
+        )
+        for date in dates:
+            Donation.objects.create(
+                donor=donor,
+                method="banktransfer",
+                amount=Decimal("10.00"),
+                timestamp=date,
+                received_timestamp=date if received else None,
+                completed=received,
+                recurrence=recurrence,
+            )
+        return recurrence
+
+    two_months_ago = known_until - relativedelta(months=2)
+    late = make_recurrence(1, two_months_ago - relativedelta(months=1), two_months_ago)
+    # Last donation is within the interval
+    make_recurrence(1, two_months_ago, known_until)
+    make_recurrence(3, two_months_ago)
+    # No received donations
+    make_recurrence(1, two_months_ago, received=False)
+    # Already canceled
+    make_recurrence(1, two_months_ago, cancel_date=two_months_ago)
+
+    assert list(get_late_recurrences(now)) == [late]
+
+
 @pytest.mark.django_db
 def test_breaking_recurrence():
     now = timezone.now()
@@ -437,3 +481,43 @@ def test_recurrence_streak_date(streaks, expected):
             donor.recurrences.all().order_by("start_date")[expected].start_date
         )
     assert date == expected_date
+
+
+@pytest.mark.django_db
+def test_process_recurrence_batches(django_assert_max_num_queries):
+    now = timezone.now().replace(day=15)
+    amount = Decimal("10.00")
+    donors = DonorFactory.create_batch(5)
+    for donor in donors:
+        for months in (3, 2, 1):
+            date = now - relativedelta(months=months)
+            Donation.objects.create(
+                donor=donor,
+                method="banktransfer",
+                amount=amount,
+                timestamp=date,
+                received_timestamp=date,
+                completed=True,
+            )
+    donor_ids = [donor.id for donor in donors]
+
+    # Time budget is used up before the first batch
+    assert (
+        process_recurrence_batches(
+            donor_ids, batch_size=2, time_budget=timedelta(seconds=-1)
+        )
+        == donor_ids
+    )
+
+    with django_assert_max_num_queries(25):
+        remaining = process_recurrence_batches(donor_ids, current_date=now)
+    assert remaining == []
+
+    for donor in donors:
+        recurrence = Recurrence.objects.get(donor=donor)
+        assert recurrence.donations.count() == 3
+        assert recurrence.interval == 1
+        assert recurrence.cancel_date is None
+        donor.refresh_from_db()
+        assert donor.recurring_amount == amount
+        assert donor.recurrence_streak_start == recurrence.start_date
@@ -0,0 +1,112 @@
+import random
+import time
+from collections import defaultdict
+from datetime import UTC, datetime, timedelta
+from decimal import Decimal
+
+import numpy as np
+import pytest
+
+from ..models import Donation
+from ..recurrence import find_donation_streaks, find_donation_streaks_batch
+from ..recurrence_detection import DAY_MICROSECONDS, detect_streaks
+
+
+def make_donations(rng, donor_count):
+    start_date = datetime(2015, 1, 1, tzinfo=UTC)
+    donations = []
+    for donor_id in range(1, donor_count + 1):
+        for _i in range(rng.randint(0, 4)):
+            interval = rng.choice([15, 30, 45, 91, 182, 365])
+            amount = Decimal(rng.choice(["5.00", "10", "10.00", "20.00"]))
+            method = rng.choice(["banktransfer", "paypal"])
+            project = rng.choice(["general", "fds"])
+            timestamp = start_date + timedelta(
+                days=rng.randint(0, 2000), seconds=rng.randint(0, 86400)
+            )
+            for _j in range(rng.randint(1, 30)):
+                # Duplicate transfers on the same day
+                for _k in range(2 if rng.random() < 0.05 else 1):
+                    donations.append(
+                        Donation(
+                            id=len(donations) + 1,
+                            donor_id=donor_id,
+                            amount=amount,
+                            method=method,
+                            project=project,
+                            received_timestamp=timestamp,
+                        )
+                    )
+                timestamp += timedelta(
+                    days=interval + rng.randint(-12, 12),
+                    seconds=rng.randint(-86400, 86400),
+                )
+                if rng.random() < 0.1:
+                    # Missed some payments
+                    timestamp += timedelta(days=rng.randint(0, 200))
+    rng.shuffle(donations)
+    return donations
+
+
+def get_streak_data(streaks):
+    return [
+        (
+            streak.interval,
+            [donation.id for donation in streak.donations],
+            streak.project,
+            streak.method,
+            streak.canceled,
+        )
+        for streak in streaks
+    ]
+
+
+def test_detect_streaks_equivalence():
+    rng = random.Random(42)
+    now = datetime(2021, 6, 1, tzinfo=UTC)
+    donations = make_donations(rng, 500)
+    donor_donations = defaultdict(list)
+    for donation in donations:
+        donor_donations[donation.donor_id].append(donation)
+
+    batch_streaks = find_donation_streaks_batch(donations, current_date=now)
+
+    streak_count = 0
+    for donor_id, donor_list in donor_donations.items():
+        expected = get_streak_data(find_donation_streaks(donor_list, now))
+        assert get_streak_data(batch_streaks.get(donor_id, [])) == expected
+        streak_count += len(expected)
+    assert streak_count > 100
+    assert set(batch_streaks) <= set(donor_donations)
+
+
+def test_detect_streaks_empty():
+    assert find_donation_streaks_batch([]) == {}
+    assert len(detect_streaks([], [], [], [], [])) == 0
+
+
+@pytest.mark.benchmark
+def test_detect_streaks_benchmark():
+    row_count = 1_000_000
+    per_donor = 20
+    rng = np.random.default_rng(42)
+    donor_ids = np.repeat(np.arange(row_count // per_donor), per_donor)
+    amounts = rng.choice([500, 1000, 2000], row_count // per_donor).repeat(per_donor)
+    methods = rng.choice(["banktransfer", "paypal"], row_count)
+    projects = np.zeros(row_count, dtype=np.int64)
+    start = rng.integers(0, 3000, row_count // per_donor).repeat(per_donor)
+    months = np.tile(np.arange(per_donor), row_count // per_donor)
+    jitter = rng.integers(-3 * DAY_MICROSECONDS, 3 * DAY_MICROSECONDS, row_count)
+    received = (
+        np.datetime64("2011-01-01", "us")
+        + (start + months * 30) * DAY_MICROSECONDS
+        + jitter
+    )
+
+    start_time = time.perf_counter()
+    streaks = detect_streaks(donor_ids, amounts, methods, projects, received)
+    duration = time.perf_counter() - start_time
+
+    assert len(streaks) > 0
+    assert streaks.offsets[-1] <= row_count
+    assert row_count / duration > 50_000
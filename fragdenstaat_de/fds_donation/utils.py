@@ -3,15 +3,24 @@ from decimal import ROUND_DOWN, ROUND_UP, Decimal
 
 from django.conf import settings
 from django.contrib.humanize.templatetags.humanize import intcomma
+from django.core.exceptions import EmptyResultSet
 from django.core.signing import BadSignature, SignatureExpired, TimestampSigner
-from django.db.models import Min
+from django.db import connection
 from django.template.defaultfilters import floatformat
 from django.utils.translation import gettext_lazy as _
 from django.utils.translation import ngettext_lazy
 
 from fragdenstaat_de.fds_newsletter.utils import subscribe_to_newsletter
 
-from .models import Donation, Donor, DonorEvent, Recurrence, update_donation_numbers
+from .models import (
+    DONOR_AGGREGATE_FIELDS,
+    Donation,
+    Donor,
+    DonorEvent,
+    Recurrence,
+    update_donation_numbers,
+    update_donor_aggregates,
+)
 
 MERGE_DONOR_FIELDS = [
     "salutation",
@@ -233,6 +242,7 @@ def merge_donors(candidates, primary_id, validated_data=None):
 
     # Clear duplicate flag
     merged_donor.duplicate = None
+    merged_donor.duplicate_score = None
 
     merged_donor.save()
 
@@ -255,13 +265,12 @@ def merge_donors(candidates, primary_id, validated_data=None):
     # Delete old donors
     Donor.objects.filter(id__in=old_donor_ids).delete()
 
-    # Recalculate stored aggregates
-    aggs = Donation.objects.filter(donor=merged_donor).aggregate(
-        first_donation=Min("timestamp"),
-    )
-    merged_donor.first_donation = aggs["first_donation"]
     merged_donor.save()
 
+    # Recalculate stored aggregates
+    update_donor_aggregates([merged_donor.id])
+    merged_donor.refresh_from_db(fields=DONOR_AGGREGATE_FIELDS)
+
     update_donation_numbers(merged_donor.id)
 
     detect_recurring_on_donor(merged_donor)
@@ -519,3 +528,69 @@ def make_presets(presets: list[int]) -> list[tuple[int, str]]:
         )
         for amount in presets
     ]
+
+
+DONATION_STATS_SQL = """
+WITH filtered AS MATERIALIZED ({filtered}),
+donation_stats AS (
+    SELECT
+        SUM(amount) AS amount_sum,
+        AVG(amount) AS amount_avg,
+        percentile_cont(0.5) WITHIN GROUP (ORDER BY amount) AS amount_median,
+        SUM(amount_received) AS amount_received_sum,
+        COUNT(DISTINCT donor_id) AS donor_count
+    FROM filtered
+),
+donor_stats AS (
+    SELECT SUM(recurring_amount) AS recurring_donor_amount
+    FROM {donor_table}
+    WHERE id IN (SELECT donor_id FROM filtered)
+),
+recurrence_stats AS (
+    SELECT
+        COUNT(*) AS recurring_count,
+        COUNT(*) FILTER (WHERE cancel_date IS NOT NULL) AS cancel_count,
+        SUM(amount / {interval}) AS recurring_monthly_amount,
+        SUM(amount / {interval}) FILTER (
+            WHERE cancel_date IS NULL
+        ) AS recurring_monthly_active_amount
+    FROM {recurrence_table}
+    WHERE id IN (SELECT recurrence_id FROM filtered)
+)
+SELECT * FROM donation_stats, donor_stats, recurrence_stats
+"""
+
+
+def get_donation_stats(queryset):
+    """
+    Returns summary statistics of the donations in the queryset,
+    computed in one query over the filtered donations.
+    """
+    columns = ("id", "donor_id", "recurrence_id", "amount", "amount_received")
+    try:
+        filtered_sql, params = (
+            queryset.order_by().values(*columns).query.sql_with_params()
+        )
+    except EmptyResultSet:
+        # Empty filter like pk__in=[], run the statistics on no rows
+        empty = Donation.objects.filter(pk__isnull=True).values(*columns)
+        filtered_sql, params = empty.query.sql_with_params()
+    sql = DONATION_STATS_SQL.format(
+        filtered=filtered_sql,
+        donor_table=connection.ops.quote_name(Donor._meta.db_table),
+        recurrence_table=connection.ops.quote_name(Recurrence._meta.db_table),
+        interval=connection.ops.quote_name("interval"),
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        names = [col[0] for col in cursor.description]
+        stats = dict(zip(names, cursor.fetchone(), strict=True))
+
+    for key in (
+        "amount_avg",
+        "amount_median",
+        "recurring_monthly_amount",
+        "recurring_monthly_active_amount",
+    ):
+        stats[key] = round(stats[key]) if stats[key] is not None else "-"
+    return stats
@@ -26,7 +26,14 @@ from fragdenstaat_de.fds_newsletter.models import Subscriber
 from fragdenstaat_de.theme.admin import PublicBodyAdmin
 
 from .forms import RandomSplitForm
-from .models import ContinuousMailing, EmailTemplate, Mailing, MailingMessage
+from .models import (
+    ContinuousMailing,
+    EmailTemplate,
+    Mailing,
+    MailingMessage,
+    MailingOpenStats,
+    MailingShard,
+)
 from .tasks import continue_sending
 from .utils import add_fake_context
 
@@ -131,33 +138,58 @@ class MailingAdminMixin:
             return "n/a"
         if not (obj.sending or obj.sent):
             return "..."
-        if obj.total_recipients == 0:
+        try:
+            open_rate = obj.open_stats.open_rate
+        except MailingOpenStats.DoesNotExist:
+            # Stats not yet refreshed since sending started
+            open_rate = None
+            if obj.total_recipients:
+                open_rate = obj.open_count / obj.total_recipients
+        if open_rate is None:
             return "-"
-        return "{}%".format(
-            formats.number_format(
-                obj.open_count / obj.total_recipients * 100, decimal_pos=3
-            )
-        )
+        return "{}%".format(formats.number_format(open_rate * 100, decimal_pos=3))
 
     @admin.display(description=_("Recipients"))
     def recipients(self, obj):
         if obj.total_recipients == 0 and obj.newsletter_id:
-            if not hasattr(self, "_newsletter_recipients_cache"):
-                self._newsletter_recipients_cache = {}
-            if obj.newsletter_id and obj.segments.count() == 0:
-                if obj.newsletter_id not in self._newsletter_recipients_cache:
-                    self._newsletter_recipients_cache[obj.newsletter_id] = (
-                        obj.get_recipient_count()
-                        if obj.newsletter_id
-                        else obj.get_recipient_count()
-                    )
-                return self._newsletter_recipients_cache[obj.newsletter_id]
-            return obj.get_recipient_count()
+            # Counted in the background, see update_recipient_count task
+            if obj.recipient_count is None:
+                return "..."
+            if obj.is_recipient_count_stale:
+                return format_html(
+                    '<span title="{}">~{}</span>',
+                    formats.localize(obj.recipient_count_updated),
+                    obj.recipient_count,
+                )
+            return obj.recipient_count
         return obj.total_recipients
 
 
+class MailingShardInline(admin.TabularInline):
+    model = MailingShard
+    extra = 0
+    can_delete = False
+    fields = (
+        "start_id",
+        "end_id",
+        "scheduled",
+        "started",
+        "heartbeat",
+        "finished",
+        "failed",
+        "sent_count",
+        "failed_count",
+        "task_count",
+    )
+    readonly_fields = fields
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+
 class MailingAdmin(MailingAdminMixin, admin.ModelAdmin):
     raw_id_fields = ("email_template",)
+    inlines = [MailingShardInline]
     filter_horizontal = ("segments",)
     list_display = (
         "name",
@@ -179,6 +211,7 @@ class MailingAdmin(MailingAdminMixin, admin.ModelAdmin):
         "publish",
         "sending",
         "sent",
+        "failed",
     )
     readonly_fields = (
         "created",
@@ -190,6 +223,12 @@ class MailingAdmin(MailingAdminMixin, admin.ModelAdmin):
         "open_count",
         "open_log_timestamp",
         "sending",
+        "failed",
+        "preparation_started",
+        "preparation_duration",
+        "sending_throughput",
+        "send_rate",
+        "projected_completion",
     )
     fieldsets = (
         (
@@ -212,6 +251,7 @@ class MailingAdmin(MailingAdminMixin, admin.ModelAdmin):
                     "tracking",
                     "publish",
                     "sending_date",
+                    "delivery_window",
                     "ready",
                 )
             },
@@ -224,7 +264,13 @@ class MailingAdmin(MailingAdminMixin, admin.ModelAdmin):
                     "submitted",
                     "sending",
                     "sent",
+                    "failed",
                     "sent_date",
+                    "preparation_started",
+                    "preparation_duration",
+                    "sending_throughput",
+                    "send_rate",
+                    "projected_completion",
                     "open_count",
                     "open_log_timestamp",
                 )
@@ -280,7 +326,9 @@ class MailingAdmin(MailingAdminMixin, admin.ModelAdmin):
             ),
         )
 
-        return qs.prefetch_related("email_template", "newsletter", "segments")
+        return qs.select_related("open_stats").prefetch_related(
+            "email_template", "newsletter", "segments"
+        )
 
     def save_model(self, request, obj, form, change):
         if not change:
@@ -294,19 +342,34 @@ class MailingAdmin(MailingAdminMixin, admin.ModelAdmin):
             # We are adding or still changing
             if obj.newsletter and obj.newsletter.default_segment:
                 obj.segments.add(obj.newsletter.default_segment)
+        if not obj.sending and not obj.sent:
+            obj.schedule_recipient_count_update()
 
     def changelist_view(self, request, extra_context=None):
         if extra_context is None:
             extra_context = {}
         extra_context["random_split_form"] = RandomSplitForm()
+        Mailing.schedule_stale_recipient_counts()
         return super().changelist_view(request, extra_context=extra_context)
 
     @admin.display(description=_("Segments"))
     def segment_list(self, obj):
         return ", ".join([segment.name for segment in obj.segments.all()]) or "-"
 
+    @admin.display(description=_("Sending throughput"))
+    def sending_throughput(self, obj):
+        stats = obj.get_sending_stats()
+        if stats["messages_per_second"] is None:
+            return "-"
+        return _("{rate} messages/s, {tasks} tasks per 1000 messages").format(
+            rate=formats.number_format(stats["messages_per_second"], decimal_pos=1),
+            tasks=formats.number_format(stats["tasks_per_thousand"], decimal_pos=1),
+        )
+
     @admin.display(description=_("Status"))
     def status(self, obj):
+        if obj.failed and not obj.sending:
+            return _("Failed")
         if not (obj.sending or obj.sent):
             if obj.submitted:
                 return _("Submitted")
@@ -476,7 +539,7 @@ class ContinuousMailingAdmin(MailingAdminMixin, admin.ModelAdmin):
                 "recipients", filter=models.Q(recipients__sent__isnull=False)
             ),
         )
-        return qs.prefetch_related("email_template")
+        return qs.select_related("open_stats").prefetch_related("email_template")
 
     def save_model(self, request, obj, form, change):
         obj.is_continuous = True
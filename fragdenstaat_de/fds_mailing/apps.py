@@ -1,4 +1,5 @@
 from django.apps import AppConfig
+from django.db.models.signals import m2m_changed, post_save
 from django.utils.translation import gettext_lazy as _
 
 
@@ -16,12 +17,17 @@ class FdsMailingConfig(AppConfig):
         from froide.bounce.signals import email_bounced
         from froide.helper.email_sending import mail_middleware_registry
 
+        from fragdenstaat_de.fds_newsletter.models import Segment
+
         from . import (
             actions,  # noqa: F401
             preview,  # noqa: F401
         )
+        from .listeners import segment_changed
         from .middleware import EmailTemplateMiddleware
         from .utils import handle_bounce
 
         mail_middleware_registry.register(EmailTemplateMiddleware())
         email_bounced.connect(handle_bounce)
+        post_save.connect(segment_changed, sender=Segment)
+        m2m_changed.connect(segment_changed, sender=Segment.tags.through)
@@ -298,6 +298,7 @@ class RawCodePlugin(CMSPluginBase):
     name = _("Raw Code")
     allow_children = False
     cache = False
+    context_branching = True
     render_template = "email/raw_code.html"
 
     def render(self, context, instance, placeholder):
@@ -309,6 +310,9 @@ class RawCodePlugin(CMSPluginBase):
         template = Template(instance.code)
         return template.render(Context(context))
 
+    def get_context_branch(self, context, instance):
+        return self._render_code(context, instance)
+
     def render_text(self, context, instance):
         web_html = self.render_web_html(context, instance)
         return convert_html_to_text(web_html)
@@ -370,6 +374,7 @@ class ConditionPlugin(CMSPluginBase):
     module = _("Context")
     name = _("Condition")
     cache = False
+    context_branching = True
     allow_children = True
     render_template_template = "email/condition.html"
 
@@ -396,6 +401,9 @@ class ConditionPlugin(CMSPluginBase):
             result = not result
         return result
 
+    def get_context_branch(self, context, instance):
+        return self.should_render(instance, context)
+
     def render_text(self, context, instance):
         if self.should_render(instance, context):
             children = get_plugin_children(instance)
@@ -87,6 +87,12 @@ class RandomSplitForm(forms.Form):
         required=False,
         initial=True,
     )
+    seed = forms.IntegerField(
+        label=_("Random seed"),
+        required=False,
+        min_value=0,
+        help_text=_("Leave empty for a new random split."),
+    )
 
     def __init__(self, *arg, **kwargs):
         super().__init__(*arg, **kwargs)
@@ -119,6 +125,7 @@ class RandomSplitForm(forms.Form):
             self.cleaned_data["segments"],
             self.cleaned_data["groups"],
             add_remaining=self.cleaned_data["add_remaining"],
+            seed=self.cleaned_data["seed"],
         )
 
         for segment in target_segments:
@@ -129,3 +136,4 @@ class RandomSplitForm(forms.Form):
                 publish=False,
             )
             mailing.segments.add(segment)
+            mailing.schedule_recipient_count_update()
@@ -0,0 +1,21 @@
+def segment_changed(sender, instance, **kwargs):
+    """
+    Recount draft mailings whose audience depends on a segment
+    whose tags or settings changed.
+    """
+    from fragdenstaat_de.fds_newsletter.models import Segment
+
+    from .models import Mailing
+
+    action = kwargs.get("action")
+    if action is not None and action not in ("post_add", "post_remove", "post_clear"):
+        return
+    if not isinstance(instance, Segment):
+        return
+    # Segments include the subscribers of their subtree
+    segments = [instance, *instance.get_ancestors()]
+    mailings = Mailing.objects.filter(
+        sending=False, sent=False, newsletter__isnull=False, segments__in=segments
+    ).distinct()
+    for mailing in mailings:
+        mailing.schedule_recipient_count_update()
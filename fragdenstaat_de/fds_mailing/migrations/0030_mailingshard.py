@@ -0,0 +1,34 @@
+# Generated by Django 5.2.15 on 2026-10-17 10:12
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fds_mailing', '0029_alter_mailing_sender_email_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MailingShard',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start_id', models.PositiveBigIntegerField()),
+                ('end_id', models.PositiveBigIntegerField()),
+                ('created', models.DateTimeField(default=django.utils.timezone.now)),
+                ('started', models.DateTimeField(blank=True, null=True)),
+                ('finished', models.DateTimeField(blank=True, null=True)),
+                ('sent_count', models.PositiveIntegerField(default=0)),
+                ('failed_count', models.PositiveIntegerField(default=0)),
+                ('mailing', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shards', to='fds_mailing.mailing')),
+            ],
+            options={
+                'verbose_name': 'mailing shard',
+                'verbose_name_plural': 'mailing shards',
+                'ordering': ('mailing', 'start_id'),
+            },
+        ),
+    ]
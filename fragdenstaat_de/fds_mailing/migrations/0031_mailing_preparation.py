@@ -0,0 +1,23 @@
+# Generated by Django 5.2.15 on 2026-10-17 11:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fds_mailing', '0030_mailingshard'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mailing',
+            name='preparation_started',
+            field=models.DateTimeField(blank=True, editable=False, null=True, verbose_name='preparation started'),
+        ),
+        migrations.AddField(
+            model_name='mailing',
+            name='preparation_duration',
+            field=models.DurationField(blank=True, editable=False, null=True, verbose_name='preparation duration'),
+        ),
+    ]
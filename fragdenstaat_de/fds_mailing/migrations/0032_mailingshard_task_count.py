@@ -0,0 +1,18 @@
+# Generated by Django 5.2.15 on 2026-10-17 11:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fds_mailing', '0031_mailing_preparation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mailingshard',
+            name='task_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.15 on 2026-10-17 12:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fds_mailing', '0032_mailingshard_task_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mailing',
+            name='delivery_window',
+            field=models.DurationField(blank=True, help_text='Spread delivery over this time span, e.g. 2:00:00.', null=True, verbose_name='delivery window'),
+        ),
+        migrations.AddField(
+            model_name='mailing',
+            name='send_rate',
+            field=models.FloatField(blank=True, editable=False, help_text='Messages per second', null=True, verbose_name='send rate'),
+        ),
+        migrations.AddField(
+            model_name='mailing',
+            name='projected_completion',
+            field=models.DateTimeField(blank=True, editable=False, null=True, verbose_name='projected completion'),
+        ),
+        migrations.AddField(
+            model_name='mailingshard',
+            name='scheduled',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
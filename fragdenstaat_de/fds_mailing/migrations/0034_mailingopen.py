@@ -0,0 +1,28 @@
+# Generated by Django 5.2.15 on 2026-10-17 13:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fds_mailing', '0033_mailing_delivery_schedule'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MailingOpen',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('token_hash', models.BigIntegerField()),
+                ('first_seen', models.DateTimeField()),
+                ('mailing', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='opens', to='fds_mailing.mailing')),
+            ],
+            options={
+                'verbose_name': 'mailing open',
+                'verbose_name_plural': 'mailing opens',
+                'constraints': [models.UniqueConstraint(fields=('mailing', 'token_hash'), name='unique_mailing_open_token')],
+            },
+        ),
+    ]
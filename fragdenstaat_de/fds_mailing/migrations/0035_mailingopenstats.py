@@ -0,0 +1,64 @@
+# Generated by Django 5.2.15 on 2026-10-17 14:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+CREATE_VIEW = """
+CREATE MATERIALIZED VIEW fds_mailing_mailingopenstats AS
+SELECT
+    m.id AS mailing_id,
+    -- Mailings sent before unique opens were recorded only have open_count
+    COALESCE(o.unique_opens, m.open_count) AS unique_opens,
+    COALESCE(r.recipient_count, 0) AS recipient_count,
+    o.first_open,
+    o.last_open
+FROM fds_mailing_mailing m
+LEFT JOIN (
+    SELECT
+        mailing_id,
+        COUNT(*) AS unique_opens,
+        MIN(first_seen) AS first_open,
+        MAX(first_seen) AS last_open
+    FROM fds_mailing_mailingopen
+    GROUP BY mailing_id
+) o ON o.mailing_id = m.id
+LEFT JOIN (
+    SELECT mailing_id, COUNT(*) AS recipient_count
+    FROM fds_mailing_mailingmessage
+    WHERE sent IS NOT NULL
+    GROUP BY mailing_id
+) r ON r.mailing_id = m.id
+WHERE m.tracking AND (m.sending OR m.sent);
+
+CREATE UNIQUE INDEX fds_mailing_mailingopenstats_mailing_id
+    ON fds_mailing_mailingopenstats (mailing_id);
+"""
+
+DROP_VIEW = "DROP MATERIALIZED VIEW IF EXISTS fds_mailing_mailingopenstats;"
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fds_mailing', '0034_mailingopen'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MailingOpenStats',
+            fields=[
+                ('mailing', models.OneToOneField(on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='open_stats', serialize=False, to='fds_mailing.mailing')),
+                ('unique_opens', models.PositiveIntegerField()),
+                ('recipient_count', models.PositiveIntegerField()),
+                ('first_open', models.DateTimeField(null=True)),
+                ('last_open', models.DateTimeField(null=True)),
+            ],
+            options={
+                'verbose_name': 'mailing open stats',
+                'verbose_name_plural': 'mailing open stats',
+                'db_table': 'fds_mailing_mailingopenstats',
+                'managed': False,
+            },
+        ),
+        migrations.RunSQL(CREATE_VIEW, DROP_VIEW),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.15 on 2026-10-17 14:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fds_mailing', '0035_mailingopenstats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mailing',
+            name='recipient_count',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True, verbose_name='recipient count'),
+        ),
+        migrations.AddField(
+            model_name='mailing',
+            name='recipient_count_updated',
+            field=models.DateTimeField(blank=True, editable=False, null=True, verbose_name='recipient count updated'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.15 on 2026-10-17 20:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fds_mailing', '0036_mailing_recipient_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mailing',
+            name='failed',
+            field=models.BooleanField(default=False, editable=False, verbose_name='failed'),
+        ),
+        migrations.AddField(
+            model_name='mailingshard',
+            name='failed',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='mailingshard',
+            name='heartbeat',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.2.15 on 2026-10-17 20:20
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fds_mailing', '0037_mailing_failed_shard_heartbeat'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mailing',
+            name='updated',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+    ]
@@ -1,13 +1,17 @@
 import logging
 import re
+from collections import Counter
+from datetime import timedelta
+from itertools import batched
 
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
 from django.core.exceptions import ValidationError
 from django.core.mail import EmailMultiAlternatives, mail_managers
-from django.db import models, transaction
+from django.db import connection, models, transaction
 from django.db.models.query import QuerySet
 from django.template import Context, Template
 from django.template.loader import render_to_string
@@ -28,12 +32,16 @@ from froide.helper.email_sending import EmailContent, mail_registry, send_mail
 from froide.helper.email_utils import make_address
 
 from fragdenstaat_de.fds_cms.utils import get_alias_placeholder, get_request
-from fragdenstaat_de.fds_donation.models import Donor
+from fragdenstaat_de.fds_donation.models import Donor, get_donation_aggregates
 from fragdenstaat_de.fds_newsletter.models import Newsletter, Segment, Subscriber
+from fragdenstaat_de.fds_newsletter.tag_index import tag_index
 from fragdenstaat_de.fds_newsletter.utils import get_subscribers
+from fragdenstaat_de.theme.email_backend import bulk_email_sending
 
 from . import mailing_submitted
 from .pixel_log import generate_random_unique_pixel_url
+from .rendering import CompiledEmailTemplate
+from .throttle import DeliveryScheduler
 from .utils import get_url_tagger, render_text, render_web_html
 from .validators import validate_sender_domain
 
@@ -50,6 +58,20 @@ EMAIL_TEMPLATE_CHOICES = [
 
 COLLAPSE_NEWLINES = re.compile(r"((?:\r?\n){3,})")
 
+MAILING_SHARD_SIZE = getattr(settings, "MAILING_SHARD_SIZE", 1000)
+# Shards without progress for this long are considered abandoned
+MAILING_SHARD_LEASE = timedelta(minutes=10)
+# Sending shards renew their claim at most this often
+MAILING_SHARD_HEARTBEAT = timedelta(minutes=1)
+MAILING_BATCH_SIZE = 2000
+# Cached recipient counts of draft mailings older than this are refreshed
+RECIPIENT_COUNT_MAX_AGE = timedelta(hours=1)
+# Only drafts edited within this time are refreshed in the background
+RECIPIENT_COUNT_DRAFT_AGE = timedelta(days=30)
+# Stale counts are refreshed at most once in this many seconds
+RECIPIENT_COUNT_DEBOUNCE = 60 * 5
+RECIPIENT_COUNT_DEBOUNCE_KEY = "fds_mailing:stale_recipient_counts"
+
 
 def get_default_sender_email():
     return settings.SITE_EMAIL
@@ -138,14 +160,19 @@ class EmailTemplate(models.Model):
     def update_context(self, ctx):
         ctx.update({"subject": self.subject, "preheader": self.preheader})
 
+    def get_body_html_template(
+        self, context, template="fds_mailing/render_base.html"
+    ) -> Template:
+        template_str = self.render_email_html(context=context, template=template)
+        return Template(template_str)
+
     def get_body_html(
         self, context=None, preview=False, template="fds_mailing/render_base.html"
     ):
         if context is None:
             context = {}
         self.update_context(context)
-        template_str = self.render_email_html(context=context, template=template)
-        template = Template(template_str)
+        template = self.get_body_html_template(context, template=template)
         html = template.render(Context(context))
         if "{{" in html or "}}" in html and not preview:
             raise ValueError("Likely variable definition broken")
@@ -179,7 +206,7 @@ class EmailTemplate(models.Model):
         html = template.render(Context(context))
         return html
 
-    def get_body_text(self, context=None, preview=False):
+    def get_body_text_template(self, context) -> Template:
         template_str = self.render_email_text(context)
         template_str = "{top}{body}{bottom}{footer}".format(
             top="{% autoescape off %}",
@@ -187,10 +214,13 @@ class EmailTemplate(models.Model):
             bottom="{% endautoescape %}",
             footer='\r\n\r\n{% include "emails/footer.txt" %}',
         )
+        return Template(template_str)
+
+    def get_body_text(self, context=None, preview=False):
+        template = self.get_body_text_template(context)
         if context is None:
             context = {}
         self.update_context(context)
-        template = Template(template_str)
         html = template.render(Context(context))
         if "{{" in html or "}}" in html and not preview:
             raise ValueError("Likely variable definition broken")
@@ -214,16 +244,13 @@ class EmailTemplate(models.Model):
             context_vars.extend(intent.get_context({}, preview=True).keys())
         return context_vars
 
+    @cached_property
+    def compiled_template(self) -> CompiledEmailTemplate:
+        return CompiledEmailTemplate(self)
+
     def get_email_content(self, context, preview=False):
-        if self.mail_intent:
-            intent = self.get_mail_intent()
-            if intent is not None:
-                context = intent.get_context(context)
-        ctx = Context(context)
-        subject = self.subject_template.render(ctx)
-        text = self.get_body_text(context, preview=preview)
-        html = self.get_body_html(context, preview=preview)
-        return EmailContent(subject, text, html)
+        # Placeholder is rendered once per condition branch of this instance
+        return self.compiled_template.get_email_content(context, preview=preview)
 
     def send_to_user(self, user):
         context = {"user": user, "name": user.get_full_name()}
@@ -432,6 +459,7 @@ class Mailing(models.Model):
         related_name="mailings_created",
     )
     created = models.DateTimeField(default=timezone.now, editable=False)
+    updated = models.DateTimeField(auto_now=True)
 
     publish = models.BooleanField(
         default=False,
@@ -463,6 +491,9 @@ class Mailing(models.Model):
     sending = models.BooleanField(
         default=False, verbose_name=_("sending"), editable=False
     )
+    failed = models.BooleanField(
+        default=False, verbose_name=_("failed"), editable=False
+    )
 
     open_count = models.PositiveIntegerField(
         default=0,
@@ -473,6 +504,37 @@ class Mailing(models.Model):
         null=True,
         blank=True,
     )
+    delivery_window = models.DurationField(
+        verbose_name=_("delivery window"),
+        blank=True,
+        null=True,
+        help_text=_("Spread delivery over this time span, e.g. 2:00:00."),
+    )
+    send_rate = models.FloatField(
+        verbose_name=_("send rate"),
+        blank=True,
+        null=True,
+        editable=False,
+        help_text=_("Messages per second"),
+    )
+    projected_completion = models.DateTimeField(
+        verbose_name=_("projected completion"), blank=True, null=True, editable=False
+    )
+    preparation_started = models.DateTimeField(
+        verbose_name=_("preparation started"), blank=True, null=True, editable=False
+    )
+    preparation_duration = models.DurationField(
+        verbose_name=_("preparation duration"), blank=True, null=True, editable=False
+    )
+    recipient_count = models.PositiveIntegerField(
+        verbose_name=_("recipient count"), blank=True, null=True, editable=False
+    )
+    recipient_count_updated = models.DateTimeField(
+        verbose_name=_("recipient count updated"),
+        blank=True,
+        null=True,
+        editable=False,
+    )
 
     all_mailings = MailingBaseManager()
     objects = MailingManager()
@@ -528,35 +590,84 @@ class Mailing(models.Model):
     def get_recipient_count(self):
         if not hasattr(self, "_recipient_count"):
             if self.newsletter:
-                self._recipient_count = self.get_subscribers().count()
+                self._recipient_count = tag_index.count_subscribers(
+                    self.newsletter, list(self.segments.all())
+                )
             else:
                 self._recipient_count = self.recipients.count()
         return self._recipient_count
 
+    def update_recipient_count(self):
+        if hasattr(self, "_recipient_count"):
+            del self._recipient_count
+        self.recipient_count = self.get_recipient_count()
+        self.recipient_count_updated = timezone.now()
+        self.save(update_fields=["recipient_count", "recipient_count_updated"])
+
+    def schedule_recipient_count_update(self):
+        from .tasks import update_recipient_count
+
+        transaction.on_commit(lambda: update_recipient_count.delay(self.id))
+
+    @classmethod
+    def schedule_stale_recipient_counts(cls):
+        from .tasks import update_stale_recipient_counts
+
+        if not cache.add(RECIPIENT_COUNT_DEBOUNCE_KEY, True, RECIPIENT_COUNT_DEBOUNCE):
+            return
+        transaction.on_commit(update_stale_recipient_counts.delay)
+
+    @property
+    def is_recipient_count_stale(self):
+        if self.recipient_count_updated is None:
+            return True
+        return timezone.now() - self.recipient_count_updated > RECIPIENT_COUNT_MAX_AGE
+
     def get_subscribers(self):
         return get_subscribers(self.newsletter, self.segments.all())
 
-    def auto_populate(self):
+    def auto_populate(self, batch_size=MAILING_BATCH_SIZE):
         if not self.newsletter:
             return
 
         # Remove and re-add all newsletter recipients
         self.recipients.all().delete()
 
-        for subscriber in self.get_subscribers():
-            MailingMessage.objects.create(
-                mailing=self,
-                subscriber=subscriber,
-                name=subscriber.get_name(),
-                email=subscriber.get_email(),
+        # Subscriber query may be a union, so resolve ids first
+        subscriber_ids = list(self.get_subscribers().values_list("id", flat=True))
+        for id_batch in batched(subscriber_ids, batch_size):
+            subscribers = Subscriber.objects.filter(id__in=id_batch).select_related(
+                "user"
             )
+            MailingMessage.objects.bulk_create(
+                [
+                    MailingMessage(
+                        mailing=self,
+                        subscriber=subscriber,
+                        name=subscriber.get_name(),
+                        email=subscriber.get_email(),
+                    )
+                    for subscriber in subscribers
+                ]
+            )
+
+    def finalize_recipients(self, batch_size=MAILING_BATCH_SIZE):
+        recipients = self.recipients.select_related(
+            "donor", "user", "subscriber", "subscriber__user"
+        ).order_by("id")
+        for recipient_batch in batched(
+            recipients.iterator(chunk_size=batch_size), batch_size
+        ):
+            for recipient in recipient_batch:
+                recipient.finalize()
+            MailingMessage.objects.bulk_update(recipient_batch, ["name", "email"])
 
     def finalize(self):
+        self.preparation_started = timezone.now()
         self.auto_populate()
-
-        for recipient in self.recipients.all():
-            recipient.finalize()
-            recipient.save()
+        self.finalize_recipients()
+        self.preparation_duration = timezone.now() - self.preparation_started
+        self.save(update_fields=["preparation_started", "preparation_duration"])
 
     @property
     def mailing_ident(self):
@@ -565,6 +676,10 @@ class Mailing(models.Model):
             return f"mailing-{date_str}-{self.id}"
         return f"mailing--{self.id}"
 
+    @cached_property
+    def url_tagger(self):
+        return get_url_tagger(self.mailing_ident)
+
     def get_email_content(self, context) -> EmailContent:
         if not self.email_template:
             raise ValueError("No email template set")
@@ -575,7 +690,7 @@ class Mailing(models.Model):
             return email_content
 
         # Add campaign param to all URLs
-        url_tagger = get_url_tagger(self.mailing_ident)
+        url_tagger = self.url_tagger
         text = email_content.text
         if text:
             text = url_tagger(text)
@@ -603,10 +718,7 @@ class Mailing(models.Model):
         )
         mailing_submitted.send(sender=self, mailing=self)
 
-    def send(self):
-        if self.sending or self.sent or not self.submitted:
-            return
-
+    def get_sendable_recipients(self):
         recipients = self.recipients.all()
 
         if self.newsletter:
@@ -615,6 +727,69 @@ class Mailing(models.Model):
                 subscriber__newsletter=self.newsletter,
                 subscriber__subscribed__isnull=False,
             )
+        return recipients
+
+    def get_send_rate(self, recipient_count):
+        rate = getattr(settings, "MAILING_SEND_RATE", None)
+        if self.delivery_window and recipient_count:
+            window_rate = recipient_count / self.delivery_window.total_seconds()
+            rate = min(rate, window_rate) if rate else window_rate
+        return rate
+
+    def get_delivery_scheduler(self, **kwargs):
+        # Shared by all shards of this mailing
+        kwargs.setdefault("key", "mailing:{}".format(self.id))
+        return DeliveryScheduler.from_settings(rate=self.send_rate, **kwargs)
+
+    def create_shards(self, shard_size=None):
+        if shard_size is None:
+            shard_size = MAILING_SHARD_SIZE
+        recipients = list(
+            self.get_sendable_recipients()
+            .filter(sent__isnull=True)
+            .order_by("id")
+            .values_list("id", "email")
+        )
+        self.send_rate = self.get_send_rate(len(recipients))
+        scheduler = self.get_delivery_scheduler()
+        # Schedule every shard at the planned send time of its first message
+        offsets = scheduler.plan(email for _id, email in recipients)
+        start = timezone.now()
+        shards = []
+        for chunk in batched(zip(recipients, offsets, strict=True), shard_size):
+            (start_id, _email), first_offset = chunk[0]
+            (end_id, _email), _offset = chunk[-1]
+            shards.append(
+                MailingShard(
+                    mailing=self,
+                    start_id=start_id,
+                    end_id=end_id,
+                    scheduled=start + timedelta(seconds=first_offset),
+                )
+            )
+        self.projected_completion = None
+        if offsets and scheduler.is_throttled:
+            self.projected_completion = start + timedelta(seconds=offsets[-1])
+        self.save(update_fields=["send_rate", "projected_completion"])
+        return MailingShard.objects.bulk_create(shards)
+
+    def dispatch_shards(self, shards):
+        from .tasks import send_mailing_shard
+
+        now = timezone.now()
+        for shard in shards:
+            eta = shard.scheduled if shard.scheduled and shard.scheduled > now else None
+            transaction.on_commit(
+                lambda shard_id=shard.id, eta=eta: send_mailing_shard.apply_async(
+                    (shard_id,), queue=settings.EMAIL_BULK_QUEUE, eta=eta
+                )
+            )
+
+    def send(self):
+        if self.sending or self.sent or not self.submitted:
+            return
+
+        recipients = self.get_sendable_recipients()
 
         logger.info(
             _("Sending %(mailing)s to %(count)d people"),
@@ -623,22 +798,75 @@ class Mailing(models.Model):
         self.sending = True
         self.save()
 
-        context = self.get_email_context()
-
-        try:
-            for recipient in recipients:
-                recipient.send(context)
-
-            self.sent = True
-            self.sent_date = timezone.now()
-
-        except Exception:
-            logger.exception("Mailing %s sending failed", self.name)
-            mail_managers("Sending out {} partly failed".format(self.name), "")
+        shards = self.create_shards()
+        if not shards:
+            self.finish_sending()
+            return
+        self.dispatch_shards(shards)
+
+    def finish_sending(self):
+        """
+        Mark mailing as sent once all of its shards are finished or as
+        failed once the remaining shards failed.
+        Called by every shard when it is done, the last one wins.
+        """
+        with transaction.atomic():
+            mailing = Mailing.all_mailings.select_for_update().get(id=self.id)
+            if mailing.sent:
+                return False
+            shards = mailing.shards.filter(finished__isnull=True)
+            if shards.filter(failed__isnull=True).exists():
+                return False
+            if shards.exists():
+                mailing.failed = True
+            else:
+                mailing.sent = True
+                mailing.sent_date = timezone.now()
+            mailing.sending = False
+            mailing.save(update_fields=["sent", "sent_date", "sending", "failed"])
+        self.sent = mailing.sent
+        self.sent_date = mailing.sent_date
+        self.sending = mailing.sending
+        self.failed = mailing.failed
+        return True
 
-        finally:
-            self.sending = False
-            self.save()
+    def get_sending_stats(self):
+        stats = self.shards.aggregate(
+            started=models.Min("started"),
+            finished=models.Max("finished"),
+            sent_count=models.Sum("sent_count"),
+            task_count=models.Sum("task_count"),
+        )
+        sent_count = stats["sent_count"] or 0
+        stats["messages_per_second"] = None
+        stats["tasks_per_thousand"] = None
+        if stats["started"] and stats["finished"] and sent_count:
+            duration = (stats["finished"] - stats["started"]).total_seconds()
+            if duration > 0:
+                stats["messages_per_second"] = sent_count / duration
+        if sent_count:
+            stats["tasks_per_thousand"] = (stats["task_count"] or 0) * 1000 / sent_count
+        return stats
+
+    def continue_sending(self):
+        """
+        Resend unfinished shards, e.g. after a worker crashed or a shard
+        failed. Shards still claimed by a running worker are left to it.
+        Recipients that did not end up in any shard get new shards.
+        """
+        unfinished = self.shards.filter(finished__isnull=True)
+        unfinished.filter(failed__isnull=False).update(failed=None)
+        shards = list(unfinished)
+        if not shards:
+            shards = self.create_shards()
+        if not shards:
+            self.finish_sending()
+            return
+        if not self.sending or self.failed:
+            self.sending = True
+            self.failed = False
+            self.save(update_fields=["sending", "failed"])
+        self.dispatch_shards([shard for shard in shards if not shard.is_claimed()])
 
 
 class ContinuousMailingManager(MailingBaseManager):
@@ -727,7 +955,9 @@ class MailingMessage(models.Model):
     def __str__(self):
         return "MailingRecipient  %s (%s)" % (self.email, self.mailing)
 
-    def get_email_context(self):
+    def get_email_context(self, resolver=None):
+        if resolver is None:
+            resolver = RecipientContextResolver()
         ctx = {"user": self.user, "donor": self.donor}
         # Try to find a user
         if not self.user and self.subscriber and self.subscriber.user:
@@ -737,19 +967,20 @@ class MailingMessage(models.Model):
 
         # Try to find a donor
         if ctx["user"] and not ctx.get("donor"):
-            ctx["donor"] = Donor.objects.filter(user=ctx["user"]).first()
+            ctx["donor"] = resolver.get_donor_by_user(ctx["user"])
 
         if self.subscriber and not ctx.get("donor"):
-            ctx["donor"] = Donor.objects.filter(subscriber=self.subscriber).first()
+            ctx["donor"] = resolver.get_donor_by_subscriber(self.subscriber)
 
         if not ctx["donor"] and self.subscriber and self.subscriber.email:
-            ctx["donor"] = Donor.objects.filter(
-                email=self.subscriber.email, email_confirmed__isnull=False
-            ).first()
+            ctx["donor"] = resolver.get_donor_by_email(self.subscriber.email)
 
-        for obj in (self.subscriber, ctx["donor"], ctx["user"]):
-            if hasattr(obj, "get_email_context"):
-                ctx.update(obj.get_email_context())
+        if self.subscriber:
+            ctx.update(self.subscriber.get_email_context())
+        if ctx["donor"]:
+            ctx.update(resolver.get_donor_email_context(ctx["donor"]))
+        if hasattr(ctx["user"], "get_email_context"):
+            ctx.update(ctx["user"].get_email_context())
         if "name" not in ctx:
             ctx["name"] = self.name
 
@@ -779,7 +1010,18 @@ class MailingMessage(models.Model):
             self.email = self.subscriber.get_email()
             self.name = self.subscriber.get_name()
 
-    def send(self, mailing_context=None, extra_kwargs=None, force=False):
+    def send(
+        self,
+        mailing_context=None,
+        extra_kwargs=None,
+        force=False,
+        resolver=None,
+        mark_sent=True,
+    ):
+        """
+        Sends the message. With mark_sent=False the caller records the
+        sent date, e.g. once buffered messages have been enqueued.
+        """
         if self.sent is not None:
             raise Exception("Tried sending already sent mailing message!")
 
@@ -790,7 +1032,7 @@ class MailingMessage(models.Model):
             logger.error("Mailing %s not sending, not sending message", self.mailing)
             return
 
-        context = self.get_email_context()
+        context = self.get_email_context(resolver=resolver)
         if mailing_context is not None:
             context.update(mailing_context)
 
@@ -823,8 +1065,9 @@ class MailingMessage(models.Model):
                 headers=headers,
                 **extra_kwargs,
             )
-            self.sent = timezone.now()
-            self.save()
+            if mark_sent:
+                self.sent = timezone.now()
+                self.save()
 
         except Exception as e:
             logger.error("Mailing message %s failed with error: %s" % (self, e))
@@ -832,6 +1075,372 @@ class MailingMessage(models.Model):
         return True
 
 
+class RecipientContextResolver:
+    """
+    Looks up donors and donation aggregates for a single recipient.
+    """
+
+    def get_donor_by_user(self, user):
+        return Donor.objects.filter(user=user).first()
+
+    def get_donor_by_subscriber(self, subscriber):
+        return Donor.objects.filter(subscriber=subscriber).first()
+
+    def get_donor_by_email(self, email):
+        return Donor.objects.filter(email=email, email_confirmed__isnull=False).first()
+
+    def get_donor_email_context(self, donor):
+        return donor.get_email_context()
+
+
+class BatchRecipientContextResolver(RecipientContextResolver):
+    """
+    Prefetches donors and donation aggregates for a chunk of
+    mailing messages so contexts are built with a constant
+    number of queries per chunk.
+    """
+
+    def __init__(self, messages):
+        self.messages = messages
+        user_ids = set()
+        subscriber_ids = set()
+        emails = set()
+        for message in messages:
+            for user_id in (
+                message.user_id,
+                message.subscriber.user_id if message.subscriber else None,
+                message.donor.user_id if message.donor else None,
+            ):
+                if user_id:
+                    user_ids.add(user_id)
+            if message.subscriber:
+                subscriber_ids.add(message.subscriber_id)
+                if message.subscriber.email:
+                    emails.add(message.subscriber.email)
+
+        self.donors_by_user = self.get_first_donors("user_id", user__in=user_ids)
+        self.donors_by_subscriber = self.get_first_donors(
+            "subscriber_id", subscriber__in=subscriber_ids
+        )
+        self.donors_by_email = self.get_first_donors(
+            "email", email__in=emails, email_confirmed__isnull=False
+        )
+
+        donor_ids = {message.donor_id for message in messages if message.donor_id}
+        for donors in (
+            self.donors_by_user,
+            self.donors_by_subscriber,
+            self.donors_by_email,
+        ):
+            donor_ids.update(donor.id for donor in donors.values())
+        self.donation_aggregates = get_donation_aggregates(donor_ids)
+
+    def get_first_donors(self, key, **filters):
+        if not any(filters.values()):
+            return {}
+        donors = {}
+        # Matches ordering of Donor.objects.filter(...).first()
+        for donor in Donor.objects.filter(**filters).select_related("user"):
+            donors.setdefault(getattr(donor, key), donor)
+        return donors
+
+    def get_donor_by_user(self, user):
+        return self.donors_by_user.get(user.id)
+
+    def get_donor_by_subscriber(self, subscriber):
+        return self.donors_by_subscriber.get(subscriber.id)
+
+    def get_donor_by_email(self, email):
+        return self.donors_by_email.get(email)
+
+    def get_donor_email_context(self, donor):
+        donation_aggregate = self.donation_aggregates.get(donor.id)
+        return donor.get_email_context(donation_aggregate=donation_aggregate)
+
+    def get_email_contexts(self):
+        return [message.get_email_context(resolver=self) for message in self.messages]
+
+
+class MailingShard(models.Model):
+    """
+    Range of mailing message ids of a mailing that is sent by one task.
+    """
+
+    mailing = models.ForeignKey(
+        Mailing, on_delete=models.CASCADE, related_name="shards"
+    )
+    start_id = models.PositiveBigIntegerField()
+    end_id = models.PositiveBigIntegerField()
+
+    created = models.DateTimeField(default=timezone.now)
+    started = models.DateTimeField(null=True, blank=True)
+    finished = models.DateTimeField(null=True, blank=True)
+
+    scheduled = models.DateTimeField(null=True, blank=True)
+    heartbeat = models.DateTimeField(null=True, blank=True)
+    failed = models.DateTimeField(null=True, blank=True)
+    sent_count = models.PositiveIntegerField(default=0)
+    failed_count = models.PositiveIntegerField(default=0)
+    task_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ("mailing", "start_id")
+        verbose_name = _("mailing shard")
+        verbose_name_plural = _("mailing shards")
+
+    def __str__(self):
+        return "MailingShard %s-%s (%s)" % (self.start_id, self.end_id, self.mailing)
+
+    def get_recipients(self):
+        return (
+            self.mailing.get_sendable_recipients()
+            .filter(
+                id__gte=self.start_id,
+                id__lte=self.end_id,
+                sent__isnull=True,
+            )
+            .order_by("id")
+        )
+
+    def is_claimed(self):
+        if self.heartbeat is None:
+            return False
+        return self.heartbeat > timezone.now() - MAILING_SHARD_LEASE
+
+    def claim(self):
+        """
+        Claims the shard for the current worker unless another worker
+        has made progress on it within the lease.
+        """
+        now = timezone.now()
+        claimed = (
+            MailingShard.objects.filter(
+                id=self.id, finished__isnull=True, failed__isnull=True
+            )
+            .filter(
+                models.Q(heartbeat__isnull=True)
+                | models.Q(heartbeat__lt=now - MAILING_SHARD_LEASE)
+            )
+            .update(heartbeat=now)
+        )
+        if claimed:
+            self.heartbeat = now
+        return bool(claimed)
+
+    def renew_claim(self):
+        """
+        Renews the claim while sending. Returns False if the claim
+        expired and the shard was claimed by another worker.
+        """
+        now = timezone.now()
+        if now - self.heartbeat < MAILING_SHARD_HEARTBEAT:
+            return True
+        renewed = MailingShard.objects.filter(
+            id=self.id, heartbeat=self.heartbeat
+        ).update(heartbeat=now)
+        if renewed:
+            self.heartbeat = now
+        return bool(renewed)
+
+    def save_progress(self):
+        # Keep the claim while sending, release it when done or failed
+        done = self.finished is not None or self.failed is not None
+        self.heartbeat = None if done else timezone.now()
+        self.save(
+            update_fields=[
+                "started",
+                "finished",
+                "failed",
+                "heartbeat",
+                "sent_count",
+                "failed_count",
+                "task_count",
+            ]
+        )
+
+    def send(self, batch_size=100, scheduler=None):
+        """
+        Sends the shard. Returns False if it is claimed by another worker.
+        """
+        if self.finished is not None:
+            return
+        if not self.claim():
+            logger.info("Mailing shard %s is claimed by another worker", self.id)
+            return False
+
+        mailing = self.mailing
+        if scheduler is None:
+            scheduler = mailing.get_delivery_scheduler()
+        if not self.started:
+            self.started = timezone.now()
+            self.save_progress()
+
+        context = mailing.get_email_context()
+
+        recipients = self.get_recipients().select_related(
+            "user", "subscriber__user", "subscriber__newsletter", "donor__user"
+        )
+        try:
+            for recipient_batch in batched(recipients, batch_size):
+                resolver = BatchRecipientContextResolver(recipient_batch)
+                sent_ids = []
+                email_buffer = None
+                try:
+                    # Enqueue messages in chunks, flushed before progress is
+                    # saved. When sending fails, buffered messages are dropped.
+                    with bulk_email_sending() as email_buffer:
+                        for recipient in recipient_batch:
+                            scheduler.wait(recipient.email)
+                            # Waiting for send slots can take longer than
+                            # the lease
+                            if not self.renew_claim():
+                                logger.warning(
+                                    "Mailing shard %s was claimed by another worker",
+                                    self.id,
+                                )
+                                return False
+                            # Share compiled template across recipients
+                            recipient.mailing = mailing
+                            # Throttled chunks are not larger than a burst, so
+                            # messages spaced by the scheduler are not enqueued
+                            # together
+                            with (
+                                email_buffer.tagged(recipient.id),
+                                email_buffer.grouped(
+                                    scheduler.get_throttle_group(recipient.email),
+                                    scheduler.burst,
+                                ),
+                            ):
+                                result = recipient.send(
+                                    context, resolver=resolver, mark_sent=False
+                                )
+                            if result:
+                                sent_ids.append(recipient.id)
+                            elif result is False:
+                                self.failed_count += 1
+                finally:
+                    # Only record messages as sent once they are enqueued,
+                    # so a resumed shard does not send them again
+                    if email_buffer is not None:
+                        sent_ids = [
+                            message_id
+                            for message_id in sent_ids
+                            if not email_buffer.is_pending(message_id)
+                        ]
+                        self.task_count += email_buffer.task_count
+                    MailingMessage.objects.filter(id__in=sent_ids).update(
+                        sent=timezone.now()
+                    )
+                    self.sent_count += len(sent_ids)
+                self.save_progress()
+        except Exception:
+            logger.exception(
+                "Mailing %s shard %s sending failed", mailing.name, self.id
+            )
+            mail_managers("Sending out {} partly failed".format(mailing.name), "")
+            self.failed = timezone.now()
+            self.save_progress()
+            mailing.finish_sending()
+            return
+
+        self.finished = timezone.now()
+        self.save_progress()
+        mailing.finish_sending()
+
+
+class MailingOpenManager(models.Manager):
+    def add_opens(self, opens, batch_size=1000):
+        """
+        Insert (mailing_id, token_hash, first_seen) tuples, skipping
+        already known tokens. Returns number of new opens per mailing id.
+        """
+        counts = Counter()
+        table = self.model._meta.db_table
+        for batch in batched(opens, batch_size):
+            values = ", ".join(["(%s, %s, %s)"] * len(batch))
+            params = [value for row in batch for value in row]
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"INSERT INTO {table} (mailing_id, token_hash, first_seen) "
+                    f"VALUES {values} "
+                    "ON CONFLICT (mailing_id, token_hash) DO NOTHING "
+                    "RETURNING mailing_id",
+                    params,
+                )
+                counts.update(row[0] for row in cursor.fetchall())
+        return counts
+
+
+class MailingOpen(models.Model):
+    """
+    Unique opens of a mailing by hashed pixel token.
+    """
+
+    id = models.BigAutoField(primary_key=True)
+    mailing = models.ForeignKey(Mailing, on_delete=models.CASCADE, related_name="opens")
+    token_hash = models.BigIntegerField()
+    first_seen = models.DateTimeField()
+
+    objects = MailingOpenManager()
+
+    class Meta:
+        verbose_name = _("mailing open")
+        verbose_name_plural = _("mailing opens")
+        constraints = [
+            models.UniqueConstraint(
+                fields=["mailing", "token_hash"],
+                name="unique_mailing_open_token",
+            )
+        ]
+
+    def __str__(self):
+        return "MailingOpen %s (%s)" % (self.token_hash, self.mailing_id)
+
+
+class MailingOpenStatsManager(models.Manager):
+    def refresh(self, concurrently=True):
+        table = self.model._meta.db_table
+        concurrently = "CONCURRENTLY " if concurrently else ""
+        with connection.cursor() as cursor:
+            cursor.execute(f"REFRESH MATERIALIZED VIEW {concurrently}{table}")
+
+
+class MailingOpenStats(models.Model):
+    """
+    Aggregated opens of tracked mailings, backed by a materialized view
+    that is refreshed after processing the pixel log. Mailings without
+    recorded unique opens fall back to their open count.
+    """
+
+    mailing = models.OneToOneField(
+        Mailing,
+        primary_key=True,
+        on_delete=models.DO_NOTHING,
+        related_name="open_stats",
+    )
+    unique_opens = models.PositiveIntegerField()
+    recipient_count = models.PositiveIntegerField()
+    first_open = models.DateTimeField(null=True)
+    last_open = models.DateTimeField(null=True)
+
+    objects = MailingOpenStatsManager()
+
+    class Meta:
+        managed = False
+        db_table = "fds_mailing_mailingopenstats"
+        verbose_name = _("mailing open stats")
+        verbose_name_plural = _("mailing open stats")
+
+    def __str__(self):
+        return "MailingOpenStats (%s)" % self.mailing_id
+
+    @property
+    def open_rate(self):
+        if not self.recipient_count:
+            return None
+        return self.unique_opens / self.recipient_count
+
+
 class MailingMessageReferenceManager(models.Manager):
     def create_with_object(self, mailing_message, content_object, content_type=None):
         if content_type is None:
@@ -1,3 +1,4 @@
+import hashlib
 from dataclasses import dataclass
 from typing import Optional
 from urllib.parse import urlparse
@@ -46,8 +47,11 @@ def parse_pixel_path(url_string: str) -> Optional[PixelPath]:
     return PixelPath(namespace, mailing_id, token, signature)
 
 
-def validate_pixel_path_signature(path: PixelPath) -> bool:
-    signer = LowerCaseSigner()
+def validate_pixel_path_signature(
+    path: PixelPath, signer: Optional[LowerCaseSigner] = None
+) -> bool:
+    if signer is None:
+        signer = LowerCaseSigner()
     data = f"{path.namespace}/{path.mailing_id}/{path.token}"
     signed_value = signer.sep.join([data, path.signature])
     try:
@@ -55,3 +59,11 @@ def validate_pixel_path_signature(path: PixelPath) -> bool:
         return True
     except BadSignature:
         return False
+
+
+def get_token_hash(token: str) -> int:
+    """
+    Stable signed 64 bit hash of a pixel token for de-duplicating opens.
+    """
+    digest = hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big", signed=True)
@@ -1,19 +1,88 @@
 import collections
+import functools
 import logging
 import re
 from collections import defaultdict
 from dataclasses import dataclass
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
 from typing import Generator, Iterable, Optional
 
+from django.db.models import Case, DateTimeField, F, IntegerField, Value, When
+from django.db.models.functions import Greatest
+
 from dogtail import Dogtail
 
-from .models import Mailing
-from .pixel_log import PixelPath, parse_pixel_path, validate_pixel_path_signature
+from .models import Mailing, MailingOpen, MailingOpenStats
+from .pixel_log import (
+    PixelPath,
+    get_token_hash,
+    parse_pixel_path,
+    validate_pixel_path_signature,
+)
+from .utils import LowerCaseSigner
 
 logger = logging.getLogger(__name__)
 
+LOG_TIMESTAMP_FORMAT = "%d/%b/%Y:%H:%M:%S %z"
+MONTHS = {
+    month: i
+    for i, month in enumerate(
+        (
+            "Jan",
+            "Feb",
+            "Mar",
+            "Apr",
+            "May",
+            "Jun",
+            "Jul",
+            "Aug",
+            "Sep",
+            "Oct",
+            "Nov",
+            "Dec",
+        ),
+        start=1,
+    )
+}
+
+# Upper bound of validated pixel paths remembered while reading a log
+PIXEL_PATH_CACHE_SIZE = 100_000
+# Number of opens inserted per database round trip
+PIXEL_BATCH_SIZE = 10_000
+
+
+@functools.lru_cache(maxsize=32)
+def get_utc_offset(offset: str) -> timezone:
+    sign = -1 if offset[0] == "-" else 1
+    delta = timedelta(hours=int(offset[1:3]), minutes=int(offset[3:5]))
+    return timezone(sign * delta)
+
+
+@functools.lru_cache(maxsize=1024)
+def parse_log_timestamp(date_str: str) -> datetime:
+    """
+    Parse a log timestamp like ``24/Apr/2025:11:37:37 +0200``.
+
+    Uses fixed positions and falls back to strptime for other layouts.
+    Log lines arrive in order, so the cache hits for all lines of
+    the same second.
+    """
+    try:
+        if len(date_str) != 26:
+            raise ValueError
+        return datetime(
+            int(date_str[7:11]),
+            MONTHS[date_str[3:6]],
+            int(date_str[0:2]),
+            int(date_str[12:14]),
+            int(date_str[15:17]),
+            int(date_str[18:20]),
+            tzinfo=get_utc_offset(date_str[21:26]),
+        )
+    except (KeyError, ValueError):
+        return datetime.strptime(date_str, LOG_TIMESTAMP_FORMAT)
+
 
 @dataclass(frozen=True)
 class PixelLogLine:
@@ -50,6 +119,7 @@ class PixelLogParser(collections.abc.Iterator):
     PATH_RE = r"(?P<path>/[^\.]+\.gif)"
     HTTP_VERSION_RE = r"(?P<http_version>HTTP/\d\.\d)"
     LINE_RE = rf"^{TIMESTAMP_RE}\|{HTTP_VERB_RE} {PATH_RE} {HTTP_VERSION_RE}$"
+    LINE_PATTERN = re.compile(LINE_RE)
 
     def __init__(
         self,
@@ -86,14 +156,13 @@ class PixelLogParser(collections.abc.Iterator):
             Optional[PixelLogLine]: If the logline was parsed successfully, a PixelLogLine namedtuple is returned. If it could not be parsed, None is returned
         """
 
-        match = re.match(self.LINE_RE, line)
+        match = self.LINE_PATTERN.match(line)
         if not match:
             return
-        line_data = match.groupdict()
 
         return PixelLogLine(
-            timestamp=self._parse_date(line_data["timestamp"]),
-            path=line_data["path"],
+            timestamp=self._parse_date(match.group("timestamp")),
+            path=match.group("path"),
         )
 
     @staticmethod
@@ -106,7 +175,7 @@ class PixelLogParser(collections.abc.Iterator):
         Returns:
             datetime: The parsed datetime object.
         """
-        return datetime.strptime(date_str, "%d/%b/%Y:%H:%M:%S %z")
+        return parse_log_timestamp(date_str)
 
 
 class DogtailPixelLogParser(PixelLogParser):
@@ -147,13 +216,25 @@ class DogtailPixelLogParser(PixelLogParser):
 def read_pixel_log(
     log_line_generator: Iterable[PixelLogLine],
 ) -> Generator[VerifiedPixelPath, None, None]:
+    # Pixels are requested repeatedly by the same recipients,
+    # remember results per path so every path is only validated once
+    signer = LowerCaseSigner()
+    validated_paths = {}
     for logline in log_line_generator:
-        pixel_path = parse_pixel_path(logline.path)
+        try:
+            pixel_path = validated_paths[logline.path]
+        except KeyError:
+            pixel_path = parse_pixel_path(logline.path)
+            if pixel_path is not None and not validate_pixel_path_signature(
+                pixel_path, signer=signer
+            ):
+                logger.warning("Invalid signature on pixel path: %s", logline.path)
+                pixel_path = None
+            if len(validated_paths) >= PIXEL_PATH_CACHE_SIZE:
+                validated_paths.clear()
+            validated_paths[logline.path] = pixel_path
         if pixel_path is None:
             continue
-        if not validate_pixel_path_signature(pixel_path):
-            logger.warning("Invalid signature on pixel path: %s", logline.path)
-            continue
         yield VerifiedPixelPath.from_pixel_path(pixel_path, logline.timestamp)
 
 
@@ -168,13 +249,28 @@ def get_pixel_log_generator(
 
 
 class PixelProcessor:
-    def __init__(self, pixel_generator: Iterable[VerifiedPixelPath]):
+    """
+    Counts unique opens per mailing.
+
+    Opens are stored by token hash in `MailingOpen`, so reading the same
+    log lines again (e.g. after a log rotation) does not count them twice.
+    """
+
+    def __init__(
+        self,
+        pixel_generator: Iterable[VerifiedPixelPath],
+        batch_size: int = PIXEL_BATCH_SIZE,
+    ):
         self.pixel_generator = pixel_generator
-        self.mailings = {}
+        self.batch_size = batch_size
+        self.mailings = None
         self.token_set = defaultdict(set)
         self.open_count = defaultdict(int)
+        self.open_log_timestamp = {}
+        self.pending = []
 
     def run(self):
+        self.load_mailings()
         for pixel in self.pixel_generator:
             if pixel.namespace != "mailing":
                 # Ignore other namespaces
@@ -185,42 +281,68 @@ class PixelProcessor:
             self.process_pixel(pixel, mailing)
 
         # Done reading the log, now save the results
-        for mailing_id, mailing in self.mailings.items():
-            if mailing is None:
-                continue
-            if self.open_count[mailing_id] > 0:
-                mailing.open_count += self.open_count[mailing_id]
-                mailing.save()
-                logger.info(
-                    "Processed %d opens for mailing %d",
-                    self.open_count[mailing_id],
-                    mailing_id,
-                )
+        self.flush()
+        self.save_counters()
+        MailingOpenStats.objects.refresh()
+
+    def load_mailings(self):
+        self.mailings = {
+            mailing.id: mailing
+            for mailing in Mailing._default_manager.get_tracked().only(
+                "id", "open_count", "open_log_timestamp"
+            )
+        }
 
     def process_pixel(self, pixel: VerifiedPixelPath, mailing: Mailing):
-        if pixel.token in self.token_set[pixel.mailing_id]:
+        last_timestamp = self.open_log_timestamp.get(mailing.id)
+        if last_timestamp is None or pixel.timestamp > last_timestamp:
+            self.open_log_timestamp[mailing.id] = pixel.timestamp
+        tokens = self.token_set[mailing.id]
+        if pixel.token in tokens:
             # Already seen this mail in this log run
-            # Do not count again but remember the timestamp
-            mailing.open_log_timestamp = max(
-                pixel.timestamp, mailing.open_log_timestamp
-            )
             return
-        if (
-            mailing.open_log_timestamp is not None
-            and mailing.open_log_timestamp >= pixel.timestamp
-        ):
-            # Already read until there and counted
+        tokens.add(pixel.token)
+        self.pending.append((mailing.id, get_token_hash(pixel.token), pixel.timestamp))
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        new_opens = MailingOpen.objects.add_opens(self.pending)
+        for mailing_id, count in new_opens.items():
+            self.open_count[mailing_id] += count
+        self.pending = []
+
+    def save_counters(self):
+        mailing_ids = set(self.open_log_timestamp)
+        if not mailing_ids:
             return
-        self.token_set[pixel.mailing_id].add(pixel.token)
-        self.open_count[pixel.mailing_id] += 1
-        mailing.open_log_timestamp = pixel.timestamp
+        open_counts = [
+            When(id=mailing_id, then=Value(count))
+            for mailing_id, count in self.open_count.items()
+            if count > 0
+        ]
+        timestamps = [
+            When(id=mailing_id, then=Value(timestamp))
+            for mailing_id, timestamp in self.open_log_timestamp.items()
+        ]
+        update = {
+            "open_log_timestamp": Greatest(
+                F("open_log_timestamp"),
+                Case(*timestamps, output_field=DateTimeField()),
+            )
+        }
+        if open_counts:
+            update["open_count"] = F("open_count") + Case(
+                *open_counts, default=Value(0), output_field=IntegerField()
+            )
+        Mailing._default_manager.filter(id__in=mailing_ids).update(**update)
+        for mailing_id, count in self.open_count.items():
+            if count > 0:
+                logger.info("Processed %d opens for mailing %d", count, mailing_id)
 
     def get_mailing(self, pixel):
-        if pixel.mailing_id in self.mailings:
-            return self.mailings[pixel.mailing_id]
-        try:
-            mailing = Mailing._default_manager.get_tracked().get(id=pixel.mailing_id)
-        except Mailing.DoesNotExist:
-            mailing = None
-        self.mailings[pixel.mailing_id] = mailing
-        return mailing
+        if self.mailings is None:
+            self.load_mailings()
+        return self.mailings.get(pixel.mailing_id)
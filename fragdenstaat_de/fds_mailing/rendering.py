@@ -0,0 +1,140 @@
+"""
+Compiled rendering of mailings.
+
+Rendering an email template means rendering its CMS placeholder
+(and possibly MJML) into a Django template string which is then
+rendered again with the recipient context. The first step only
+depends on the recipient through plugins marked as
+``context_branching`` (conditions, donor logic and raw code) and
+through a few personalized URLs used by the base templates.
+
+A compiled template renders the placeholder once per distinct
+branch of those and reuses the parsed templates for all recipients
+in that branch, so per recipient only the variables are evaluated.
+Templates with more branches than fit in memory, e.g. raw code that
+outputs recipient data, fall back to rendering every recipient.
+"""
+
+import logging
+
+from django.template import Context
+from django.utils.html import mark_safe
+
+from froide.helper.email_sending import EmailContent
+
+from fragdenstaat_de.fds_cms.utils import get_alias_placeholder
+
+logger = logging.getLogger(__name__)
+
+# Recipient variables that base templates render in the first pass.
+# They are replaced by template variables before compiling.
+PERSONALIZED_CONTEXT_VARS = ("unsubscribe_url", "pixel_url")
+
+# Values used by base templates in the first pass that are shared
+# by all recipients of a mailing but may differ between other sends
+BRANCH_CONTEXT_VARS = ("newsletter", "site_url")
+
+# Upper bound of compiled branches kept in memory per mailing
+MAX_COMPILED_BRANCHES = 64
+
+
+class CompiledBranch:
+    def __init__(self, text_template, html_template):
+        self.text_template = text_template
+        self.html_template = html_template
+
+
+class CompiledEmailTemplate:
+    def __init__(self, email_template, max_branches=MAX_COMPILED_BRANCHES):
+        self.email_template = email_template
+        self.max_branches = max_branches
+        self.subject_template = email_template.subject_template
+        self.intent = email_template.get_mail_intent()
+        self.context_plugins = self.get_context_plugins()
+        self.branches = {}
+        self.compile_count = 0
+        self.uncached = False
+
+    def get_placeholders(self):
+        placeholders = [self.email_template.email_body]
+        extra_placeholder_name = self.email_template.get_extra_placeholder_name()
+        if extra_placeholder_name:
+            placeholder = get_alias_placeholder(extra_placeholder_name)
+            if placeholder:
+                placeholders.append(placeholder)
+        return [p for p in placeholders if p is not None]
+
+    def get_context_plugins(self):
+        context_plugins = []
+        for placeholder in self.get_placeholders():
+            for base_plugin in placeholder.get_plugins():
+                plugin_class = base_plugin.get_plugin_class()
+                if not getattr(plugin_class, "context_branching", False):
+                    continue
+                instance, plugin = base_plugin.get_plugin_instance()
+                if instance is None:
+                    continue
+                context_plugins.append((instance, plugin))
+        return context_plugins
+
+    def get_branch_key(self, context):
+        key = [bool(context.get(var)) for var in PERSONALIZED_CONTEXT_VARS]
+        key.extend(context.get(var) for var in BRANCH_CONTEXT_VARS)
+        for instance, plugin in self.context_plugins:
+            key.append(plugin.get_context_branch(context, instance))
+        return tuple(key)
+
+    def get_compile_context(self, context):
+        compile_context = dict(context)
+        for var in PERSONALIZED_CONTEXT_VARS:
+            if compile_context.get(var):
+                compile_context[var] = mark_safe("{{ %s }}" % var)
+        return compile_context
+
+    def compile_branch(self, context):
+        compile_context = self.get_compile_context(context)
+        self.email_template.update_context(compile_context)
+        self.compile_count += 1
+        return self.render_branch(compile_context)
+
+    def render_branch(self, context):
+        return CompiledBranch(
+            self.email_template.get_body_text_template(context),
+            self.email_template.get_body_html_template(context),
+        )
+
+    def get_branch(self, context):
+        if self.uncached:
+            return self.render_branch(context)
+        key = self.get_branch_key(context)
+        branch = self.branches.get(key)
+        if branch is not None:
+            return branch
+        if len(self.branches) >= self.max_branches:
+            logger.warning(
+                "Compiled branch limit reached for email template %s,"
+                " rendering uncached",
+                self.email_template.pk,
+            )
+            self.uncached = True
+            self.branches = {}
+            return self.render_branch(context)
+        branch = self.compile_branch(context)
+        self.branches[key] = branch
+        return branch
+
+    def get_email_content(self, context, preview=False):
+        if self.intent is not None:
+            context = self.intent.get_context(context)
+        context = dict(context)
+        self.email_template.update_context(context)
+        branch = self.get_branch(context)
+
+        ctx = Context(context)
+        subject = self.subject_template.render(ctx)
+        text = branch.text_template.render(ctx)
+        html = branch.html_template.render(ctx)
+        for content in (text, html):
+            if "{{" in content or "}}" in content and not preview:
+                raise ValueError("Likely variable definition broken")
+        return EmailContent(subject, text, html)
@@ -3,6 +3,7 @@ from pathlib import Path
 
 from django.conf import settings
 from django.core.mail import mail_admins
+from django.db import models
 from django.utils import timezone
 
 from froide.celery import app as celery_app
@@ -30,6 +31,24 @@ def send_mailing(mailing_id, sending_date):
     mailing.send()
 
 
+@celery_app.task(
+    name="fragdenstaat_de.fds_mailing.send_mailing_shard", bind=True, acks_late=True
+)
+def send_mailing_shard(self, shard_id):
+    from .models import MAILING_SHARD_LEASE, MailingShard
+
+    try:
+        shard = MailingShard.objects.select_related("mailing").get(
+            id=shard_id, finished__isnull=True, failed__isnull=True
+        )
+    except MailingShard.DoesNotExist:
+        return
+    if shard.send() is False:
+        # Claimed by another worker, e.g. before this task was redelivered
+        # after a crash. Try again when the claim has expired.
+        raise self.retry(countdown=MAILING_SHARD_LEASE.total_seconds())
+
+
 @celery_app.task(name="fragdenstaat_de.fds_mailing.continue_sending")
 def continue_sending(mailing_id):
     from .models import Mailing
@@ -43,17 +62,37 @@ def continue_sending(mailing_id):
     except Mailing.DoesNotExist:
         return
 
-    missing_recipients = mailing.recipients.all().filter(sent__isnull=True)
-    context = mailing.get_email_context()
+    mailing.continue_sending()
+
+
+@celery_app.task(name="fragdenstaat_de.fds_mailing.update_recipient_count")
+def update_recipient_count(mailing_id):
+    from .models import Mailing
 
     try:
-        for recipient in missing_recipients:
-            recipient.send(context)
-        mailing.sent = True
-        mailing.sent_date = timezone.now()
-    finally:
-        mailing.sending = False
-        mailing.save()
+        mailing = Mailing.objects.get(id=mailing_id, sending=False, sent=False)
+    except Mailing.DoesNotExist:
+        return
+    mailing.update_recipient_count()
+
+
+@celery_app.task(name="fragdenstaat_de.fds_mailing.update_stale_recipient_counts")
+def update_stale_recipient_counts():
+    from .models import RECIPIENT_COUNT_DRAFT_AGE, RECIPIENT_COUNT_MAX_AGE, Mailing
+
+    now = timezone.now()
+    stale_date = now - RECIPIENT_COUNT_MAX_AGE
+    mailings = Mailing.objects.filter(
+        sending=False,
+        sent=False,
+        newsletter__isnull=False,
+        updated__gte=now - RECIPIENT_COUNT_DRAFT_AGE,
+    ).filter(
+        models.Q(recipient_count_updated__isnull=True)
+        | models.Q(recipient_count_updated__lt=stale_date)
+    )
+    for mailing in mailings:
+        mailing.update_recipient_count()
 
 
 @celery_app.task(name="fragdenstaat_de.fds_mailing.process_pixel_log")
@@ -1,14 +1,33 @@
+from datetime import timedelta
+
 from django.conf import settings
 from django.core import mail
+from django.core.cache import cache
 from django.utils import timezone
 
 import pytest
+from celery.exceptions import Retry
 from cms.api import add_plugin
 
+from fragdenstaat_de.fds_donation.tests.factories import DonationFactory, DonorFactory
 from fragdenstaat_de.fds_newsletter.listeners import handle_unsubscribe
-from fragdenstaat_de.fds_newsletter.models import Newsletter, Subscriber
+from fragdenstaat_de.fds_newsletter.models import Newsletter, Segment, Subscriber
 
-from ..models import EmailTemplate, Mailing
+from ..models import (
+    MAILING_SHARD_HEARTBEAT,
+    MAILING_SHARD_LEASE,
+    RECIPIENT_COUNT_DEBOUNCE_KEY,
+    RECIPIENT_COUNT_DRAFT_AGE,
+    RECIPIENT_COUNT_MAX_AGE,
+    BatchRecipientContextResolver,
+    EmailTemplate,
+    Mailing,
+    MailingMessage,
+    MailingShard,
+)
+from ..tasks import send_mailing_shard, update_stale_recipient_counts
+from ..throttle import BUCKET_KEY
+from .test_throttle import FakeClock
 
 
 @pytest.fixture
@@ -274,3 +293,536 @@ def test_mailing_render_uncached(mailing, settings, newsletter):
     context["action_url"] = settings.SITE_URL + "/action2/"
     email_content = mailing.get_email_content(context)
     assert f'!<a href="{settings.SITE_URL}/action2/' in email_content.html
+
+
+@pytest.mark.django_db
+def test_mailing_compiled_render(mailing, newsletter, monkeypatch):
+    for i in range(20):
+        Subscriber.objects.create(
+            email="subscriber-{}@example.org".format(i),
+            newsletter=newsletter,
+            subscribed=timezone.now(),
+        )
+    add_plugin(
+        mailing.email_template.email_body,
+        "ConditionPlugin",
+        "de",
+        context_key="subscriber.email",
+        context_value="'subscribed@example.org'",
+    )
+    mailing.auto_populate()
+    recipients = list(mailing.recipients.all())
+    assert len(recipients) == 21
+    contexts = [recipient.get_email_context() for recipient in recipients]
+
+    render_calls = []
+    render_email_html = EmailTemplate.render_email_html
+
+    def counting_render_email_html(self, *args, **kwargs):
+        render_calls.append(1)
+        return render_email_html(self, *args, **kwargs)
+
+    monkeypatch.setattr(EmailTemplate, "render_email_html", counting_render_email_html)
+
+    for recipient, context in zip(recipients, contexts, strict=True):
+        context["escape_chars"] = recipient.email
+        email_content = mailing.get_email_content(context)
+        assert email_content.subject == "Test subject & {}".format(recipient.email)
+        assert "Content & {}".format(recipient.email) in email_content.text
+        assert context["unsubscribe_url"] in email_content.html
+        assert context["pixel_url"] in email_content.html
+
+    # Placeholder is only rendered once per condition branch, not per recipient
+    assert mailing.email_template.compiled_template.compile_count == 2
+    assert len(render_calls) == 2
+
+
+@pytest.mark.django_db
+def test_mailing_compiled_render_donor_plugin(mailing, newsletter):
+    for i in range(6):
+        subscriber = Subscriber.objects.create(
+            email="subscriber-{}@example.org".format(i),
+            newsletter=newsletter,
+            subscribed=timezone.now(),
+        )
+        if i % 2 == 0:
+            DonorFactory.create(
+                email=subscriber.email,
+                email_confirmed=timezone.now(),
+                subscriber=subscriber,
+            )
+    donor_plugin = add_plugin(mailing.email_template.email_body, "IsDonorPlugin", "de")
+    add_plugin(
+        mailing.email_template.email_body,
+        "TextPlugin",
+        "de",
+        body="<p>Thank you for your donation</p>",
+        target=donor_plugin,
+    )
+    mailing.auto_populate()
+    recipients = list(mailing.recipients.all())
+    assert len(recipients) == 7
+
+    for recipient in recipients:
+        context = recipient.get_email_context()
+        context["escape_chars"] = recipient.email
+        email_content = mailing.get_email_content(context)
+        is_donor = bool(context.get("donor"))
+        assert ("Thank you for your donation" in email_content.text) is is_donor
+        assert ("Thank you for your donation" in email_content.html) is is_donor
+
+    assert mailing.email_template.compiled_template.compile_count == 2
+
+
+@pytest.mark.django_db
+def test_mailing_compiled_render_branch_limit(mailing, newsletter):
+    for i in range(5):
+        Subscriber.objects.create(
+            email="subscriber-{}@example.org".format(i),
+            newsletter=newsletter,
+            subscribed=timezone.now(),
+        )
+    add_plugin(
+        mailing.email_template.email_body,
+        "RawCodePlugin",
+        "de",
+        label="Recipient",
+        code="<mj-text>Raw {{ subscriber.email }}</mj-text>",
+    )
+    mailing.auto_populate()
+    compiled_template = mailing.email_template.compiled_template
+    compiled_template.max_branches = 2
+
+    for recipient in mailing.recipients.all():
+        context = recipient.get_email_context()
+        context["escape_chars"] = recipient.email
+        email_content = mailing.get_email_content(context)
+        assert "Raw {}".format(recipient.email) in email_content.html
+
+    # Recipients beyond the branch limit are rendered without compiling
+    assert compiled_template.uncached
+    assert compiled_template.compile_count == 2
+    assert compiled_template.branches == {}
+
+
+@pytest.mark.django_db
+def test_mailing_send_shards(
+    mailing, newsletter, monkeypatch, django_capture_on_commit_callbacks
+):
+    for i in range(4):
+        Subscriber.objects.create(
+            email="subscriber-{}@example.org".format(i),
+            newsletter=newsletter,
+            subscribed=timezone.now(),
+        )
+    monkeypatch.setattr("fragdenstaat_de.fds_mailing.models.MAILING_SHARD_SIZE", 2)
+    mailing.finalize()
+    assert mailing.recipients.count() == 5
+
+    mail.outbox = []
+    with django_capture_on_commit_callbacks(execute=True):
+        mailing.send()
+
+    mailing.refresh_from_db()
+    assert mailing.sent
+    assert not mailing.sending
+    assert len(mail.outbox) == 5
+    shards = list(mailing.shards.all())
+    assert len(shards) == 3
+    assert all(shard.finished is not None for shard in shards)
+    assert sum(shard.sent_count for shard in shards) == 5
+
+
+@pytest.mark.django_db
+def test_mailing_continue_sending_shard(
+    mailing, newsletter, django_capture_on_commit_callbacks
+):
+    for i in range(2):
+        Subscriber.objects.create(
+            email="subscriber-{}@example.org".format(i),
+            newsletter=newsletter,
+            subscribed=timezone.now(),
+        )
+    mailing.finalize()
+    mailing.sending = True
+    mailing.save()
+    shard = mailing.create_shards()[0]
+    # Simulate a crashed worker that sent the first message
+    first_recipient = shard.get_recipients().first()
+    first_recipient.sent = timezone.now()
+    first_recipient.save()
+
+    mail.outbox = []
+    with django_capture_on_commit_callbacks(execute=True):
+        mailing.continue_sending()
+
+    assert len(mail.outbox) == 2
+    shard.refresh_from_db()
+    assert shard.finished is not None
+    mailing.refresh_from_db()
+    assert mailing.sent
+
+
+@pytest.mark.django_db
+def test_mailing_shard_failure_and_claim(
+    mailing, newsletter, monkeypatch, django_capture_on_commit_callbacks
+):
+    for i in range(2):
+        Subscriber.objects.create(
+            email="subscriber-{}@example.org".format(i),
+            newsletter=newsletter,
+            subscribed=timezone.now(),
+        )
+    mailing.finalize()
+
+    def broken_send(self, *args, **kwargs):
+        raise ValueError("broken")
+
+    monkeypatch.setattr(MailingMessage, "send", broken_send)
+    mail.outbox = []
+    with django_capture_on_commit_callbacks(execute=True):
+        mailing.send()
+
+    # A failed shard ends sending instead of leaving the mailing stuck
+    mailing.refresh_from_db()
+    assert not mailing.sending
+    assert not mailing.sent
+    assert mailing.failed
+    shard = mailing.shards.get()
+    assert shard.failed is not None
+    assert shard.heartbeat is None
+
+    monkeypatch.undo()
+    # Shards with a current claim are not dispatched again
+    MailingShard.objects.filter(id=shard.id).update(heartbeat=timezone.now())
+    with django_capture_on_commit_callbacks(execute=True):
+        mailing.continue_sending()
+    assert len(mail.outbox) == 0
+    mailing.refresh_from_db()
+    assert mailing.sending
+    assert not mailing.failed
+
+    # Abandoned claims expire
+    MailingShard.objects.filter(id=shard.id).update(
+        heartbeat=timezone.now() - MAILING_SHARD_LEASE
+    )
+    with django_capture_on_commit_callbacks(execute=True):
+        mailing.continue_sending()
+    assert len(mail.outbox) == 3
+    mailing.refresh_from_db()
+    assert mailing.sent
+    assert not mailing.sending
+
+
+@pytest.fixture
+def bulk_email_backend(settings):
+    settings.EMAIL_BACKEND = (
+        "fragdenstaat_de.theme.email_backend.CustomCeleryEmailBackend"
+    )
+    settings.CELERY_EMAIL_BACKEND = "django.core.mail.backends.locmem.EmailBackend"
+    return settings
+
+
+@pytest.mark.django_db
+def test_mailing_shard_claim_renewal(mailing, monkeypatch):
+    mailing.finalize()
+    shard = mailing.create_shards()[0]
+    assert shard.claim()
+    assert shard.renew_claim()
+
+    # Renewed while sending once the heartbeat gets old
+    old_heartbeat = timezone.now() - MAILING_SHARD_HEARTBEAT * 2
+    MailingShard.objects.filter(id=shard.id).update(heartbeat=old_heartbeat)
+    shard.heartbeat = old_heartbeat
+    assert shard.renew_claim()
+    assert shard.heartbeat > old_heartbeat
+    assert MailingShard.objects.get(id=shard.id).heartbeat == shard.heartbeat
+
+    # Expired claim was taken over by another worker
+    other = MailingShard.objects.get(id=shard.id)
+    MailingShard.objects.filter(id=shard.id).update(
+        heartbeat=timezone.now() - MAILING_SHARD_LEASE
+    )
+    assert other.claim()
+    shard.heartbeat = old_heartbeat
+    assert not shard.renew_claim()
+
+    # A task for a claimed shard is retried after the lease
+    retries = []
+
+    def fake_retry(**kwargs):
+        retries.append(kwargs)
+        return Retry()
+
+    monkeypatch.setattr(send_mailing_shard, "retry", fake_retry)
+    with pytest.raises(Retry):
+        send_mailing_shard(shard.id)
+    assert retries == [{"countdown": MAILING_SHARD_LEASE.total_seconds()}]
+    assert not mailing.recipients.filter(sent__isnull=False).exists()
+
+
+@pytest.mark.django_db
+def test_mailing_shard_marks_sent_after_flush(
+    mailing, bulk_email_backend, monkeypatch, django_capture_on_commit_callbacks
+):
+    mailing.finalize()
+
+    def failing_enqueue_emails(*args, **kwargs):
+        raise ConnectionError("broker unavailable")
+
+    monkeypatch.setattr(
+        "fragdenstaat_de.theme.email_backend.enqueue_emails", failing_enqueue_emails
+    )
+    with django_capture_on_commit_callbacks(execute=True):
+        mailing.send()
+
+    # Messages that were not enqueued are not recorded as sent
+    assert not mailing.recipients.filter(sent__isnull=False).exists()
+    shard = mailing.shards.get()
+    assert shard.failed is not None
+    assert shard.sent_count == 0
+
+
+@pytest.mark.django_db
+def test_mailing_shard_resumes_after_failure(
+    mailing,
+    newsletter,
+    bulk_email_backend,
+    monkeypatch,
+    django_capture_on_commit_callbacks,
+):
+    bulk_email_backend.CELERY_EMAIL_BULK_CHUNK_SIZE = 2
+    for i in range(5):
+        Subscriber.objects.create(
+            email="subscriber-{}@example.org".format(i),
+            newsletter=newsletter,
+            subscribed=timezone.now(),
+        )
+    mailing.finalize()
+
+    send = MailingMessage.send
+    calls = []
+
+    def send_until_broken(self, *args, **kwargs):
+        calls.append(self.id)
+        if len(calls) == 4:
+            raise ValueError("broken")
+        return send(self, *args, **kwargs)
+
+    monkeypatch.setattr(MailingMessage, "send", send_until_broken)
+    mail.outbox = []
+    with django_capture_on_commit_callbacks(execute=True):
+        mailing.send()
+
+    # The first chunk went out, the buffered third message was dropped
+    assert len(mail.outbox) == 2
+    shard = mailing.shards.get()
+    assert shard.failed is not None
+    assert shard.sent_count == 2
+    assert mailing.recipients.filter(sent__isnull=False).count() == 2
+
+    monkeypatch.undo()
+    with django_capture_on_commit_callbacks(execute=True):
+        mailing.continue_sending()
+
+    # Every recipient gets the mailing exactly once
+    recipients = [message.to[0] for message in mail.outbox]
+    assert len(recipients) == 6
+    assert len(set(recipients)) == 6
+    mailing.refresh_from_db()
+    assert mailing.sent
+
+
+@pytest.mark.django_db
+def test_mailing_finalize_bulk(mailing, newsletter, django_assert_max_num_queries):
+    for i in range(30):
+        Subscriber.objects.create(
+            email="subscriber-{}@example.org".format(i),
+            newsletter=newsletter,
+            subscribed=timezone.now(),
+        )
+    with django_assert_max_num_queries(15):
+        mailing.finalize()
+
+    assert mailing.recipients.count() == 31
+    assert set(mailing.recipients.values_list("email", flat=True)) == set(
+        mailing.get_subscribers().values_list("email", flat=True)
+    )
+    mailing.refresh_from_db()
+    assert mailing.preparation_started is not None
+    assert mailing.preparation_duration is not None
+
+
+@pytest.mark.django_db
+def test_mailing_batch_context(mailing, newsletter, django_assert_max_num_queries):
+    for i in range(10):
+        subscriber = Subscriber.objects.create(
+            email="subscriber-{}@example.org".format(i),
+            newsletter=newsletter,
+            subscribed=timezone.now(),
+        )
+        if i % 2 == 0:
+            donor = DonorFactory.create(
+                email=subscriber.email,
+                email_confirmed=timezone.now(),
+                subscriber=subscriber if i % 4 == 0 else None,
+            )
+            DonationFactory.create(
+                donor=donor, amount=10, received_timestamp=timezone.now()
+            )
+    mailing.auto_populate()
+
+    messages = list(
+        MailingMessage.objects.filter(mailing=mailing).select_related(
+            "mailing",
+            "user",
+            "subscriber__user",
+            "subscriber__newsletter",
+            "donor__user",
+        )
+    )
+    assert len(messages) == 11
+    with django_assert_max_num_queries(6):
+        resolver = BatchRecipientContextResolver(messages)
+
+    ignored_keys = {"pixel_url", "donations", "donor_url"}
+    for message, batch_context in zip(
+        messages, resolver.get_email_contexts(), strict=True
+    ):
+        context = message.get_email_context()
+        assert context.get("donor") == batch_context.get("donor")
+        assert context.get("amount_total") == batch_context.get("amount_total")
+        assert {k: v for k, v in context.items() if k not in ignored_keys} == {
+            k: v for k, v in batch_context.items() if k not in ignored_keys
+        }
+
+
+@pytest.mark.django_db
+def test_mailing_cached_recipient_count(mailing, newsletter):
+    assert mailing.recipient_count is None
+    assert mailing.is_recipient_count_stale
+
+    update_stale_recipient_counts()
+    mailing.refresh_from_db()
+    assert mailing.recipient_count == 1
+    assert not mailing.is_recipient_count_stale
+
+    Subscriber.objects.create(
+        email="another@example.org",
+        newsletter=newsletter,
+        subscribed=timezone.now(),
+    )
+    update_stale_recipient_counts()
+    mailing.refresh_from_db()
+    assert mailing.recipient_count == 1
+
+    Mailing.objects.filter(id=mailing.id).update(
+        recipient_count_updated=timezone.now() - RECIPIENT_COUNT_MAX_AGE * 2
+    )
+    update_stale_recipient_counts()
+    mailing.refresh_from_db()
+    assert mailing.recipient_count == 2
+
+    # Drafts not edited for a long time are left alone
+    Subscriber.objects.create(
+        email="third@example.org",
+        newsletter=newsletter,
+        subscribed=timezone.now(),
+    )
+    Mailing.objects.filter(id=mailing.id).update(
+        recipient_count_updated=timezone.now() - RECIPIENT_COUNT_MAX_AGE * 2,
+        updated=timezone.now() - RECIPIENT_COUNT_DRAFT_AGE * 2,
+    )
+    update_stale_recipient_counts()
+    mailing.refresh_from_db()
+    assert mailing.recipient_count == 2
+
+
+@pytest.mark.django_db
+def test_mailing_recipient_count_triggers(
+    mailing, newsletter, django_capture_on_commit_callbacks
+):
+    cache.delete(RECIPIENT_COUNT_DEBOUNCE_KEY)
+    with django_capture_on_commit_callbacks() as callbacks:
+        Mailing.schedule_stale_recipient_counts()
+        Mailing.schedule_stale_recipient_counts()
+    # Repeated changelist views are debounced
+    assert len(callbacks) == 1
+
+    root = Segment.add_root(name="Root")
+    child = root.add_child(name="Child")
+    mailing.segments.add(root)
+    mailing.update_recipient_count()
+    assert mailing.recipient_count == 1
+
+    subscriber = Subscriber.objects.get(email="subscribed@example.org")
+    with django_capture_on_commit_callbacks(execute=True):
+        subscriber.tags.add("tagged")
+    # Changing tags of a segment in the subtree recounts the mailing
+    with django_capture_on_commit_callbacks(execute=True):
+        child.tags.add("tagged", "missing")
+    mailing.refresh_from_db()
+    assert mailing.recipient_count == 0
+
+    with django_capture_on_commit_callbacks(execute=True):
+        child.tags.remove("missing")
+    mailing.refresh_from_db()
+    assert mailing.recipient_count == 1
+
+
+@pytest.mark.django_db
+def test_mailing_shard_bulk_chunks(mailing, newsletter, bulk_email_backend):
+    cache.delete(BUCKET_KEY.format("domain:web.de"))
+    for i in range(40):
+        Subscriber.objects.create(
+            email="subscriber-{}@example.org".format(i),
+            newsletter=newsletter,
+            subscribed=timezone.now(),
+        )
+    for i in range(2):
+        Subscriber.objects.create(
+            email="subscriber-{}@web.de".format(i),
+            newsletter=newsletter,
+            subscribed=timezone.now(),
+        )
+    mailing.finalize()
+    shard = mailing.create_shards()[0]
+
+    clock = FakeClock()
+    mail.outbox = []
+    # Default settings throttle some domains
+    shard.send(
+        scheduler=mailing.get_delivery_scheduler(clock=clock.time, sleep=clock.sleep)
+    )
+
+    shard.refresh_from_db()
+    assert len(mail.outbox) == 43
+    assert shard.sent_count == 43
+    # Unthrottled messages share bulk chunks, throttled ones go alone
+    assert shard.task_count == 3
+
+
+@pytest.mark.django_db
+def test_mailing_shard_throttled(mailing, newsletter, settings):
+    settings.MAILING_DOMAIN_SEND_RATES = {"web.de": 1}
+    for i in range(3):
+        Subscriber.objects.create(
+            email="subscriber-{}@web.de".format(i),
+            newsletter=newsletter,
+            subscribed=timezone.now(),
+        )
+    mailing.delivery_window = timedelta(seconds=8)
+    mailing.finalize()
+    shards = mailing.create_shards()
+    assert mailing.send_rate == pytest.approx(0.5)
+    assert mailing.projected_completion is not None
+    assert len(shards) == 1
+
+    clock = FakeClock()
+    mail.outbox = []
+    shards[0].send(
+        scheduler=mailing.get_delivery_scheduler(clock=clock.time, sleep=clock.sleep)
+    )
+    assert len(mail.outbox) == 4
+    # Four messages at 0.5 messages per second
+    assert clock.now == pytest.approx(6.0)
@@ -1,11 +1,20 @@
 import io
+import math
+import time
+from datetime import datetime, timedelta, timezone
 from urllib.parse import urlparse
 
 from django.conf import settings
+from django.utils import timezone as django_timezone
 
 import pytest
 
-from fragdenstaat_de.fds_mailing.models import Mailing
+from fragdenstaat_de.fds_mailing.models import (
+    Mailing,
+    MailingMessage,
+    MailingOpen,
+    MailingOpenStats,
+)
 from fragdenstaat_de.fds_mailing.pixel_log import (
     generate_random_unique_pixel_url,
     parse_pixel_path,
@@ -14,6 +23,7 @@ from fragdenstaat_de.fds_mailing.pixel_log import (
 from fragdenstaat_de.fds_mailing.pixel_log_parsing import (
     PixelLogParser,
     PixelProcessor,
+    parse_log_timestamp,
     read_pixel_log,
 )
 from fragdenstaat_de.fds_mailing.utils import LowerCaseSigner
@@ -184,8 +194,8 @@ def test_processing_pixel_log():
     assert mailing.open_log_timestamp is not None
     assert mailing.open_log_timestamp.second == 44
 
-    # Run again with higher timestamp and its counted
-    # as we are not aware of previous runs
+    # Run again with higher timestamp, e.g. after log rotation,
+    # the open is known from previous runs and not counted again
     log_lines = f"24/Apr/2025:14:12:45 +0200|GET {path} HTTP/2.0"
 
     parser = PixelLogParser(io.StringIO(log_lines))
@@ -194,6 +204,149 @@ def test_processing_pixel_log():
     processor.run()
     mailing.refresh_from_db()
 
-    assert mailing.open_count == 2
+    assert MailingOpen.objects.filter(mailing=mailing).count() == 1
+    assert mailing.open_count == 1
     assert mailing.open_log_timestamp is not None
     assert mailing.open_log_timestamp.second == 45
+
+
+@pytest.mark.django_db
+def test_pixel_log_open_stats():
+    mailing = Mailing.objects.create(
+        tracking=True, ready=True, submitted=True, sent=True
+    )
+    now = django_timezone.now()
+    MailingMessage.objects.bulk_create(
+        [
+            MailingMessage(mailing=mailing, email=f"user{i}@example.org", sent=now)
+            for i in range(4)
+        ]
+        + [MailingMessage(mailing=mailing, email="unsent@example.org")]
+    )
+    paths = [
+        urlparse(generate_random_unique_pixel_url(mailing.id)).path for _i in range(2)
+    ]
+    log_lines = "\n".join(
+        [
+            f"24/Apr/2025:14:12:43 +0200|GET {paths[0]} HTTP/2.0",
+            f"24/Apr/2025:14:13:43 +0200|GET {paths[1]} HTTP/2.0",
+            f"24/Apr/2025:14:14:43 +0200|GET {paths[0]} HTTP/2.0",
+        ]
+    )
+    processor = PixelProcessor(read_pixel_log(PixelLogParser(io.StringIO(log_lines))))
+    processor.run()
+
+    stats = MailingOpenStats.objects.get(mailing=mailing)
+    assert stats.unique_opens == 2
+    assert stats.recipient_count == 4
+    assert stats.open_rate == 0.5
+    assert stats.first_open.minute == 12
+    assert stats.last_open.minute == 13
+
+
+@pytest.mark.django_db
+def test_open_stats_fall_back_to_open_count():
+    # Sent before unique opens were recorded
+    mailing = Mailing.objects.create(
+        tracking=True, ready=True, submitted=True, sent=True, open_count=3
+    )
+    now = django_timezone.now()
+    MailingMessage.objects.bulk_create(
+        [
+            MailingMessage(mailing=mailing, email=f"user{i}@example.org", sent=now)
+            for i in range(4)
+        ]
+    )
+    MailingOpenStats.objects.refresh(concurrently=False)
+
+    stats = MailingOpenStats.objects.get(mailing=mailing)
+    assert stats.unique_opens == 3
+    assert stats.open_rate == 0.75
+    assert stats.first_open is None
+
+
+@pytest.mark.parametrize(
+    "date_str",
+    [
+        "24/Apr/2025:11:37:37 +0200",
+        "01/Dec/2024:23:59:59 -0130",
+        "31/Jan/2025:00:00:00 +0000",
+    ],
+)
+def test_parse_log_timestamp(date_str):
+    assert parse_log_timestamp(date_str) == datetime.strptime(
+        date_str, "%d/%b/%Y:%H:%M:%S %z"
+    )
+
+
+def make_pixel_log(mailings, line_count, opens_per_token=4):
+    start = datetime(2025, 4, 24, 11, 0, 0, tzinfo=timezone(timedelta(hours=2)))
+    paths = []
+    for mailing in mailings:
+        for _i in range(line_count // opens_per_token // len(mailings)):
+            url = generate_random_unique_pixel_url(mailing.id, namespace="mailing")
+            paths.append(urlparse(url).path)
+    lines = []
+    for i in range(line_count):
+        timestamp = (start + timedelta(seconds=i // 1000)).strftime(
+            "%d/%b/%Y:%H:%M:%S %z"
+        )
+        if i % 10 == 0:
+            lines.append(f"{timestamp}|GET /favicon.ico HTTP/2.0")
+        else:
+            path = paths[i % len(paths)]
+            lines.append(f"{timestamp}|GET {path} HTTP/2.0")
+    return "\n".join(lines), paths
+
+
+@pytest.mark.benchmark
+@pytest.mark.django_db
+def test_processing_pixel_log_benchmark():
+    mailings = [
+        Mailing.objects.create(
+            open_count=0, tracking=True, ready=True, submitted=True, sent=True
+        )
+        for _i in range(3)
+    ]
+    line_count = 100_000
+    log, paths = make_pixel_log(mailings, line_count)
+
+    start = time.perf_counter()
+    parser = PixelLogParser(io.StringIO(log))
+    processor = PixelProcessor(read_pixel_log(parser), batch_size=5000)
+    processor.run()
+    duration = time.perf_counter() - start
+
+    assert MailingOpen.objects.count() == len(paths)
+    assert line_count / duration > 20_000
+
+
+@pytest.mark.django_db
+def test_processing_pixel_log_batches(django_assert_max_num_queries):
+    mailings = [
+        Mailing.objects.create(
+            open_count=0, tracking=True, ready=True, submitted=True, sent=True
+        )
+        for _i in range(3)
+    ]
+    line_count = 10_000
+    batch_size = 500
+    log, paths = make_pixel_log(mailings, line_count)
+
+    parser = PixelLogParser(io.StringIO(log))
+    processor = PixelProcessor(read_pixel_log(parser), batch_size=batch_size)
+    # Loading mailings, one insert per batch, saving counters and stats
+    with django_assert_max_num_queries(3 + math.ceil(len(paths) / batch_size)):
+        processor.run()
+
+    for mailing in mailings:
+        mailing.refresh_from_db()
+    assert sum(m.open_count for m in mailings) == len(paths)
+    assert MailingOpen.objects.count() == len(paths)
+
+    # Reading the same log again does not count anything twice
+    processor = PixelProcessor(read_pixel_log(PixelLogParser(io.StringIO(log))))
+    processor.run()
+    for mailing in mailings:
+        mailing.refresh_from_db()
+    assert sum(m.open_count for m in mailings) == len(paths)
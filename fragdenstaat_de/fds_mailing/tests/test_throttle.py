@@ -0,0 +1,98 @@
+from django.core.cache import cache
+
+import pytest
+
+from ..throttle import BUCKET_KEY, DeliveryScheduler, TokenBucket
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def make_scheduler(clock, **kwargs):
+    return DeliveryScheduler(clock=clock.time, sleep=clock.sleep, **kwargs)
+
+
+def test_token_bucket_burst():
+    clock = FakeClock()
+    bucket = TokenBucket(2, capacity=3, clock=clock.time)
+    for _ in range(3):
+        assert bucket.get_available(0.0) == 0.0
+        bucket.consume(0.0)
+    assert bucket.get_available(0.0) == pytest.approx(0.5)
+
+
+def test_scheduler_rate():
+    clock = FakeClock()
+    scheduler = make_scheduler(clock, rate=4)
+    for _ in range(9):
+        scheduler.wait("a@example.org")
+    assert clock.now == pytest.approx(2.0)
+
+
+def test_scheduler_domain_rate():
+    clock = FakeClock()
+    scheduler = make_scheduler(clock, rate=10, domain_rates={"gmx.de": 1})
+    scheduler.wait("a@gmx.de")
+    scheduler.wait("b@example.org")
+    assert clock.now == pytest.approx(0.1)
+    scheduler.wait("c@GMX.de")
+    assert clock.now == pytest.approx(1.0)
+    scheduler.wait("d@example.org")
+    assert clock.now == pytest.approx(1.1)
+
+
+def test_scheduler_plan():
+    scheduler = DeliveryScheduler(rate=2, domain_rates={"web.de": 0.5})
+    offsets = scheduler.plan(["a@web.de", "b@example.org", "c@web.de", "d@example.org"])
+    assert offsets == pytest.approx([0.0, 0.5, 2.0, 2.5])
+    assert scheduler.get_projected_duration(
+        ["a@web.de", "b@example.org", "c@web.de", "d@example.org"]
+    ) == pytest.approx(2.0)
+
+
+def test_scheduler_unthrottled():
+    clock = FakeClock()
+    scheduler = make_scheduler(clock)
+    assert not scheduler.is_throttled
+    for _ in range(100):
+        scheduler.wait("a@gmx.de")
+    assert clock.sleeps == []
+
+
+def test_scheduler_shared_buckets():
+    cache.delete_many(
+        [BUCKET_KEY.format("test-shared"), BUCKET_KEY.format("domain:gmx.net")]
+    )
+    clock = FakeClock()
+    # Two shards of the same mailing share the mailing and domain rates
+    first = make_scheduler(
+        clock, rate=4, domain_rates={"gmx.net": 1}, key="test-shared"
+    )
+    second = make_scheduler(
+        clock, rate=4, domain_rates={"gmx.net": 1}, key="test-shared"
+    )
+    first.wait("a@example.org")
+    second.wait("b@example.org")
+    assert clock.now == pytest.approx(0.25)
+    first.wait("c@gmx.net")
+    second.wait("d@gmx.net")
+    assert clock.now == pytest.approx(1.5)
+
+
+def test_scheduler_throttle_group():
+    clock = FakeClock()
+    scheduler = make_scheduler(clock, domain_rates={"gmx.net": 1})
+    assert scheduler.get_throttle_group("a@gmx.net") == "domain:gmx.net"
+    assert scheduler.get_throttle_group("a@example.org") is None
+    scheduler = make_scheduler(clock, rate=2, domain_rates={"gmx.net": 1})
+    assert scheduler.get_throttle_group("a@example.org") == "mailing"
@@ -94,3 +94,54 @@ def test_mailing_url_tagging(settings):
         content.text
         == "Hello, visit https://example.com/page?pk_campaign=mailing-202412131242-1 for more info and click bar."
     )
+
+
+def make_newsletter_html(site_url, size=50_000):
+    parts = []
+    i = 0
+    while sum(len(p) for p in parts) < size:
+        parts.append(
+            "<tr><td><p>Lorem ipsum dolor sit amet &amp; more.</p>"
+            '<a href="{site}/artikel/{n}/?a=1&amp;b=2">Artikel {n}</a> '
+            '<a href="{site}/kampagne/{m}/">Kampagne</a> '
+            '<a href="https://external.example.org/{n}/">Extern</a></td></tr>\n'.format(
+                site=site_url, n=i, m=i % 5
+            )
+        )
+        i += 1
+    return "".join(parts)
+
+
+def test_url_tagger_newsletter_benchmark(settings, monkeypatch):
+    settings.SITE_URL = "https://example.com"
+    html = make_newsletter_html(settings.SITE_URL)
+    assert len(html) >= 50_000
+
+    expected = get_url_tagger("campaign123")(html, html_entities=True)
+    assert "/artikel/1/?a=1&amp;b=2&amp;pk_campaign=campaign123" in expected
+    assert 'https://external.example.org/1/"' in expected
+
+    from .. import utils
+
+    parse_calls = []
+    original_urlparse = utils.urlparse
+
+    def counting_urlparse(url):
+        parse_calls.append(url)
+        return original_urlparse(url)
+
+    monkeypatch.setattr(utils, "urlparse", counting_urlparse)
+
+    tagger = get_url_tagger("campaign123")
+    first = tagger(html, html_entities=True)
+    distinct_urls = len(parse_calls)
+    assert first == expected
+
+    # Every further recipient only parses URLs it has not seen before
+    for n in range(100):
+        personal_html = html + '<a href="{}/login/{}/">Login</a>'.format(
+            settings.SITE_URL, n
+        )
+        result = tagger(personal_html, html_entities=True)
+        assert result.startswith(expected)
+    assert len(parse_calls) == distinct_urls + 100
@@ -0,0 +1,211 @@
+"""
+Token buckets to throttle mailing delivery per mailing and per
+recipient domain, so large providers do not greylist or defer us.
+
+Buckets of a scheduler with a key are shared through the cache, so
+shards sending in parallel draw from the same tokens and the rate
+limits hold for the whole mailing, and per domain across mailings.
+"""
+
+import time
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+
+from fragdenstaat_de.theme.utils import cache_lock
+
+BUCKET_KEY = "fds_mailing:throttle:{}"
+BUCKET_TIMEOUT = 60 * 60
+LOCK_TIMEOUT = 5
+
+
+def get_email_domain(email):
+    return email.rsplit("@", 1)[-1].lower()
+
+
+class TokenBucket:
+    """
+    Token bucket with a fill rate in tokens per second and a burst capacity.
+    Tokens can be consumed at a future time to reserve a send slot.
+    """
+
+    def __init__(self, rate, capacity=1, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.tokens = capacity
+        self.updated = clock()
+
+    def refill(self, now):
+        elapsed = max(0.0, now - self.updated)
+        self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+        self.updated = max(self.updated, now)
+
+    def get_available(self, now):
+        """
+        Returns the earliest time at or after now when a token is available.
+        """
+        start = max(now, self.updated)
+        self.refill(start)
+        if self.tokens >= 1:
+            return start
+        return start + (1 - self.tokens) / self.rate
+
+    def consume(self, when):
+        self.refill(when)
+        self.tokens -= 1
+
+    @contextmanager
+    def locked(self):
+        yield self
+
+
+class SharedTokenBucket(TokenBucket):
+    """
+    Token bucket with its state kept in the cache. The state is loaded
+    and stored under a lock, the clock has to be the same for all workers.
+    """
+
+    def __init__(self, key, rate, capacity=1, clock=time.time, cache=cache):
+        self.key = key
+        self.cache = cache
+        super().__init__(rate, capacity=capacity, clock=clock)
+
+    @contextmanager
+    def locked(self):
+        lock_key = "{}:lock".format(self.key)
+        with cache_lock(lock_key, LOCK_TIMEOUT, cache=self.cache):
+            state = self.cache.get(self.key)
+            if state is not None:
+                self.tokens, self.updated = state
+            yield self
+            self.cache.set(self.key, (self.tokens, self.updated), BUCKET_TIMEOUT)
+
+
+class DeliveryScheduler:
+    """
+    Combines a bucket for the whole mailing with buckets per recipient
+    domain. `wait` blocks until a message to the given email may be
+    sent, `plan` computes send offsets without waiting. With a key,
+    the buckets are shared with all schedulers of the same key.
+    """
+
+    def __init__(
+        self,
+        rate=None,
+        domain_rates=None,
+        burst=1,
+        clock=time.time,
+        sleep=time.sleep,
+        key=None,
+    ):
+        self.rate = rate
+        self.domain_rates = domain_rates or {}
+        self.burst = burst
+        self.clock = clock
+        self.sleep = sleep
+        self.key = key
+        self.bucket = None
+        if rate:
+            self.bucket = self.make_bucket(key, rate)
+        self.domain_buckets = {}
+
+    def make_bucket(self, key, rate):
+        if self.key is None:
+            return TokenBucket(rate, capacity=self.burst, clock=self.clock)
+        return SharedTokenBucket(
+            BUCKET_KEY.format(key), rate, capacity=self.burst, clock=self.clock
+        )
+
+    @property
+    def is_throttled(self):
+        return bool(self.rate or self.domain_rates)
+
+    @classmethod
+    def from_settings(cls, rate=None, **kwargs):
+        if rate is None:
+            rate = getattr(settings, "MAILING_SEND_RATE", None)
+        domain_rates = getattr(settings, "MAILING_DOMAIN_SEND_RATES", {})
+        return cls(rate=rate, domain_rates=domain_rates, **kwargs)
+
+    def get_buckets(self, email):
+        buckets = []
+        if self.bucket is not None:
+            buckets.append(self.bucket)
+        domain = get_email_domain(email)
+        domain_rate = self.domain_rates.get(domain)
+        if domain_rate:
+            if domain not in self.domain_buckets:
+                self.domain_buckets[domain] = self.make_bucket(
+                    "domain:{}".format(domain), domain_rate
+                )
+            buckets.append(self.domain_buckets[domain])
+        return buckets
+
+    def get_throttle_group(self, email):
+        """
+        Returns the bucket key that limits sending to email,
+        None if it is not throttled.
+        """
+        if self.rate:
+            return "mailing"
+        domain = get_email_domain(email)
+        if self.domain_rates.get(domain):
+            return "domain:{}".format(domain)
+        return None
+
+    def reserve(self, email, now):
+        """
+        Reserve a send slot for email at or after now,
+        returns the time of the slot.
+        """
+        buckets = self.get_buckets(email)
+        with ExitStack() as stack:
+            # Always locked in the same order, mailing before domain
+            for bucket in buckets:
+                stack.enter_context(bucket.locked())
+            slot = max((bucket.get_available(now) for bucket in buckets), default=now)
+            for bucket in buckets:
+                bucket.consume(slot)
+        return slot
+
+    def wait(self, email):
+        now = self.clock()
+        slot = self.reserve(email, now)
+        if slot > now:
+            self.sleep(slot - now)
+
+    def plan(self, emails, start=0.0):
+        """
+        Returns send offsets in seconds from start for emails in order.
+        Does not touch the state used by `wait`.
+        """
+        planner = DeliveryScheduler(
+            rate=self.rate,
+            domain_rates=self.domain_rates,
+            burst=self.burst,
+            clock=lambda: start,
+        )
+        now = start
+        offsets = []
+        for email in emails:
+            now = planner.reserve(email, now)
+            offsets.append(now - start)
+        return offsets
+
+    def get_projected_duration(self, emails):
+        """
+        Lower bound of seconds needed to deliver emails, independent of order.
+        """
+        emails = list(emails)
+        durations = [0.0]
+        if self.rate:
+            durations.append(max(0, len(emails) - self.burst) / self.rate)
+        domain_counts = Counter(get_email_domain(email) for email in emails)
+        for domain, count in domain_counts.items():
+            domain_rate = self.domain_rates.get(domain)
+            if domain_rate:
+                durations.append(max(0, count - self.burst) / domain_rate)
+        return max(durations)
@@ -1,4 +1,5 @@
 import base64
+import functools
 import re
 from datetime import timedelta
 from urllib.parse import parse_qs, urlencode, urlparse
@@ -202,24 +203,59 @@ class LowerCaseSigner(signing.Signer):
         ).lower()
 
 
-def get_url_tagger(mailing_campaign: str, query_param: str = "pk_campaign") -> str:
-    url_regex = re.compile('(%s[^\\s"]+)' % re.escape(settings.SITE_URL))
-
-    def tag_urls(text, html_entities=False):
-        def replace_match(match):
-            url_match = match.group(1)
-            if html_entities:
-                url_match = url_match.replace("&amp;", "&")
-            url = urlparse(url_match)
-            qs = parse_qs(url.query, keep_blank_values=True)
-            if query_param in qs:
-                return match.group(0)
-            qs[query_param] = [mailing_campaign]
-            url_str = url._replace(query=urlencode(qs, doseq=True)).geturl()
-            if html_entities:
-                url_str = url_str.replace("&", "&amp;")
-            return url_str
+@functools.lru_cache(maxsize=8)
+def get_url_regex(site_url: str) -> re.Pattern:
+    return re.compile('(%s[^\\s"]+)' % re.escape(site_url))
+
+
+class UrlTagger:
+    """
+    Adds a campaign query parameter to all site URLs in a text.
+    Tagged URLs are memoized, so tagging the same mailing for many
+    recipients only parses URLs that differ between recipients.
+    """
+
+    max_cache_size = 10000
+
+    def __init__(self, mailing_campaign: str, query_param: str = "pk_campaign"):
+        self.mailing_campaign = mailing_campaign
+        self.query_param = query_param
+        self.url_regex = get_url_regex(settings.SITE_URL)
+        self.cache = {}
+
+    def tag_url(self, url_match: str, html_entities: bool = False) -> str:
+        key = (url_match, html_entities)
+        try:
+            return self.cache[key]
+        except KeyError:
+            pass
+        url_str = self._tag_url(url_match, html_entities=html_entities)
+        if len(self.cache) < self.max_cache_size:
+            self.cache[key] = url_str
+        return url_str
+
+    def _tag_url(self, url_match: str, html_entities: bool = False) -> str:
+        original = url_match
+        if html_entities:
+            url_match = url_match.replace("&amp;", "&")
+        url = urlparse(url_match)
+        qs = parse_qs(url.query, keep_blank_values=True)
+        if self.query_param in qs:
+            return original
+        qs[self.query_param] = [self.mailing_campaign]
+        url_str = url._replace(query=urlencode(qs, doseq=True)).geturl()
+        if html_entities:
+            url_str = url_str.replace("&", "&amp;")
+        return url_str
+
+    def __call__(self, text: str, html_entities: bool = False) -> str:
+        return self.url_regex.sub(
+            lambda match: self.tag_url(match.group(1), html_entities=html_entities),
+            text,
+        )
 
-        return url_regex.sub(replace_match, text)
 
-    return tag_urls
+def get_url_tagger(
+    mailing_campaign: str, query_param: str = "pk_campaign"
+) -> UrlTagger:
+    return UrlTagger(mailing_campaign, query_param=query_param)
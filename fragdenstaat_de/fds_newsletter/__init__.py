@@ -5,4 +5,7 @@ default_app_config = "fragdenstaat_de.fds_newsletter.apps.NewsletterConfig"
 subscribed = Signal()  # args: []
 unsubscribed = Signal()  # args: []
 
-tag_subscriber = Signal()  # args: [email]
+# Receivers return {subscriber_id: (add_tags, remove_tags)}
+tag_subscribers = Signal()  # args: [subscribers]
+# Receivers return a Q object on Subscriber for changed tag sources
+tag_sources_changed = Signal()  # args: [since]
@@ -1,3 +1,5 @@
+from itertools import batched
+
 from django import forms
 from django.conf import settings
 from django.contrib import admin
@@ -7,8 +9,10 @@ from django.db.models.functions import Cast, Collate, ExtractDay, Now, TruncDate
 from django.http import JsonResponse
 from django.urls import path, reverse, reverse_lazy
 from django.utils import timezone
+from django.utils.decorators import method_decorator
 from django.utils.html import format_html
 from django.utils.translation import gettext as _
+from django.views.decorators.gzip import gzip_page
 
 from flowcontrol.engine import create_flowrun
 from flowcontrol.models import Flow
@@ -23,11 +27,11 @@ from froide.helper.admin_utils import (
     make_daterangefilter,
     make_rangefilter,
 )
-from froide.helper.csv_utils import export_csv, export_csv_response
 from froide.helper.widgets import TagAutocompleteWidget
 
 from fragdenstaat_de.fds_mailing.models import MailingMessage
 from fragdenstaat_de.fds_mailing.utils import SetupMailingMixin
+from fragdenstaat_de.theme.csv_export import export_queryset_csv
 
 from .models import (
     SUBSCRIBER_TAG_AUTOCOMPLETE_URL,
@@ -41,6 +45,8 @@ from .models import (
     TaggedSubscriber,
     UnsubscribeFeedback,
 )
+from .tag_index import tag_index
+from .tagging import SUBSCRIBER_TAG_BATCH_SIZE, update_subscriber_tags
 from .utils import subscribe, unsubscribe_queryset
 
 
@@ -253,21 +259,47 @@ class SubscriberAdmin(SetupMailingMixin, admin.ModelAdmin):
 
     @admin.action(description=_("Update tags"))
     def update_tags(self, request, queryset):
-        for subscriber in queryset:
-            subscriber.update_tags()
+        subscribers = queryset.select_related("user")
+        for subscriber_batch in batched(subscribers, SUBSCRIBER_TAG_BATCH_SIZE):
+            update_subscriber_tags(subscriber_batch)
 
     @admin.action(description=_("Export to CSV"))
+    @method_decorator(gzip_page)
     def export_subscribers_csv(self, request, queryset):
+        def get_email(row):
+            if row["user_id"]:
+                return row["user__email"]
+            return row["email"]
+
+        def get_name(row):
+            if row["user_id"]:
+                return "{} {}".format(row["user__first_name"], row["user__last_name"])
+            return row["name"]
+
         fields = (
             "id",
-            ("email", lambda o: o.get_email()),
-            ("name", lambda o: o.get_name()),
+            "email",
+            "name",
             "newsletter_id",
             "user_id",
+            "user__email",
+            "user__first_name",
+            "user__last_name",
             "subscribed",
             "unsubscribed",
         )
-        return export_csv_response(export_csv(queryset, fields))
+        columns = {
+            "id": "id",
+            "email": get_email,
+            "name": get_name,
+            "newsletter_id": "newsletter_id",
+            "user_id": "user_id",
+            "subscribed": "subscribed",
+            "unsubscribed": "unsubscribed",
+        }
+        return export_queryset_csv(
+            queryset, fields, columns, filename="subscribers.csv"
+        )
 
     def setup_mailing_messages(self, mailing, queryset):
         queryset = queryset.exclude(subscribed__isnull=True)
@@ -295,16 +327,6 @@ class SubscriberTagAdmin(admin.ModelAdmin):
     list_display = ("name", "subscriber_count")
     search_fields = ("name",)
 
-    def get_queryset(self, request):
-        qs = super().get_queryset(request)
-        qs = qs.annotate(
-            subscriber_count=Count(
-                "subscribers",
-                filter=Q(subscribers__content_object__subscribed__isnull=False),
-            )
-        )
-        return qs
-
     def get_urls(self):
         urls = super().get_urls()
         my_urls = [
@@ -323,11 +345,10 @@ class SubscriberTagAdmin(admin.ModelAdmin):
         qs = qs.order_by("name").values_list("name", flat=True)
         return JsonResponse({"objects": [{"value": tag, "label": tag} for tag in qs]})
 
+    @admin.display(description=_("active subscriber count"))
     def subscriber_count(self, obj):
-        return obj.subscriber_count
-
-    subscriber_count.admin_order_field = "subscriber_count"
-    subscriber_count.short_description = _("active subscriber count")
+        subscribed = tag_index.get_subscribed_bitmap()
+        return len(tag_index.get_tag_bitmap(obj.id) & subscribed)
 
 
 SegmentAdminBaseForm = movenodeform_factory(Segment)
@@ -385,12 +406,11 @@ class SegmentAdmin(TreeAdmin):
                 self._newsletter = None
         return self._newsletter
 
-    @admin.display(
-        ordering="subscriber_count", description=_("active subscriber count")
-    )
+    @admin.display(description=_("active subscriber count"))
     def subscriber_count(self, obj):
-        # FIXME: n+1 query with ballooning joins
-        return obj.get_subscribers(newsletter=self.get_default_newsletter()).count()
+        newsletter = self.get_default_newsletter()
+        newsletter_id = newsletter.id if newsletter is not None else None
+        return len(tag_index.get_segments_bitmap([obj], newsletter_id=newsletter_id))
 
     @admin.action(description=_("Archive segments"))
     def archive_segments(self, request, queryset):
@@ -434,6 +454,7 @@ class SubscriberImportAdmin(admin.ModelAdmin):
         "reference",
         "started",
         "completed",
+        "progress",
         "imported_count",
     )
     list_filter = (
@@ -448,6 +469,7 @@ class SubscriberImportAdmin(admin.ModelAdmin):
         "started",
         "completed",
         "row_count",
+        "processed_count",
         "imported_count",
     )
 
@@ -476,10 +498,17 @@ class SubscriberImportAdmin(admin.ModelAdmin):
                 "started",
                 "completed",
                 "row_count",
+                "processed_count",
                 "imported_count",
             )
         return super().get_readonly_fields(request, obj)
 
+    @admin.display(description=_("progress"))
+    def progress(self, obj):
+        if not obj.row_count:
+            return "-"
+        return "{} / {}".format(obj.processed_count or 0, obj.row_count)
+
     @admin.action(description=_("Start import"))
     def start_import(self, request, queryset):
         queryset = queryset.filter(started=None)
@@ -7,6 +7,7 @@ from froide.helper.admin_utils import (
 
 from .admin import SUBSCRIBER_TAG_AUTOCOMPLETE_URL
 from .models import Subscriber, SubscriberTag, TaggedSubscriber
+from .tag_index import tag_index
 
 
 def make_subscriber_tagger(
@@ -47,12 +48,14 @@ def apply_tags_to_subscribers(tags: list[str], queryset, field="tags"):
         return
 
     tags = [SubscriberTag.objects.get_or_create(name=tag)[0] for tag in tags]
+    subscriber_ids = list(queryset.values_list("id", flat=True))
 
     for tag in tags:
         TaggedSubscriber.objects.bulk_create(
             [
                 TaggedSubscriber(content_object_id=subscriber_id, tag=tag)
-                for subscriber_id in queryset.values_list("id", flat=True)
+                for subscriber_id in subscriber_ids
             ],
             ignore_conflicts=True,
         )
+    tag_index.add_tags(subscriber_ids, [tag.id for tag in tags])
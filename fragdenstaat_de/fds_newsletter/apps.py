@@ -2,7 +2,8 @@ import json
 from datetime import timedelta
 
 from django.apps import AppConfig
-from django.db.models.signals import pre_delete
+from django.db.models import Q
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
@@ -34,7 +35,8 @@ class NewsletterConfig(AppConfig):
         from . import (
             actions,  # noqa: F401
             subscribed,
-            tag_subscriber,
+            tag_sources_changed,
+            tag_subscribers,
             unsubscribed,
         )
         from .forms import NewsletterFollowExtra, NewsletterUserExtra
@@ -45,12 +47,15 @@ class NewsletterConfig(AppConfig):
             handle_bounce,
             handle_unsubscribe,
             merge_user,
+            newsletter_changed,
             subscribe_alert,
             subscribe_follower,
+            subscriber_changed,
             subscriber_import_delete_file,
             user_email_changed,
         )
-        from .models import SubscriberImport
+        from .models import Newsletter, Subscriber, SubscriberImport, TaggedSubscriber
+        from .tag_index import update_subscription_index, update_tag_index
         from .triggers import (
             newsletter_subscribed_trigger_listener,
             newsletter_unsubscribed_trigger_listener,
@@ -70,8 +75,18 @@ class NewsletterConfig(AppConfig):
         user_extra_registry.register("alert", NewsletterFollowExtra())
         FoiRequestFollower.followed.connect(subscribe_follower)
         Alert.subscribed.connect(subscribe_alert)
-        tag_subscriber.connect(set_new_subscriber_tag)
+        tag_subscribers.connect(set_new_subscriber_tags)
+        tag_sources_changed.connect(new_subscriber_tag_changed)
         pre_delete.connect(subscriber_import_delete_file, sender=SubscriberImport)
+        m2m_changed.connect(update_tag_index, sender=TaggedSubscriber)
+        post_save.connect(update_subscription_index, sender=Subscriber)
+        post_delete.connect(update_subscription_index, sender=Subscriber)
+        subscribed.connect(subscriber_changed)
+        unsubscribed.connect(subscriber_changed)
+        post_save.connect(subscriber_changed, sender=Subscriber)
+        post_delete.connect(subscriber_changed, sender=Subscriber)
+        post_save.connect(newsletter_changed, sender=Newsletter)
+        post_delete.connect(newsletter_changed, sender=Newsletter)
 
         registry.register(export_user_data)
 
@@ -105,13 +120,23 @@ def export_user_data(user):
         )
 
 
-def set_new_subscriber_tag(sender, email=None, **kwargs):
-    SIX_MONTHS = timedelta(days=182)
-    is_new = sender.created + SIX_MONTHS > timezone.now()
-    add_tags = set()
-    remove_tags = set()
-    if is_new:
-        add_tags.add("newsletter:new")
-    else:
-        remove_tags.add("newsletter:new")
-    return add_tags, remove_tags
+NEW_SUBSCRIBER_PERIOD = timedelta(days=182)
+
+
+def set_new_subscriber_tags(sender, subscribers=None, **kwargs):
+    new_since = timezone.now() - NEW_SUBSCRIBER_PERIOD
+    result = {}
+    for subscriber in subscribers:
+        if subscriber.created > new_since:
+            result[subscriber.id] = ({"newsletter:new"}, set())
+        else:
+            result[subscriber.id] = (set(), {"newsletter:new"})
+    return result
+
+
+def new_subscriber_tag_changed(sender, since=None, **kwargs):
+    # Subscribers who stopped being new since the last run
+    return Q(
+        created__gt=since - NEW_SUBSCRIBER_PERIOD,
+        created__lte=timezone.now() - NEW_SUBSCRIBER_PERIOD,
+    )
@@ -0,0 +1,73 @@
+"""
+Compact sets of subscriber ids.
+
+Bits of a Python integer stand for subscriber ids, so intersections,
+unions and counts run in C over machine words. Serialized bitmaps are
+zlib compressed, which keeps sparse id ranges small.
+"""
+
+import re
+import zlib
+from typing import Iterable
+
+SET_BIT_RE = re.compile("1")
+
+
+class SubscriberBitmap:
+    __slots__ = ("bits",)
+
+    def __init__(self, bits: int = 0):
+        self.bits = bits
+
+    @classmethod
+    def from_ids(cls, ids: Iterable[int]) -> "SubscriberBitmap":
+        ids = list(ids)
+        if not ids:
+            return cls()
+        buffer = bytearray(max(ids) // 8 + 1)
+        for id_ in ids:
+            buffer[id_ >> 3] |= 1 << (id_ & 7)
+        return cls(int.from_bytes(buffer, "little"))
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "SubscriberBitmap":
+        return cls(int.from_bytes(zlib.decompress(data), "little"))
+
+    def to_bytes(self) -> bytes:
+        length = (self.bits.bit_length() + 7) // 8
+        return zlib.compress(self.bits.to_bytes(length, "little"))
+
+    def __and__(self, other):
+        return SubscriberBitmap(self.bits & other.bits)
+
+    def __or__(self, other):
+        return SubscriberBitmap(self.bits | other.bits)
+
+    def __sub__(self, other):
+        return SubscriberBitmap(self.bits & ~other.bits)
+
+    def __eq__(self, other):
+        if not isinstance(other, SubscriberBitmap):
+            return NotImplemented
+        return self.bits == other.bits
+
+    def __hash__(self):
+        return hash(self.bits)
+
+    def __len__(self):
+        return self.bits.bit_count()
+
+    def __bool__(self):
+        return bool(self.bits)
+
+    def __contains__(self, id_):
+        return bool(self.bits >> id_ & 1)
+
+    def __iter__(self):
+        # Reversed binary string has the bit for id n at position n
+        binary = bin(self.bits)[:1:-1]
+        for match in SET_BIT_RE.finditer(binary):
+            yield match.start()
+
+    def __repr__(self):
+        return "<SubscriberBitmap: %d ids>" % len(self)
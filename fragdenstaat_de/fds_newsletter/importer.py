@@ -0,0 +1,255 @@
+"""
+Bulk import of newsletter subscribers from CSV files.
+
+Rows are normalized and de-duplicated by email in memory. Each batch
+of emails resolves existing users and subscribers with IN queries,
+creates new subscribers and their tags with bulk inserts and subscribes
+confirmed emails with one update. Activation mails are queued as one
+task per batch.
+"""
+
+import csv
+from dataclasses import dataclass, field
+from itertools import batched
+
+from django.contrib.auth import get_user_model
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from . import subscribed
+from .models import Subscriber
+from .tag_index import tag_index
+from .tagging import apply_tag_deltas
+
+IMPORT_BATCH_SIZE = 1000
+NAME_MAX_LENGTH = Subscriber._meta.get_field("name").max_length
+
+
+@dataclass
+class ImportRow:
+    name: str
+    data: dict
+    raw_emails: set = field(default_factory=set)
+    tags: set = field(default_factory=set)
+    row_count: int = 0
+
+
+def get_row_name(row):
+    if "name" in row:
+        name = row.get("name") or ""
+    elif "first_name" in row and "last_name" in row:
+        name = "{} {}".format(row["first_name"], row["last_name"])
+    else:
+        name = ""
+    return name.strip()[:NAME_MAX_LENGTH]
+
+
+@dataclass
+class BatchResult:
+    imported_count: int = 0
+    subscribed: list = field(default_factory=list)
+    user_subscribers: list = field(default_factory=list)
+    activation_ids: list = field(default_factory=list)
+
+
+class SubscriberImporter:
+    def __init__(
+        self,
+        newsletter,
+        reference="",
+        email_confirmed=False,
+        tags=None,
+        new_tags=None,
+        data_columns=None,
+        activation_template=None,
+        batch_size=IMPORT_BATCH_SIZE,
+        progress=None,
+    ):
+        self.newsletter = newsletter
+        self.reference = reference
+        self.email_confirmed = email_confirmed
+        self.tags = set(tags or ())
+        self.new_tags = set(new_tags or ())
+        self.data_columns = set(data_columns or ())
+        self.activation_template = activation_template
+        self.batch_size = batch_size
+        self.progress = progress
+        self.rows = {}
+
+    def read_rows(self, csv_file):
+        """
+        Reads the CSV into rows by normalized email and returns the
+        number of CSV rows. Tags of duplicate rows are merged, name
+        and data are taken from the first row.
+        """
+        row_count = 0
+        for row in csv.DictReader(csv_file):
+            row_count += 1
+            raw_email = (row.get("email") or "").strip()
+            email = raw_email.lower()
+            if not email:
+                continue
+            import_row = self.rows.get(email)
+            if import_row is None:
+                import_row = ImportRow(
+                    name=get_row_name(row),
+                    data={k: v for k, v in row.items() if k in self.data_columns},
+                )
+                self.rows[email] = import_row
+            import_row.raw_emails.add(raw_email)
+            import_row.tags.update(
+                t.strip() for t in (row.get("tags") or "").split(",") if t.strip()
+            )
+            import_row.row_count += 1
+        return row_count
+
+    def run(self, csv_file):
+        row_count = self.read_rows(csv_file)
+        processed_count = row_count - sum(r.row_count for r in self.rows.values())
+        imported_count = 0
+        for emails in batched(self.rows, self.batch_size):
+            result = self.import_batch(emails)
+            self.finish_batch(result)
+            processed_count += sum(self.rows[email].row_count for email in emails)
+            imported_count += result.imported_count
+            if self.progress is not None:
+                self.progress(row_count, processed_count, imported_count)
+        return row_count, imported_count
+
+    def import_batch(self, emails):
+        try:
+            with transaction.atomic():
+                return self.write_batch(emails)
+        except IntegrityError:
+            # A subscriber was created concurrently, resolve the batch again
+            with transaction.atomic():
+                return self.write_batch(emails)
+
+    def get_users(self, emails):
+        User = get_user_model()
+        candidates = set(emails)
+        for email in emails:
+            candidates |= self.rows[email].raw_emails
+        return {
+            user.email.lower(): user
+            for user in User.objects.filter(email__in=candidates)
+        }
+
+    def get_existing_subscribers(self, emails, users):
+        subscribers = list(
+            Subscriber.objects.filter(newsletter=self.newsletter)
+            .filter(Q(email__in=emails) | Q(user_id__in=[u.id for u in users.values()]))
+            .select_related("user")
+        )
+        existing = {}
+        # Prefer subscribers by email over subscribers by user email
+        for subscriber in subscribers:
+            if subscriber.email:
+                existing.setdefault(subscriber.email.lower(), subscriber)
+        for subscriber in subscribers:
+            if subscriber.user:
+                existing.setdefault(subscriber.user.email.lower(), subscriber)
+        return existing
+
+    def write_batch(self, emails):
+        result = BatchResult()
+        users = self.get_users(emails)
+        subscribers = self.get_existing_subscribers(emails, users)
+        new_subscribers = [
+            Subscriber(
+                newsletter=self.newsletter,
+                email=email,
+                name=self.rows[email].name,
+                reference=self.reference,
+                data=self.rows[email].data,
+            )
+            for email in emails
+            if email not in subscribers
+        ]
+        Subscriber.objects.bulk_create(new_subscribers)
+        created_ids = {s.id for s in new_subscribers}
+        subscribers.update({s.email: s for s in new_subscribers})
+
+        apply_tag_deltas(
+            {
+                subscriber.id: (
+                    self.tags
+                    | self.rows[email].tags
+                    | (self.new_tags if subscriber.id in created_ids else set()),
+                    set(),
+                )
+                for email, subscriber in subscribers.items()
+            }
+        )
+
+        pending = {
+            email: subscriber
+            for email, subscriber in subscribers.items()
+            if not subscriber.subscribed
+        }
+        result.imported_count = len(pending)
+        if not self.email_confirmed:
+            result.activation_ids = [
+                s.id for s in pending.values() if s.can_send_activation()
+            ]
+            return result
+
+        for email, subscriber in pending.items():
+            user = users.get(email)
+            if subscriber.email and user is not None and user.is_active:
+                # Needs to be merged into the user's subscription
+                result.user_subscribers.append(subscriber)
+            else:
+                result.subscribed.append(subscriber)
+        self.subscribe_all(result.subscribed)
+        return result
+
+    def subscribe_all(self, subscribers):
+        if not subscribers:
+            return
+        changes = {"subscribed": timezone.now(), "unsubscribed": None}
+        if self.reference:
+            changes["reference"] = self.reference
+        subscriber_ids = [s.id for s in subscribers]
+        Subscriber.objects.filter(id__in=subscriber_ids).update(**changes)
+        tag_index.update_subscriptions(self.newsletter.id, add=subscriber_ids)
+        for subscriber in subscribers:
+            for key, value in changes.items():
+                setattr(subscriber, key, value)
+
+    def finish_batch(self, result):
+        from .tasks import send_activation_emails_task
+
+        for subscriber in result.subscribed:
+            subscribed.send(sender=subscriber, batch=True)
+        for subscriber in result.user_subscribers:
+            subscriber.subscribe(reference=self.reference, batch=True)
+        if result.activation_ids:
+            send_activation_emails_task.delay(
+                self.newsletter.id,
+                result.activation_ids,
+                activation_template_id=(
+                    self.activation_template.id if self.activation_template else None
+                ),
+            )
+
+
+def send_activation_emails(newsletter, subscriber_ids, activation_template=None):
+    subscribers = Subscriber.objects.filter(
+        newsletter=newsletter, id__in=subscriber_ids
+    ).select_related("user")
+    sent_ids = []
+    for subscriber in subscribers:
+        # Share newsletter and its templates across subscribers
+        subscriber.newsletter = newsletter
+        if not subscriber.can_send_activation():
+            continue
+        subscriber.send_activation_email(
+            batch=True, activation_template=activation_template, save=False
+        )
+        sent_ids.append(subscriber.id)
+    Subscriber.objects.filter(id__in=sent_ids).update(
+        last_activation_sent=timezone.now()
+    )
+    return len(sent_ids)
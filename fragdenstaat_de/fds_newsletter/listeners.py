@@ -1,5 +1,12 @@
+from django.core.cache import cache
+
 from .models import REFERENCE_PREFIX, Subscriber
-from .utils import subscribe_to_default_newsletter, unsubscribe_queryset
+from .utils import (
+    NEWSLETTER_KEY,
+    invalidate_subscription_state,
+    subscribe_to_default_newsletter,
+    unsubscribe_queryset,
+)
 
 
 def check_account_confirmed_wants_newsletter(sender, request=None, **kwargs):
@@ -57,6 +64,7 @@ def merge_user(sender, old_user=None, new_user=None, **kwargs):
         else:
             sub.user = new_user
             sub.save()
+    invalidate_subscription_state([old_user.id, new_user.id])
 
 
 def cancel_user(sender, user=None, **kwargs):
@@ -81,6 +89,7 @@ def cancel_user(sender, user=None, **kwargs):
     Subscriber.objects.filter(
         user=user,
     ).delete()
+    invalidate_subscription_state([user.id])
 
 
 def subscribe_alert(sender, request=None, **kwargs):
@@ -169,3 +178,13 @@ def handle_bounce(sender, bounce, should_deactivate=False, **kwargs):
 
 def subscriber_import_delete_file(sender, instance, **kwargs):
     instance.data_file.delete(False)
+
+
+def subscriber_changed(sender, instance=None, **kwargs):
+    # subscribed/unsubscribed signals are sent by the subscriber
+    subscriber = instance if instance is not None else sender
+    invalidate_subscription_state([subscriber.user_id])
+
+
+def newsletter_changed(sender, instance, **kwargs):
+    cache.delete(NEWSLETTER_KEY.format(instance.slug))
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.15 on 2026-10-17 15:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fds_newsletter', '0020_archivedsegment_segment_archived'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='subscriber',
+            name='tags_updated',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+    ]
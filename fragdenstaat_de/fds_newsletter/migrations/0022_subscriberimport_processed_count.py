@@ -0,0 +1,18 @@
+# Generated by Django 5.2.15 on 2026-10-17 16:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fds_newsletter', '0021_subscriber_tags_updated'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='subscriberimport',
+            name='processed_count',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+    ]
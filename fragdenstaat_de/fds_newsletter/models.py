@@ -2,7 +2,6 @@ import codecs
 import io
 import logging
 from datetime import timedelta
-from functools import reduce
 
 from django.conf import settings
 from django.contrib.auth import get_user_model
@@ -24,7 +23,7 @@ from treebeard.mp_tree import MP_Node
 from froide.helper.email_sending import mail_registry
 from froide.helper.email_utils import make_address
 
-from . import subscribed, tag_subscriber, unsubscribed
+from . import subscribed, unsubscribed
 
 logger = logging.getLogger(__name__)
 
@@ -238,6 +237,7 @@ class Subscriber(models.Model):
     data = models.JSONField(blank=True, default=dict)
 
     tags = TaggableManager(through=TaggedSubscriber, blank=True)
+    tags_updated = models.DateTimeField(null=True, blank=True, db_index=True)
 
     objects = SubscriberManager()
 
@@ -314,7 +314,7 @@ class Subscriber(models.Model):
             or (timezone.now() - self.last_activation_sent) > ACTIVATION_MAIL_DELAY
         )
 
-    def send_activation_email(self, batch=False, activation_template=None):
+    def send_activation_email(self, batch=False, activation_template=None, save=True):
         if not self.can_send_activation():
             return
 
@@ -339,7 +339,8 @@ class Subscriber(models.Model):
                 self.send_intent(subscriber_confirm_email, context)
 
         self.last_activation_sent = timezone.now()
-        self.save()
+        if save:
+            self.save()
 
     def send_already_email(self):
         if not self.can_send_activation():
@@ -467,21 +468,9 @@ class Subscriber(models.Model):
         unsubscribed.send(sender=self)
 
     def update_tags(self):
-        add_tags = set()
-        remove_tags = set()
-        # Collect tags from all sources
-        for _receiver, response in tag_subscriber.send(self, email=self.get_email()):
-            if not response:
-                continue
-            add, remove = response
-            add_tags |= add
-            remove_tags |= remove
-
-        # Apply tags
-        if add_tags:
-            self.tags.add(*add_tags)
-        if remove_tags:
-            self.tags.remove(*remove_tags)
+        from .tagging import update_subscriber_tags
+
+        update_subscriber_tags([self])
 
 
 class TaggedSegment(TaggedItemBase):
@@ -523,22 +512,14 @@ class Segment(MP_Node):
         return self.filter_subscribers(qs)
 
     def filter_subscribers(self, qs):
-        # AND-Filter by tags
-        for tag in self.tags.all():
-            if self.negate:
-                qs = qs.exclude(taggedsubscriber__tag=tag)
-            else:
-                qs = qs.filter(taggedsubscriber__tag=tag)
+        from .segments import SegmentCompiler
 
-        # AND-Filter by children
-        children = self.get_children()
-        if children:
-            children_qs = [
-                child.filter_subscribers(qs).order_by() for child in children
-            ]
-            out_qs = reduce(lambda x, y: x & y, children_qs)
-            return out_qs
-        return qs
+        return SegmentCompiler([self]).filter_subscribers(qs)
+
+    def get_member_bitmap(self, newsletter=None):
+        from .tag_index import get_segment_bitmap
+
+        return get_segment_bitmap(self, newsletter=newsletter)
 
 
 class ArchivedSegment(Segment):
@@ -603,6 +584,7 @@ class SubscriberImport(models.Model):
     started = models.DateTimeField(null=True, blank=True)
     completed = models.DateTimeField(null=True, blank=True)
     row_count = models.IntegerField(null=True, blank=True)
+    processed_count = models.IntegerField(null=True, blank=True)
     imported_count = models.IntegerField(null=True, blank=True)
 
     class Meta:
@@ -629,6 +611,12 @@ class SubscriberImport(models.Model):
         self.save(update_fields=["started"])
         transaction.on_commit(lambda: run_subscriber_import.delay(self.pk))
 
+    def update_progress(self, row_count, processed_count, imported_count):
+        self.row_count = row_count
+        self.processed_count = processed_count
+        self.imported_count = imported_count
+        self.save(update_fields=["row_count", "processed_count", "imported_count"])
+
     def run_import(self):
         from .utils import import_csv
 
@@ -659,11 +647,20 @@ class SubscriberImport(models.Model):
                 data_columns=data_columns,
                 email_confirmed=self.email_confirmed,
                 activation_template=self.activation_template,
+                progress=self.update_progress,
             )
         self.completed = timezone.now()
         self.row_count = row_count
+        self.processed_count = row_count
         self.imported_count = imported_count
-        self.save(update_fields=["completed", "row_count", "imported_count"])
+        self.save(
+            update_fields=[
+                "completed",
+                "row_count",
+                "processed_count",
+                "imported_count",
+            ]
+        )
 
 
 class NewsletterCMSPlugin(CMSPlugin):
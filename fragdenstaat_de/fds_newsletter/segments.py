@@ -0,0 +1,108 @@
+"""
+Compiles segment trees into a single subscriber query.
+
+A segment matches subscribers that have all of its tags (or none of
+them when negated) and that match all of its child segments. Several
+segments are combined with OR.
+
+The compiler loads the segment subtrees and their tags in two queries
+and builds one filter with EXISTS for single tags and
+GROUP BY ... HAVING COUNT for sets of tags, instead of a join per tag
+and a union per segment.
+"""
+
+import operator
+from collections import defaultdict
+from functools import reduce
+
+from django.db.models import Count, Exists, OuterRef, Q
+
+from .models import Segment, TaggedSegment, TaggedSubscriber
+
+
+class SegmentCompiler:
+    def __init__(self, segments):
+        self.segments = list(segments)
+        self.nodes = {}
+        self.children = defaultdict(list)
+        self.tags = defaultdict(set)
+        self.conditions = {}
+        if self.segments:
+            self.load()
+
+    def load(self):
+        path_filter = reduce(
+            operator.or_, [Q(path__startswith=s.path) for s in self.segments]
+        )
+        nodes = Segment.objects.filter(path_filter).only("id", "path", "negate")
+        path_ids = {}
+        for node in nodes:
+            self.nodes[node.id] = node
+            path_ids[node.path] = node.id
+        for node in self.nodes.values():
+            parent_id = path_ids.get(node.path[: -Segment.steplen])
+            if parent_id is not None:
+                self.children[parent_id].append(node.id)
+
+        tagged = TaggedSegment.objects.filter(
+            content_object_id__in=self.nodes
+        ).values_list("content_object_id", "tag_id")
+        for segment_id, tag_id in tagged:
+            self.tags[segment_id].add(tag_id)
+
+    def get_tag_condition(self, segment_id):
+        tag_ids = self.tags.get(segment_id)
+        if not tag_ids:
+            return None
+        if self.nodes[segment_id].negate:
+            return ~Q(
+                Exists(
+                    TaggedSubscriber.objects.filter(
+                        content_object=OuterRef("pk"), tag_id__in=tag_ids
+                    )
+                )
+            )
+        if len(tag_ids) == 1:
+            (tag_id,) = tag_ids
+            return Q(
+                Exists(
+                    TaggedSubscriber.objects.filter(
+                        content_object=OuterRef("pk"), tag_id=tag_id
+                    )
+                )
+            )
+        tagged_with_all = (
+            TaggedSubscriber.objects.filter(tag_id__in=tag_ids)
+            .values("content_object")
+            .annotate(tag_count=Count("tag_id"))
+            .filter(tag_count=len(tag_ids))
+            .values("content_object")
+        )
+        return Q(pk__in=tagged_with_all)
+
+    def get_condition(self, segment_id):
+        """
+        Returns a Q object for the segment or None if
+        the segment matches all subscribers.
+        """
+        if segment_id in self.conditions:
+            return self.conditions[segment_id]
+        conditions = [self.get_tag_condition(segment_id)]
+        conditions.extend(
+            self.get_condition(child_id) for child_id in self.children[segment_id]
+        )
+        conditions = [c for c in conditions if c is not None]
+        condition = reduce(operator.and_, conditions) if conditions else None
+        self.conditions[segment_id] = condition
+        return condition
+
+    def filter_subscribers(self, qs):
+        conditions = []
+        for segment in self.segments:
+            condition = self.get_condition(segment.id)
+            if condition is None:
+                return qs
+            conditions.append(condition)
+        if not conditions:
+            return qs
+        return qs.filter(reduce(operator.or_, conditions))
@@ -0,0 +1,234 @@
+"""
+Bitmap index of subscriber ids per tag and of subscribed subscribers
+per newsletter, kept in the cache.
+
+Tag bitmaps are built from the database on first use and then updated
+incrementally when tags are added or removed. Updates are applied after
+the transaction commits and under a lock per bitmap, so concurrent
+tagging tasks do not overwrite each other's changes. Subscription
+bitmaps are short lived, as subscriptions are also changed with bulk
+updates.
+Segments are evaluated on these bitmaps to size audiences without
+querying the tag table. The index is only used for counts, selecting
+subscribers goes through the database.
+"""
+
+import logging
+import uuid
+from collections import defaultdict
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_delete
+
+from fragdenstaat_de.theme.utils import cache_lock
+
+from .bitmap import SubscriberBitmap
+from .models import Subscriber, TaggedSubscriber
+from .segments import SegmentCompiler
+
+TAG_KEY = "fds_newsletter:tagindex:tag:{}"
+SUBSCRIBED_KEY = "fds_newsletter:tagindex:subscribed:{}"
+TAG_INDEX_TIMEOUT = 60 * 60 * 24
+SUBSCRIBED_INDEX_TIMEOUT = 60 * 15
+LOCK_KEY = "{}:lock"
+VERSION_KEY = "{}:version"
+LOCK_TIMEOUT = 10
+LOCK_WAIT = 15
+
+logger = logging.getLogger(__name__)
+
+
+class SubscriberTagIndex:
+    def __init__(self, cache=cache):
+        self.cache = cache
+
+    def get_tag_bitmaps(self, tag_ids):
+        tag_ids = set(tag_ids)
+        keys = {TAG_KEY.format(tag_id): tag_id for tag_id in tag_ids}
+        cached = self.cache.get_many(keys)
+        bitmaps = {
+            keys[key]: SubscriberBitmap.from_bytes(data) for key, data in cached.items()
+        }
+        missing = tag_ids - set(bitmaps)
+        if missing:
+            version_keys = [
+                VERSION_KEY.format(TAG_KEY.format(tag_id)) for tag_id in missing
+            ]
+            versions = self.cache.get_many(version_keys)
+            tagged_ids = defaultdict(list)
+            tagged = TaggedSubscriber.objects.filter(tag_id__in=missing).values_list(
+                "tag_id", "content_object_id"
+            )
+            for tag_id, subscriber_id in tagged:
+                tagged_ids[tag_id].append(subscriber_id)
+            built = {
+                tag_id: SubscriberBitmap.from_ids(tagged_ids[tag_id])
+                for tag_id in missing
+            }
+            # Don't cache bitmaps that missed an update while being built
+            changed = {
+                key
+                for key, version in self.cache.get_many(version_keys).items()
+                if versions.get(key) != version
+            }
+            for tag_id, bitmap in built.items():
+                key = TAG_KEY.format(tag_id)
+                if VERSION_KEY.format(key) in changed:
+                    continue
+                # Don't replace a bitmap updated in the meantime
+                self.cache.add(key, bitmap.to_bytes(), TAG_INDEX_TIMEOUT)
+            bitmaps.update(built)
+        return bitmaps
+
+    def get_tag_bitmap(self, tag_id):
+        return self.get_tag_bitmaps([tag_id])[tag_id]
+
+    def get_subscribed_bitmap(self, newsletter_id=None):
+        """
+        Returns subscribed subscribers of the newsletter
+        or of all newsletters if newsletter_id is None.
+        """
+        key = SUBSCRIBED_KEY.format(newsletter_id or "all")
+        data = self.cache.get(key)
+        if data is not None:
+            return SubscriberBitmap.from_bytes(data)
+        qs = Subscriber.objects.filter(subscribed__isnull=False)
+        if newsletter_id is not None:
+            qs = qs.filter(newsletter_id=newsletter_id)
+        bitmap = SubscriberBitmap.from_ids(qs.order_by().values_list("id", flat=True))
+        self.cache.add(key, bitmap.to_bytes(), SUBSCRIBED_INDEX_TIMEOUT)
+        return bitmap
+
+    def lock(self, key):
+        return cache_lock(
+            LOCK_KEY.format(key), LOCK_TIMEOUT, wait=LOCK_WAIT, cache=self.cache
+        )
+
+    def update_bitmap(self, key, add=(), remove=(), timeout=TAG_INDEX_TIMEOUT):
+        add, remove = list(add), list(remove)
+        transaction.on_commit(
+            lambda: self.apply_update(key, add=add, remove=remove, timeout=timeout)
+        )
+
+    def apply_update(self, key, add=(), remove=(), timeout=TAG_INDEX_TIMEOUT):
+        with self.lock(key) as acquired:
+            if not acquired:
+                logger.warning("Could not lock %s, dropping bitmap", key)
+                self.cache.delete(key)
+                return
+            data = self.cache.get(key)
+            if data is None:
+                # Not built yet, will be built from the database on use.
+                # Bitmaps currently being built may miss this update.
+                self.cache.set(VERSION_KEY.format(key), uuid.uuid4().hex, timeout)
+                return
+            bitmap = SubscriberBitmap.from_bytes(data)
+            bitmap = (
+                bitmap | SubscriberBitmap.from_ids(add)
+            ) - SubscriberBitmap.from_ids(remove)
+            self.cache.set(key, bitmap.to_bytes(), timeout)
+
+    def add_tags(self, subscriber_ids, tag_ids):
+        for tag_id in tag_ids:
+            self.update_bitmap(TAG_KEY.format(tag_id), add=subscriber_ids)
+
+    def remove_tags(self, subscriber_ids, tag_ids):
+        for tag_id in tag_ids:
+            self.update_bitmap(TAG_KEY.format(tag_id), remove=subscriber_ids)
+
+    def clear_tags(self, tag_ids):
+        keys = [TAG_KEY.format(tag_id) for tag_id in tag_ids]
+        transaction.on_commit(lambda: self.cache.delete_many(keys))
+
+    def update_subscription(self, subscriber, deleted=False):
+        change = "add" if subscriber.subscribed and not deleted else "remove"
+        self.update_subscriptions(subscriber.newsletter_id, **{change: [subscriber.id]})
+
+    def update_subscriptions(self, newsletter_id, add=(), remove=()):
+        for key_id in (newsletter_id, "all"):
+            self.update_bitmap(
+                SUBSCRIBED_KEY.format(key_id),
+                add=add,
+                remove=remove,
+                timeout=SUBSCRIBED_INDEX_TIMEOUT,
+            )
+
+    def get_segments_bitmap(self, segments, newsletter_id=None):
+        """
+        Returns subscribed subscribers matching any of the segments.
+        """
+        universe = self.get_subscribed_bitmap(newsletter_id)
+        if not segments:
+            return universe
+        compiler = SegmentCompiler(segments)
+        tag_ids = set().union(*compiler.tags.values())
+        tag_bitmaps = self.get_tag_bitmaps(tag_ids)
+        results = {}
+
+        def evaluate(segment_id):
+            if segment_id in results:
+                return results[segment_id]
+            result = universe
+            for tag_id in compiler.tags.get(segment_id, ()):
+                if compiler.nodes[segment_id].negate:
+                    result = result - tag_bitmaps[tag_id]
+                else:
+                    result = result & tag_bitmaps[tag_id]
+            for child_id in compiler.children[segment_id]:
+                result = result & evaluate(child_id)
+            results[segment_id] = result
+            return result
+
+        bitmap = SubscriberBitmap()
+        for segment in compiler.segments:
+            bitmap = bitmap | evaluate(segment.id)
+        return bitmap
+
+    def count_subscribers(self, newsletter, segments=None):
+        if newsletter is None:
+            return 0
+        return len(self.get_segments_bitmap(segments, newsletter_id=newsletter.id))
+
+
+tag_index = SubscriberTagIndex()
+
+
+def get_segment_bitmap(segment, newsletter=None) -> SubscriberBitmap:
+    """
+    Returns the ids of subscribed subscribers that match the segment.
+    """
+    newsletter_id = newsletter.id if newsletter is not None else None
+    return tag_index.get_segments_bitmap([segment], newsletter_id=newsletter_id)
+
+
+def update_tag_index(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Keeps the tag index up to date when taggit changes subscriber tags.
+    """
+    if action == "pre_clear":
+        # Drop bitmaps of tags about to be cleared, they are rebuilt on use
+        if reverse:
+            tag_index.clear_tags([instance.pk])
+        else:
+            tag_index.clear_tags(
+                TaggedSubscriber.objects.filter(content_object=instance).values_list(
+                    "tag_id", flat=True
+                )
+            )
+        return
+    if action not in ("post_add", "post_remove") or not pk_set:
+        return
+    if reverse:
+        subscriber_ids, tag_ids = pk_set, [instance.pk]
+    else:
+        subscriber_ids, tag_ids = [instance.pk], pk_set
+    if action == "post_add":
+        tag_index.add_tags(subscriber_ids, tag_ids)
+    else:
+        tag_index.remove_tags(subscriber_ids, tag_ids)
+
+
+def update_subscription_index(sender, instance, **kwargs):
+    deleted = kwargs.get("signal") is post_delete
+    tag_index.update_subscription(instance, deleted=deleted)
@@ -0,0 +1,152 @@
+"""
+Batched subscriber tagging.
+
+Receivers of `tag_subscribers` get a batch of subscribers and return
+tags to add and remove per subscriber id, computed with a few queries
+per batch. The deltas of all receivers are applied with bulk inserts
+and deletes on `TaggedSubscriber`.
+
+Receivers of `tag_sources_changed` return a Q object selecting
+subscribers whose tag sources changed since the start of the last run,
+so regular runs only re-evaluate those. A full run happens when the
+oldest tag evaluation is older than `FULL_TAGGING_INTERVAL`.
+"""
+
+import operator
+from collections import defaultdict
+from datetime import timedelta
+from functools import reduce
+
+from django.core.cache import cache
+from django.db.models import Min, Q
+from django.utils import timezone
+
+from . import tag_sources_changed, tag_subscribers
+from .models import Subscriber, SubscriberTag, TaggedSubscriber
+from .tag_index import tag_index
+
+SUBSCRIBER_TAG_BATCH_SIZE = 1000
+FULL_TAGGING_INTERVAL = timedelta(days=7)
+LAST_RUN_KEY = "fds_newsletter:tagging:last_run"
+
+
+def gather_tag_deltas(subscribers):
+    deltas = {subscriber.id: (set(), set()) for subscriber in subscribers}
+    for _receiver, response in tag_subscribers.send(
+        sender=Subscriber, subscribers=subscribers
+    ):
+        if not response:
+            continue
+        for subscriber_id, (add, remove) in response.items():
+            deltas[subscriber_id][0].update(add)
+            deltas[subscriber_id][1].update(remove)
+    return deltas
+
+
+def get_tag_ids(add_names, remove_names):
+    tag_ids = dict(
+        SubscriberTag.objects.filter(name__in=add_names | remove_names).values_list(
+            "name", "id"
+        )
+    )
+    for name in add_names - set(tag_ids):
+        # Tags are created rarely and need a slug, so create them one by one
+        tag, _created = SubscriberTag.objects.get_or_create(name=name)
+        tag_ids[name] = tag.id
+    return tag_ids
+
+
+def apply_tag_deltas(deltas):
+    """
+    Apply {subscriber_id: (add_tags, remove_tags)}, removing tags
+    that are in both sets. Returns number of added and removed tags.
+    """
+    add_names = set()
+    remove_names = set()
+    for add, remove in deltas.values():
+        add_names |= add - remove
+        remove_names |= remove
+    if not add_names and not remove_names:
+        return 0, 0
+
+    tag_ids = get_tag_ids(add_names, remove_names)
+    existing = set(
+        TaggedSubscriber.objects.filter(
+            content_object_id__in=deltas, tag_id__in=tag_ids.values()
+        ).values_list("content_object_id", "tag_id")
+    )
+    to_add = defaultdict(list)
+    to_remove = defaultdict(list)
+    for subscriber_id, (add, remove) in deltas.items():
+        for name in add - remove:
+            if (subscriber_id, tag_ids[name]) not in existing:
+                to_add[tag_ids[name]].append(subscriber_id)
+        for name in remove:
+            if (subscriber_id, tag_ids.get(name)) in existing:
+                to_remove[tag_ids[name]].append(subscriber_id)
+
+    TaggedSubscriber.objects.bulk_create(
+        [
+            TaggedSubscriber(content_object_id=subscriber_id, tag_id=tag_id)
+            for tag_id, subscriber_ids in to_add.items()
+            for subscriber_id in subscriber_ids
+        ],
+        ignore_conflicts=True,
+    )
+    for tag_id, subscriber_ids in to_add.items():
+        tag_index.add_tags(subscriber_ids, [tag_id])
+    for tag_id, subscriber_ids in to_remove.items():
+        TaggedSubscriber.objects.filter(
+            tag_id=tag_id, content_object_id__in=subscriber_ids
+        ).delete()
+        tag_index.remove_tags(subscriber_ids, [tag_id])
+
+    return (
+        sum(len(ids) for ids in to_add.values()),
+        sum(len(ids) for ids in to_remove.values()),
+    )
+
+
+def update_subscriber_tags(subscribers):
+    subscribers = list(subscribers)
+    if not subscribers:
+        return 0, 0
+    result = apply_tag_deltas(gather_tag_deltas(subscribers))
+    Subscriber.objects.filter(id__in=[s.id for s in subscribers]).update(
+        tags_updated=timezone.now()
+    )
+    return result
+
+
+def get_last_run_start():
+    return cache.get(LAST_RUN_KEY)
+
+
+def set_last_run_start(started):
+    cache.set(LAST_RUN_KEY, started, None)
+
+
+def get_subscriber_ids_to_tag(full=False, since=None):
+    """
+    Returns ids of subscribed subscribers whose tags need to be evaluated
+    because their tag sources changed since the given time, by default
+    the start of the last run.
+    """
+    qs = Subscriber.objects.get_subscribed().order_by("id")
+    if since is None:
+        since = get_last_run_start()
+    if not full:
+        oldest = qs.aggregate(oldest=Min("tags_updated"))["oldest"]
+        full = oldest is None or oldest < timezone.now() - FULL_TAGGING_INTERVAL
+        if since is None:
+            # Start of the last run is unknown, use its earliest evaluation
+            since = oldest
+    if full:
+        return list(qs.values_list("id", flat=True))
+
+    conditions = [Q(tags_updated__isnull=True)]
+    for _receiver, response in tag_sources_changed.send(sender=Subscriber, since=since):
+        if response is not None:
+            conditions.append(response)
+    qs = qs.filter(reduce(operator.or_, conditions))
+    return list(qs.values_list("id", flat=True).distinct())
@@ -1,3 +1,7 @@
+from itertools import batched
+
+from django.utils import timezone
+
 from froide.celery import app as celery_app
 
 from .utils import cleanup_feedback, cleanup_subscribers
@@ -14,13 +18,30 @@ def cleanup_feedback_task():
 
 
 @celery_app.task(name="fragdenstaat_de.fds_newsletter.gather_subscriber_tags")
-def gather_subscriber_tags():
-    from .models import Subscriber
+def gather_subscriber_tags(full=False):
+    from .tagging import (
+        SUBSCRIBER_TAG_BATCH_SIZE,
+        get_subscriber_ids_to_tag,
+        set_last_run_start,
+    )
 
-    qs = Subscriber.objects.get_subscribed()
+    # Changes while the batches are processed are picked up next run
+    started = timezone.now()
+    subscriber_ids = get_subscriber_ids_to_tag(full=full)
+    for id_batch in batched(subscriber_ids, SUBSCRIBER_TAG_BATCH_SIZE):
+        update_subscriber_tags_task.delay(list(id_batch))
+    set_last_run_start(started)
+
+
+@celery_app.task(name="fragdenstaat_de.fds_newsletter.update_subscriber_tags")
+def update_subscriber_tags_task(subscriber_ids):
+    from .models import Subscriber
+    from .tagging import update_subscriber_tags
 
-    for subscriber in qs.iterator():
-        subscriber.update_tags()
+    subscribers = Subscriber.objects.filter(id__in=subscriber_ids).select_related(
+        "user"
+    )
+    update_subscriber_tags(subscribers)
 
 
 @celery_app.task(name="fragdenstaat_de.fds_newsletter.run_subscriber_import")
@@ -35,3 +56,26 @@ def run_subscriber_import(subscriber_import_id):
         return
 
     subscriber_import.run_import()
+
+
+@celery_app.task(name="fragdenstaat_de.fds_newsletter.send_activation_emails")
+def send_activation_emails_task(
+    newsletter_id, subscriber_ids, activation_template_id=None
+):
+    from fragdenstaat_de.fds_mailing.models import EmailTemplate
+
+    from .importer import send_activation_emails
+    from .models import Newsletter
+
+    try:
+        newsletter = Newsletter.objects.get(id=newsletter_id)
+    except Newsletter.DoesNotExist:
+        return
+    activation_template = None
+    if activation_template_id is not None:
+        activation_template = EmailTemplate.objects.filter(
+            id=activation_template_id
+        ).first()
+    send_activation_emails(
+        newsletter, subscriber_ids, activation_template=activation_template
+    )
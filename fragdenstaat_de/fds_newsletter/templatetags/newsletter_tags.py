@@ -1,9 +1,7 @@
 from django import template
-from django.conf import settings
 
 from ..forms import NewsletterForm, NewslettersUserForm
-from ..models import Newsletter
-from ..utils import has_newsletter
+from ..utils import get_newsletter, has_newsletter
 
 register = template.Library()
 
@@ -15,15 +13,6 @@ def newsletter_settings(context):
     return {"newsletter_form": NewslettersUserForm(user)}
 
 
-def _get_newsletter(newsletter_slug=None):
-    try:
-        return Newsletter.objects.get(
-            slug=newsletter_slug or settings.DEFAULT_NEWSLETTER
-        )
-    except Newsletter.DoesNotExist:
-        return None
-
-
 def get_newsletter_context(context, next=None, newsletter=None, fallback=True):
     ctx = {"next": next, "fallback": fallback, "has_newsletter": False}
 
@@ -44,7 +33,7 @@ def get_newsletter_context(context, next=None, newsletter=None, fallback=True):
     "fds_newsletter/plugins/smart_newsletter_form.html", takes_context=True
 )
 def newsletter_subscribe(context, next=None, newsletter_slug=None, fallback=True):
-    newsletter = _get_newsletter(newsletter_slug)
+    newsletter = get_newsletter(newsletter_slug)
     return get_newsletter_context(
         context, next=next, newsletter=newsletter, fallback=fallback
     )
@@ -52,5 +41,5 @@ def newsletter_subscribe(context, next=None, newsletter_slug=None, fallback=True
 
 @register.simple_tag(takes_context=True)
 def newsletter_is_subscribed(context):
-    newsletter = _get_newsletter()
+    newsletter = get_newsletter()
     return has_newsletter(context["request"].user, newsletter)
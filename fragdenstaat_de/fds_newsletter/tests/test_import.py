@@ -0,0 +1,108 @@
+import time
+from io import StringIO
+
+from django.utils import timezone
+
+import pytest
+
+from froide.account.factories import UserFactory
+
+from ..importer import SubscriberImporter
+from ..models import Subscriber
+from .factories import NewsletterFactory, SubscriberFactory
+
+
+def get_tag_names(subscriber):
+    return set(subscriber.tags.values_list("name", flat=True))
+
+
+@pytest.mark.django_db
+def test_import_csv_bulk(mailoutbox):
+    newsletter = NewsletterFactory.create()
+    existing = SubscriberFactory.create(
+        newsletter=newsletter, email="existing@example.com", reference="original"
+    )
+    user = UserFactory.create(email="user@example.com")
+    csv_data = (
+        "email,name,tags,city\n"
+        " New@Example.com ,New,a,Berlin\n"
+        "new@example.com,Duplicate,b,Hamburg\n"
+        "existing@example.com,Existing,,\n"
+        "user@example.com,User,,\n"
+        ",Empty,,\n"
+    )
+    progress = []
+    importer = SubscriberImporter(
+        newsletter,
+        reference="import",
+        email_confirmed=True,
+        tags=["imported-tag"],
+        new_tags=["imported"],
+        data_columns=["city"],
+        batch_size=2,
+        progress=lambda *args: progress.append(args),
+    )
+    row_count, imported_count = importer.run(StringIO(csv_data))
+
+    assert row_count == 5
+    assert imported_count == 2
+    assert progress[-1] == (5, 5, 2)
+    assert len(progress) == 2
+    assert len(mailoutbox) == 0
+
+    new = Subscriber.objects.get(newsletter=newsletter, email="new@example.com")
+    assert new.name == "New"
+    assert new.data == {"city": "Berlin"}
+    assert new.subscribed is not None
+    assert new.reference == "import"
+    assert get_tag_names(new) == {"a", "b", "imported-tag", "imported"}
+
+    existing.refresh_from_db()
+    assert existing.reference == "original"
+    assert get_tag_names(existing) == {"imported-tag"}
+
+    # Email of an active user is subscribed as the user
+    user_subscriber = Subscriber.objects.get(newsletter=newsletter, user=user)
+    assert user_subscriber.subscribed is not None
+    assert user_subscriber.email is None
+    assert not Subscriber.objects.filter(email="user@example.com").exists()
+
+    # Importing again does not create duplicates
+    importer = SubscriberImporter(newsletter, email_confirmed=True)
+    assert importer.run(StringIO(csv_data)) == (5, 0)
+    assert Subscriber.objects.filter(newsletter=newsletter).count() == 3
+
+
+@pytest.mark.benchmark
+@pytest.mark.django_db
+def test_import_csv_benchmark():
+    newsletter = NewsletterFactory.create()
+    row_count = 100_000
+    Subscriber.objects.bulk_create(
+        [
+            Subscriber(
+                newsletter=newsletter,
+                email="subscriber_{}@example.com".format(i),
+                subscribed=timezone.now(),
+            )
+            for i in range(0, row_count, 10)
+        ]
+    )
+    lines = ["email,name,tags"]
+    for i in range(row_count):
+        lines.append("Subscriber_{}@example.com,Name {},tag-{}".format(i, i, i % 5))
+    csv_file = StringIO("\n".join(lines))
+
+    start = time.perf_counter()
+    importer = SubscriberImporter(newsletter, reference="bench", email_confirmed=True)
+    result = importer.run(csv_file)
+    duration = time.perf_counter() - start
+
+    assert result == (row_count, row_count - row_count // 10)
+    assert (
+        Subscriber.objects.filter(
+            newsletter=newsletter, subscribed__isnull=False
+        ).count()
+        == row_count
+    )
+    assert row_count / duration > 1_000
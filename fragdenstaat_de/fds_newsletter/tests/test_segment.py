@@ -1,9 +1,14 @@
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
 from django.utils import timezone
 
 import pytest
 
-from ..models import Newsletter, Segment
-from ..utils import get_subscribers
+from ..bitmap import SubscriberBitmap
+from ..models import Newsletter, Segment, SubscriberTag
+from ..segments import SegmentCompiler
+from ..tag_index import SUBSCRIBED_KEY, TAG_KEY, SubscriberTagIndex, tag_index
+from ..utils import generate_random_split, get_subscribers
 from .factories import SubscriberFactory
 
 
@@ -206,3 +211,232 @@ def test_segment_negated_tags(newsletter, subscriber_factory, segment_factory):
 
     result = get_subscribers(newsletter, segments=[parent_segment])
     assert {subscriber4} == set(result)
+
+
+@pytest.mark.django_db
+def test_segment_compiler_single_query(
+    newsletter, subscriber_factory, segment_factory, django_assert_num_queries
+):
+    subscriber1 = subscriber_factory(newsletter, tags={"tag1", "tag2", "tag3"})
+    subscriber2 = subscriber_factory(newsletter, tags={"tag1", "tag2", "tag4"})
+    _subscriber3 = subscriber_factory(newsletter, tags={"tag1", "tag3"})
+    subscriber4 = subscriber_factory(newsletter, tags={"tag5"})
+
+    root = segment_factory(tags=["tag1"])
+    child = segment_factory(tags=["tag2"], parent=root)
+    grandchild = segment_factory(tags=["tag3", "tag4"], parent=child, negate=True)
+    segment_factory(tags=["tag3"], parent=grandchild)
+    other = segment_factory(tags=["tag5"])
+
+    # Subtrees and tags are loaded in two queries
+    with django_assert_num_queries(2):
+        compiler = SegmentCompiler([child, other])
+
+    qs = compiler.filter_subscribers(newsletter.subscribers.all())
+    sql = str(qs.query)
+    assert "UNION" not in sql.upper()
+    with django_assert_num_queries(1):
+        # child requires tag2, not (tag3 or tag4) and tag3 (from the leaf)
+        assert set(qs) == {subscriber4}
+
+    compiler = SegmentCompiler([root])
+    qs = compiler.filter_subscribers(newsletter.subscribers.all())
+    assert set(qs) == set()
+
+    leafless = segment_factory(tags=["tag1", "tag2"])
+    result = get_subscribers(newsletter, segments=[leafless])
+    assert {subscriber1, subscriber2} == set(result)
+
+
+@pytest.mark.django_db
+def test_segment_member_bitmap(
+    newsletter, subscriber_factory, segment_factory, django_capture_on_commit_callbacks
+):
+    subscriber1 = subscriber_factory(newsletter, tags={"tag1"})
+    subscriber2 = subscriber_factory(newsletter, tags={"tag2"})
+
+    segment = segment_factory(tags=["tag1"])
+    bitmap = segment.get_member_bitmap()
+    assert bitmap == SubscriberBitmap.from_ids([subscriber1.id])
+    assert subscriber1.id in bitmap
+    assert subscriber2.id not in bitmap
+
+    # Changing tags invalidates cached membership
+    with django_capture_on_commit_callbacks(execute=True):
+        subscriber2.tags.add("tag1")
+    bitmap = segment.get_member_bitmap()
+    assert set(bitmap) == {subscriber1.id, subscriber2.id}
+    assert len(bitmap) == 2
+
+    with django_capture_on_commit_callbacks(execute=True):
+        subscriber1.tags.remove("tag1")
+    assert set(segment.get_member_bitmap()) == {subscriber2.id}
+
+
+def test_subscriber_bitmap_operations():
+    a = SubscriberBitmap.from_ids([1, 5, 9, 100_000])
+    b = SubscriberBitmap.from_ids([5, 9, 42])
+    assert list(a & b) == [5, 9]
+    assert list(a | b) == [1, 5, 9, 42, 100_000]
+    assert list(a - b) == [1, 100_000]
+    assert len(a) == 4
+    assert SubscriberBitmap.from_bytes(a.to_bytes()) == a
+    assert not SubscriberBitmap.from_ids([])
+
+
+@pytest.mark.django_db
+def test_tag_index_counts(
+    newsletter,
+    subscriber_factory,
+    segment_factory,
+    django_assert_max_num_queries,
+    django_capture_on_commit_callbacks,
+    monkeypatch,
+):
+    subscriber1 = subscriber_factory(newsletter, tags={"tag1", "tag2"})
+    subscriber2 = subscriber_factory(newsletter, tags={"tag1"})
+    subscriber3 = subscriber_factory(newsletter, tags={"tag3"})
+    subscriber_factory(newsletter, tags={"tag1"}, subscribed=False)
+
+    segment_and = segment_factory(tags=["tag1", "tag2"])
+    segment_not = segment_factory(tags=["tag1"], negate=True)
+    parent = segment_factory(tags=["tag1"])
+    child = segment_factory(tags=["tag2"], parent=parent)
+
+    for segments in ([segment_and], [segment_not], [parent], [child], []):
+        assert (
+            tag_index.count_subscribers(newsletter, segments)
+            == get_subscribers(newsletter, segments).count()
+        )
+
+    assert set(tag_index.get_segments_bitmap([segment_and, segment_not])) == {
+        subscriber1.id,
+        subscriber3.id,
+    }
+
+    # Bitmaps are cached, only the segment tree is loaded
+    with django_assert_max_num_queries(2):
+        assert tag_index.count_subscribers(newsletter, [segment_and]) == 1
+
+    # Tag changes update the index incrementally after commit
+    with django_capture_on_commit_callbacks(execute=True):
+        subscriber2.tags.add("tag2")
+    assert tag_index.count_subscribers(newsletter, [segment_and]) == 2
+    with django_capture_on_commit_callbacks(execute=True):
+        subscriber1.tags.remove("tag1")
+    assert tag_index.count_subscribers(newsletter, [segment_and]) == 1
+    with django_capture_on_commit_callbacks(execute=True):
+        subscriber3.unsubscribe()
+    assert tag_index.count_subscribers(newsletter, [segment_not]) == 1
+
+    tag1 = SubscriberTag.objects.get(name="tag1")
+    assert set(tag_index.get_tag_bitmap(tag1.id)) >= {subscriber2.id}
+
+    # Rolled back changes are not applied to the index
+    with django_capture_on_commit_callbacks(execute=True) as callbacks:
+        try:
+            with transaction.atomic():
+                subscriber2.tags.remove("tag2")
+                raise IntegrityError
+        except IntegrityError:
+            pass
+    assert not callbacks
+    assert tag_index.count_subscribers(newsletter, [segment_and]) == 1
+
+    # Locked bitmaps are dropped rather than losing an update
+    tag2 = SubscriberTag.objects.get(name="tag2")
+    key = TAG_KEY.format(tag2.id)
+    tag_index.get_tag_bitmap(tag2.id)
+    monkeypatch.setattr("fragdenstaat_de.fds_newsletter.tag_index.LOCK_WAIT", 0)
+    with tag_index.lock(key):
+        with django_capture_on_commit_callbacks(execute=True):
+            subscriber3.tags.add("tag2")
+    assert cache.get(key) is None
+    assert subscriber3.id in tag_index.get_tag_bitmap(tag2.id)
+
+
+@pytest.mark.django_db
+def test_generate_random_split(newsletter, subscriber_factory, segment_factory):
+    for _i in range(10):
+        subscriber_factory(newsletter, tags={"tag1"})
+    subscriber_factory(newsletter, tags={"tag2"})
+    segment = segment_factory(tags=["tag1"])
+
+    group_a, group_b, remaining = generate_random_split(
+        "test", newsletter, [segment], [20, 30]
+    )
+    assert tag_index.count_subscribers(newsletter, [group_a]) == 2
+    assert tag_index.count_subscribers(newsletter, [group_b]) == 3
+    assert get_subscribers(newsletter, [group_b]).count() == 3
+    assert tag_index.count_subscribers(newsletter, [remaining]) == 6
+
+
+@pytest.mark.django_db
+def test_generate_random_split_rounding(newsletter, subscriber_factory):
+    subscribers = [subscriber_factory(newsletter) for _i in range(2)]
+    # Stale index doesn't change the audience of the split
+    cache.delete_many(
+        [SUBSCRIBED_KEY.format(newsletter.id), SUBSCRIBED_KEY.format("all")]
+    )
+    tag_index.get_subscribed_bitmap(newsletter.id)
+    subscribers.append(subscriber_factory(newsletter))
+
+    # Rounded group sizes add up to four
+    group_a, group_b = generate_random_split(
+        "rounding", newsletter, [], [50, 50], add_remaining=False
+    )
+    group_ids = set(get_subscribers(newsletter, [group_a]).values_list("id", flat=True))
+    group_ids |= set(
+        get_subscribers(newsletter, [group_b]).values_list("id", flat=True)
+    )
+    assert group_ids == {subscriber.id for subscriber in subscribers}
+
+
+@pytest.mark.django_db
+def test_tag_index_build_during_update(newsletter, subscriber_factory):
+    subscriber = subscriber_factory(newsletter, tags={"tag1"})
+    other = subscriber_factory(newsletter)
+    tag = SubscriberTag.objects.get(name="tag1")
+    key = TAG_KEY.format(tag.id)
+    cache.delete(key)
+
+    class ConcurrentCache:
+        calls = 0
+
+        def __getattr__(self, name):
+            return getattr(cache, name)
+
+        def get_many(self, keys):
+            self.calls += 1
+            if self.calls == 3:
+                # Another worker tags while the bitmap is built
+                index.apply_update(key, add=[other.id])
+            return cache.get_many(keys)
+
+    index = SubscriberTagIndex(cache=ConcurrentCache())
+    assert list(index.get_tag_bitmap(tag.id)) == [subscriber.id]
+    # The bitmap that missed the update is not cached
+    assert cache.get(key) is None
+
+
+@pytest.mark.django_db
+def test_generate_random_split_seed(newsletter, subscriber_factory):
+    for _i in range(20):
+        subscriber_factory(newsletter)
+
+    def get_group_ids(name, seed):
+        (group,) = generate_random_split(
+            name, newsletter, [], [50], add_remaining=False, seed=seed
+        )
+        assert "random seed {}".format(seed) in group.description
+        return set(get_subscribers(newsletter, [group]).values_list("id", flat=True))
+
+    group_ids = get_group_ids("first", 42)
+    assert len(group_ids) == 10
+    assert get_group_ids("second", 42) == group_ids
+    # Groups don't depend on the contents of the tag index
+    cache.set(
+        SUBSCRIBED_KEY.format(newsletter.id),
+        SubscriberBitmap.from_ids(list(group_ids)).to_bytes(),
+    )
+    assert get_group_ids("third", 42) == group_ids
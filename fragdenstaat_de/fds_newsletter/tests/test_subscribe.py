@@ -1,4 +1,6 @@
+import hashlib
 import re
+from datetime import timedelta
 from urllib.parse import urlparse
 
 from django.conf import settings
@@ -13,7 +15,13 @@ import pytest
 
 from froide.foirequest.tests.factories import UserFactory
 
-from fragdenstaat_de.fds_newsletter.utils import subscribe
+from fragdenstaat_de.fds_newsletter.utils import (
+    cleanup_subscribers,
+    get_newsletter,
+    get_subscription_state,
+    has_newsletter,
+    subscribe,
+)
 
 from ..listeners import (
     activate_newsletter_subscription,
@@ -619,3 +627,69 @@ def test_already_delay(mailoutbox):
     assert len(mailoutbox) == 1
     subscribe(nl, "test@example.com")
     assert len(mailoutbox) == 1
+
+
+@pytest.mark.django_db
+def test_cleanup_subscribers():
+    nl = Newsletter.objects.create(title="Newsletter", slug="newsletter")
+    week_ago = timezone.now() - timedelta(days=7)
+    user = UserFactory.create(email="User@example.com")
+    email_sub = Subscriber.objects.create(
+        newsletter=nl, email="email@example.com", name="Name", unsubscribed=week_ago
+    )
+    user_sub = Subscriber.objects.create(
+        newsletter=nl, user=user, unsubscribed=week_ago
+    )
+    recent_sub = Subscriber.objects.create(
+        newsletter=nl, email="recent@example.com", unsubscribed=timezone.now()
+    )
+    old_unconfirmed = Subscriber.objects.create(
+        newsletter=nl,
+        email="old@example.com",
+        created=timezone.now() - timedelta(days=60),
+    )
+
+    # No time budget: nothing is anonymized, next run continues
+    assert cleanup_subscribers(time_budget=timedelta(0)) is False
+    assert not Subscriber.objects.filter(id=old_unconfirmed.id).exists()
+    email_sub.refresh_from_db()
+    assert email_sub.email_hash == ""
+
+    assert cleanup_subscribers(batch_size=1) is True
+    for sub, email in (
+        (email_sub, "email@example.com"),
+        (user_sub, "user@example.com"),
+    ):
+        sub.refresh_from_db()
+        expected = hashlib.sha256(
+            str(sub.pk).encode("utf-8") + email.encode("utf-8")
+        ).hexdigest()
+        assert sub.email_hash == expected
+        assert sub.email is None
+        assert sub.user is None
+        assert sub.name == ""
+    recent_sub.refresh_from_db()
+    assert recent_sub.email == "recent@example.com"
+    assert recent_sub.email_hash == ""
+
+
+@pytest.mark.django_db
+def test_subscription_state_cache(django_assert_num_queries):
+    nl = Newsletter.objects.create(title="Newsletter", slug=settings.DEFAULT_NEWSLETTER)
+    user = UserFactory.create()
+
+    assert not has_newsletter(user)
+    subscribe(nl, user.email, user=user)
+    assert get_newsletter() == nl
+    with django_assert_num_queries(0):
+        assert get_newsletter() == nl
+        assert has_newsletter(user)
+        assert has_newsletter(user, newsletter=nl)
+        assert not has_newsletter(user, newsletter_slug="other")
+        assert get_subscription_state(user) == {nl.slug: True}
+
+    Subscriber.objects.get(user=user).unsubscribe()
+    assert get_subscription_state(user) == {nl.slug: False}
+
+    Subscriber.objects.filter(user=user).delete()
+    assert not has_newsletter(user)
@@ -0,0 +1,111 @@
+from datetime import timedelta
+from decimal import Decimal
+
+from django.utils import timezone
+
+import pytest
+
+from fragdenstaat_de.fds_donation.tests.factories import DonationFactory, DonorFactory
+
+from ..models import Subscriber
+from ..tagging import get_subscriber_ids_to_tag, update_subscriber_tags
+from ..tasks import gather_subscriber_tags, update_subscriber_tags_task
+from .factories import NewsletterFactory, SubscriberFactory
+
+
+def get_tag_names(subscriber):
+    return set(subscriber.tags.values_list("name", flat=True))
+
+
+@pytest.mark.django_db
+def test_update_subscriber_tags_batch(django_assert_max_num_queries):
+    newsletter = NewsletterFactory.create()
+    old = timezone.now() - timedelta(days=400)
+    donor_subscriber = SubscriberFactory.create(newsletter=newsletter, created=old)
+    email_subscriber = SubscriberFactory.create(newsletter=newsletter)
+    plain_subscriber = SubscriberFactory.create(newsletter=newsletter, created=old)
+    plain_subscriber.tags.add("newsletter:new")
+
+    donor = DonorFactory.create(subscriber=donor_subscriber)
+    DonationFactory.create(
+        donor=donor, amount=Decimal("150"), received_timestamp=timezone.now()
+    )
+    email_donor = DonorFactory.create(
+        email=email_subscriber.email.upper(), email_confirmed=timezone.now()
+    )
+    DonationFactory.create(donor=email_donor, received_timestamp=old, timestamp=old)
+
+    subscribers = list(Subscriber.objects.filter(newsletter=newsletter))
+    added, removed = update_subscriber_tags(subscribers)
+    assert added == 6
+    assert removed == 1
+
+    assert get_tag_names(donor_subscriber) == {
+        "donor",
+        "donor:highvalue",
+        "donor:active",
+    }
+    assert get_tag_names(email_subscriber) == {
+        "newsletter:new",
+        "donor",
+        "donor:inactive",
+    }
+    assert get_tag_names(plain_subscriber) == set()
+
+    # Running again does not write anything
+    with django_assert_max_num_queries(6):
+        assert update_subscriber_tags(subscribers) == (0, 0)
+
+
+@pytest.mark.django_db
+def test_gather_subscriber_tags_incremental():
+    newsletter = NewsletterFactory.create()
+    subscribers = SubscriberFactory.create_batch(3, newsletter=newsletter)
+
+    assert set(get_subscriber_ids_to_tag()) == {s.id for s in subscribers}
+    gather_subscriber_tags()
+    assert not Subscriber.objects.filter(
+        newsletter=newsletter, tags_updated__isnull=True
+    ).exists()
+    assert get_tag_names(subscribers[0]) == {"newsletter:new"}
+
+    # Nothing changed since the last run
+    assert get_subscriber_ids_to_tag() == []
+
+    donor = DonorFactory.create(subscriber=subscribers[1])
+    DonationFactory.create(donor=donor, received_timestamp=timezone.now())
+    new_subscriber = SubscriberFactory.create(newsletter=newsletter)
+    assert set(get_subscriber_ids_to_tag()) == {subscribers[1].id, new_subscriber.id}
+
+    gather_subscriber_tags()
+    assert "donor:active" in get_tag_names(subscribers[1])
+    assert set(get_subscriber_ids_to_tag(full=True)) == {
+        s.id for s in subscribers + [new_subscriber]
+    }
+
+
+@pytest.mark.django_db
+def test_gather_subscriber_tags_changes_during_run(monkeypatch):
+    newsletter = NewsletterFactory.create()
+    subscribers = SubscriberFactory.create_batch(2, newsletter=newsletter)
+    donor = DonorFactory.create(subscriber=subscribers[0])
+    monkeypatch.setattr(
+        "fragdenstaat_de.fds_newsletter.tagging.SUBSCRIBER_TAG_BATCH_SIZE", 1
+    )
+    delay = update_subscriber_tags_task.delay
+    batches = []
+
+    def delay_with_donation(subscriber_ids):
+        result = delay(subscriber_ids)
+        batches.append(subscriber_ids)
+        if len(batches) == 1:
+            # Donation after the first batch was tagged, before the last one
+            DonationFactory.create(donor=donor, received_timestamp=timezone.now())
+        return result
+
+    monkeypatch.setattr(update_subscriber_tags_task, "delay", delay_with_donation)
+    gather_subscriber_tags()
+    assert len(batches) == 2
+    assert "donor:active" not in get_tag_names(subscribers[0])
+
+    assert subscribers[0].id in get_subscriber_ids_to_tag()
@@ -1,17 +1,20 @@
-import csv
 import datetime
-import hashlib
+import logging
+import random
 import string
+import time
 from datetime import timedelta
 from enum import Enum
 from typing import List, Optional, Tuple
 
 from django.conf import settings
-from django.db import connection
-from django.db.models import Q
-from django.db.models.functions import Collate
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db.models import CharField, Func, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Cast, Coalesce, Collate, Concat, Lower
 from django.utils import timezone
 
+from .importer import SubscriberImporter
 from .models import (
     Newsletter,
     Segment,
@@ -20,6 +23,18 @@ from .models import (
     TaggedSubscriber,
     UnsubscribeFeedback,
 )
+from .segments import SegmentCompiler
+from .tag_index import tag_index
+
+logger = logging.getLogger(__name__)
+
+CLEANUP_BATCH_SIZE = 1000
+CLEANUP_TIME_BUDGET = timedelta(minutes=10)
+RANDOM_SPLIT_BATCH_SIZE = 5000
+NEWSLETTER_KEY = "fds_newsletter:newsletter:{}"
+NEWSLETTER_CACHE_TIMEOUT = 60 * 60
+SUBSCRIPTION_STATE_KEY = "fds_newsletter:subscriptions:{}"
+SUBSCRIPTION_STATE_TIMEOUT = 60 * 60 * 24
 
 
 class SubscriptionResult(Enum):
@@ -33,9 +48,11 @@ SubscriptionReturn = Tuple[SubscriptionResult, Subscriber]
 
 
 def unsubscribe_queryset(subscribers, method=""):
+    user_ids = set(subscribers.exclude(user=None).values_list("user_id", flat=True))
     subscribers.update(
         subscribed=None, unsubscribed=timezone.now(), unsubscribe_method=method
     )
+    invalidate_subscription_state(user_ids)
 
 
 def subscribe_to_default_newsletter(email, user=None, **kwargs) -> SubscriptionReturn:
@@ -167,10 +184,51 @@ def subscribe_user(
     return (SubscriptionResult.SUBSCRIBED, subscriber)
 
 
+def get_newsletter(newsletter_slug=None) -> Newsletter | None:
+    slug = newsletter_slug or settings.DEFAULT_NEWSLETTER
+    key = NEWSLETTER_KEY.format(slug)
+    newsletter = cache.get(key)
+    if newsletter is not None:
+        return newsletter
+    try:
+        newsletter = Newsletter.objects.get(slug=slug)
+    except Newsletter.DoesNotExist:
+        return None
+    cache.set(key, newsletter, NEWSLETTER_CACHE_TIMEOUT)
+    return newsletter
+
+
+def get_subscription_state(user) -> dict[str, bool]:
+    """
+    Returns newsletter slug -> subscribed flag for all subscribers
+    of the user, cached until a subscriber of the user changes.
+    """
+    key = SUBSCRIPTION_STATE_KEY.format(user.id)
+    state = cache.get(key)
+    if state is None:
+        state = {
+            slug: subscribed is not None
+            for slug, subscribed in Subscriber.objects.filter(user=user).values_list(
+                "newsletter__slug", "subscribed"
+            )
+        }
+        cache.set(key, state, SUBSCRIPTION_STATE_TIMEOUT)
+    return state
+
+
+def invalidate_subscription_state(user_ids):
+    keys = [SUBSCRIPTION_STATE_KEY.format(user_id) for user_id in user_ids if user_id]
+    if keys:
+        cache.delete_many(keys)
+
+
 def has_newsletter(user, newsletter=None, newsletter_slug=None) -> bool:
-    return bool(
-        get_subscriber(user, newsletter=newsletter, newsletter_slug=newsletter_slug)
-    )
+    if not user.is_authenticated:
+        return False
+    if newsletter is not None:
+        newsletter_slug = newsletter.slug
+    slug = newsletter_slug or settings.DEFAULT_NEWSLETTER
+    return slug in get_subscription_state(user)
 
 
 def get_subscriber(user, newsletter=None, newsletter_slug=None) -> Subscriber | None:
@@ -205,7 +263,45 @@ def subscribed_newsletters(user) -> List[Newsletter]:
     ]
 
 
-def cleanup_subscribers():
+class SHA256Hex(Func):
+    """
+    Hex digest of the UTF-8 encoded text with PostgreSQL's built-in
+    sha256(), which unlike Django's SHA256 does not need pgcrypto.
+    """
+
+    template = "ENCODE(SHA256(CONVERT_TO(%(expressions)s, 'UTF8')), 'hex')"
+    output_field = CharField()
+
+
+def anonymize_subscribers(subscriber_ids) -> int:
+    """
+    Removes email, user and name of subscribers but keeps a hash of
+    id and email to prove existence.
+    """
+    User = get_user_model()
+    user_email = Subquery(User.objects.filter(id=OuterRef("user_id")).values("email"))
+    # The id is kind of a salt
+    email_hash = SHA256Hex(
+        Concat(
+            Cast("id", output_field=CharField()),
+            Lower(Coalesce(user_email, "email", Value(""))),
+            output_field=CharField(),
+        )
+    )
+    subscribers = Subscriber.objects.filter(id__in=subscriber_ids, email_hash="")
+    user_ids = set(subscribers.exclude(user=None).values_list("user_id", flat=True))
+    count = subscribers.update(email_hash=email_hash, email=None, user=None, name="")
+    invalidate_subscription_state(user_ids)
+    return count
+
+
+def cleanup_subscribers(
+    batch_size=CLEANUP_BATCH_SIZE, time_budget=CLEANUP_TIME_BUDGET
+) -> bool:
+    """
+    Returns False if anonymization stopped because the time budget
+    ran out, the next run continues where this one stopped.
+    """
     now = timezone.now()
     month_ago = now - timedelta(days=30)
     three_days_ago = now - timedelta(days=3)
@@ -217,17 +313,17 @@ def cleanup_subscribers():
 
     # Recently unsubscribed: anonymize data
     # but keep hash to prove existence
-    subs = Subscriber.objects.filter(unsubscribed__lt=three_days_ago, email_hash="")
-    for sub in subs:
-        m = hashlib.sha256()
-        # Kind of a salt
-        m.update(str(sub.pk).encode("utf-8"))
-        m.update(sub.get_email().lower().encode("utf-8"))
-        sub.email_hash = m.hexdigest()
-        sub.email = None
-        sub.user = None
-        sub.name = ""
-        sub.save()
+    deadline = time.monotonic() + time_budget.total_seconds()
+    subs = Subscriber.objects.filter(
+        unsubscribed__lt=three_days_ago, email_hash=""
+    ).order_by("id")
+    while time.monotonic() < deadline:
+        subscriber_ids = list(subs.values_list("id", flat=True)[:batch_size])
+        if not subscriber_ids:
+            return True
+        anonymize_subscribers(subscriber_ids)
+    logger.info("Subscriber anonymization stopped after time budget")
+    return False
 
 
 def cleanup_feedback():
@@ -254,46 +350,19 @@ def import_csv(
     new_tags=None,
     data_columns=None,
     activation_template=None,
+    progress=None,
 ):
-    total = 0
-    already = 0
-    if tags is None:
-        tags = set()
-    else:
-        tags = set(tags)
-    if data_columns is None:
-        data_columns = set()
-    else:
-        data_columns = set(data_columns)
-
-    reader = csv.DictReader(csv_file)
-    for row in reader:
-        email = row["email"]
-        if "name" in row:
-            name = row.get("name", "")
-        elif "first_name" in row and "last_name" in row:
-            name = "{} {}".format(row["first_name"], row["last_name"])
-        else:
-            name = ""
-        row_tags = {t.strip() for t in row.get("tags", "").split(",") if t.strip()}
-        row_tags |= tags
-        row_data = {k: v for k, v in row.items() if k in data_columns}
-        result = subscribe_email(
-            newsletter,
-            email,
-            name=name,
-            email_confirmed=email_confirmed,
-            reference=reference,
-            tags=row_tags,
-            new_tags=new_tags,
-            batch=True,
-            data=row_data,
-            activation_template=activation_template,
-        )
-        if result[0] == SubscriptionResult.ALREADY_SUBSCRIBED_EMAIL:
-            already += 1
-        total += 1
-    return total, total - already
+    importer = SubscriberImporter(
+        newsletter,
+        reference=reference,
+        email_confirmed=email_confirmed,
+        tags=tags,
+        new_tags=new_tags,
+        data_columns=data_columns,
+        activation_template=activation_template,
+        progress=progress,
+    )
+    return importer.run(csv_file)
 
 
 def get_subscribers(newsletter: Newsletter, segments: Optional[list[Segment]] = None):
@@ -302,10 +371,7 @@ def get_subscribers(newsletter: Newsletter, segments: Optional[list[Segment]] =
     qs = Subscriber.objects.filter(newsletter=newsletter, subscribed__isnull=False)
 
     if segments:
-        first_segment = segments[0]
-        out_qs = first_segment.filter_subscribers(qs)
-        out_qs = out_qs.union(*[seg.filter_subscribers(qs) for seg in segments[1:]])
-        qs = out_qs
+        qs = SegmentCompiler(segments).filter_subscribers(qs)
     return qs
 
 
@@ -315,23 +381,30 @@ def generate_random_split(
     segments: list[Segment],
     groups: list[int],
     add_remaining: bool = True,
+    seed: Optional[int] = None,
 ) -> list[Segment]:
-    subscribers = get_subscribers(newsletter, segments)
+    """
+    Splits the audience into random groups. Subscriber ids are read
+    once from the database ordered by id and shuffled with the seed, so
+    the same seed gives the same groups for the same audience no matter
+    what the tag index holds. The seed is recorded in the segment
+    descriptions for audits.
+    """
+    if seed is None:
+        seed = random.SystemRandom().randrange(2**32)
+    rng = random.Random(seed)
+    subscriber_ids = list(
+        get_subscribers(newsletter, segments)
+        .order_by("id")
+        .values_list("id", flat=True)
+    )
 
-    count = subscribers.count()
+    count = len(subscriber_ids)
     group_sizes = [round(count * (g / 100.0)) for g in groups]
-    group_total = sum(group_sizes)
-
-    # Use a PostgreSQL CTE to select random subscribers
-    # This is a workaround for Django not supporting random ordering in across unions
-    subscriber_query = str(subscribers.values_list("id", flat=True).query)
-    with connection.cursor() as cursor:
-        cursor.execute(
-            "WITH selection AS ({query}) SELECT id FROM selection ORDER BY RANDOM() LIMIT {limit}".format(
-                query=subscriber_query, limit=group_total
-            )
-        )
-        sub_ids = [row[0] for row in cursor.fetchall()]
+    # Rounded group sizes can add up to more than the audience
+    group_total = min(sum(group_sizes), count)
+
+    sub_ids = rng.sample(subscriber_ids, group_total)
 
     group_tags = []
     for i, group in enumerate(groups, start=0):
@@ -352,8 +425,11 @@ def generate_random_split(
                     tag=group_tag,
                 )
                 for sub_id in sub_ids[start:end]
-            ]
+            ],
+            batch_size=RANDOM_SPLIT_BATCH_SIZE,
+            ignore_conflicts=True,
         )
+        tag_index.add_tags(sub_ids[start:end], [group_tag.id])
         start = end
 
     target_segments = []
@@ -361,7 +437,7 @@ def generate_random_split(
         group_letter = string.ascii_uppercase[i]
         segment = Segment.add_root(
             name=f"Group {group_letter} ({groups[i]}%) {name}",
-            description=f"""Selects {groups[i]}% of the subscribers of newsletter {newsletter.title} and with segments {segments}""",
+            description=f"""Selects {groups[i]}% of the subscribers of newsletter {newsletter.title} and with segments {segments} (random seed {seed})""",
         )
         segment.tags.add(group_tag)
         target_segments.append(segment)
@@ -675,6 +675,16 @@ class FragDenStaatBase(German, Base):
         "acks_late": True,
         "store_errors_even_if_ignored": True,
     }
+    # Messages per task (and SMTP connection) when sending mailings
+    CELERY_EMAIL_BULK_CHUNK_SIZE = 50
+    # Mailing delivery throttling in messages per second
+    MAILING_SEND_RATE = None
+    MAILING_DOMAIN_SEND_RATES = {
+        "gmx.de": 10,
+        "gmx.net": 10,
+        "web.de": 10,
+        "t-online.de": 5,
+    }
 
     def CELERY_TASK_ROUTES(self):
         routes = super().CELERY_TASK_ROUTES
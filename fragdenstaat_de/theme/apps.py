@@ -1,7 +1,8 @@
+from collections import defaultdict
 from datetime import timedelta
 
 from django.apps import AppConfig
-from django.db.models import Max
+from django.db.models import Max, Q
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
@@ -15,13 +16,14 @@ class ThemeConfig(AppConfig):
         from froide.account.registries import user_extra_registry
 
         from fragdenstaat_de.fds_mailing import gather_mailing_preview_context
-        from fragdenstaat_de.fds_newsletter import tag_subscriber
+        from fragdenstaat_de.fds_newsletter import tag_sources_changed, tag_subscribers
 
         from .forms import SignupUserCheckExtra
 
         user_extra_registry.register("registration", SignupUserCheckExtra())
         account_future_canceled.connect(start_legal_backup)
-        tag_subscriber.connect(tag_subscriber_froide_user)
+        tag_subscribers.connect(tag_subscribers_froide_user)
+        tag_sources_changed.connect(froide_user_tag_sources_changed)
         gather_mailing_preview_context.connect(provide_foirequest_mailing_context)
 
 
@@ -31,43 +33,80 @@ def start_legal_backup(sender, **kwargs):
     make_legal_backup.delay(sender.id)
 
 
-def tag_subscriber_froide_user(sender, email=None, **kwargs):
+def tag_subscribers_froide_user(sender, subscribers=None, **kwargs):
     from froide.account.models import User
     from froide.campaign.models import Campaign
 
-    user = (
-        User.objects.filter(email_deterministic=email)
+    subscriber_emails = {s.id: s.get_email() for s in subscribers}
+    users = (
+        User.objects.filter(
+            email_deterministic__in={e for e in subscriber_emails.values() if e}
+        )
         .annotate(last_request=Max("foirequest__created_at"))
-        .first()
+        .order_by("id")
     )
-    if not user:
+    users_by_email = {}
+    for user in users:
+        users_by_email.setdefault(user.email, user)
+    if not users_by_email:
         return
 
-    add_tags = set()
-    remove_tags = set()
+    campaigns = defaultdict(set)
+    campaign_slugs = (
+        Campaign.objects.filter(
+            foirequest__user__in=[u.id for u in users_by_email.values()]
+        )
+        .values_list("foirequest__user_id", "slug")
+        .distinct()
+    )
+    for user_id, slug in campaign_slugs:
+        campaigns[user_id].add(slug)
 
     YEAR = timedelta(days=365)
+    a_year_ago = timezone.now() - YEAR
+    result = {}
+    for subscriber_id, email in subscriber_emails.items():
+        user = users_by_email.get(email)
+        if user is None:
+            continue
+
+        add_tags = set()
+        remove_tags = set()
+
+        if user.is_trusted:
+            add_tags.add("user:trusted")
+        else:
+            remove_tags.add("user:trusted")
+
+        if user.last_request:
+            remove_tags.add("foirequest:no_requests")
+            add_tags.add("foirequest:has_requests")
+            if user.last_request > a_year_ago:
+                add_tags.add("foirequest:active")
+            else:
+                remove_tags.add("foirequest:active")
+        else:
+            add_tags.add("foirequest:no_requests")
 
-    if user.is_trusted:
-        add_tags.add("user:trusted")
-    else:
-        remove_tags.add("user:trusted")
+        add_tags |= {f"campaign:{slug}" for slug in campaigns[user.id]}
+        result[subscriber_id] = (add_tags, remove_tags)
+    return result
 
-    if user.last_request:
-        remove_tags.add("foirequest:no_requests")
-        add_tags.add("foirequest:has_requests")
-        if user.last_request > timezone.now() - YEAR:
-            add_tags.add("foirequest:active")
-        else:
-            remove_tags.add("foirequest:active")
-    else:
-        add_tags.add("foirequest:no_requests")
 
-    campaigns = Campaign.objects.filter(foirequest__user=user).values_list(
-        "slug", flat=True
+def froide_user_tag_sources_changed(sender, since=None, **kwargs):
+    from froide.account.models import User
+    from froide.foirequest.models import FoiRequest
+
+    YEAR = timedelta(days=365)
+    # New requests and requests that stopped being active since the last run
+    user_ids = FoiRequest.objects.filter(
+        Q(created_at__gt=since)
+        | Q(created_at__gt=since - YEAR, created_at__lte=timezone.now() - YEAR)
+    ).values("user_id")
+    return Q(user_id__in=user_ids) | Q(
+        user__isnull=True,
+        email__in=User.objects.filter(id__in=user_ids).values("email"),
     )
-    add_tags |= {f"campaign:{slug}" for slug in campaigns}
-    return add_tags, remove_tags
 
 
 def provide_foirequest_mailing_context(sender, **kwargs):
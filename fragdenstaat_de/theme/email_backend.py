@@ -1,9 +1,172 @@
+import threading
+import time
+from contextlib import contextmanager
+
 from django.conf import settings
 
 from djcelery_email.backends import CeleryEmailBackend
 from djcelery_email.tasks import send_emails
 from djcelery_email.utils import chunked, email_to_dict
 
+_bulk_state = threading.local()
+
+
+def get_bulk_chunk_size():
+    return getattr(
+        settings, "CELERY_EMAIL_BULK_CHUNK_SIZE", settings.CELERY_EMAIL_CHUNK_SIZE
+    )
+
+
+def enqueue_emails(messages, queue=None, backend_kwargs=None):
+    task_kwargs = {}
+    if queue is not None:
+        task_kwargs["queue"] = queue
+    return send_emails.apply_async(
+        args=[messages],
+        kwargs={"backend_kwargs": backend_kwargs or {}},
+        **task_kwargs,
+    )
+
+
+class BulkEmailBuffer:
+    """
+    Collects messages for the bulk queue and enqueues them in chunks.
+    Every chunk is sent by one task over one SMTP connection.
+
+    Messages added inside `grouped` are kept in separate chunks of
+    the group's chunk size, e.g. for throttled recipient domains.
+    Messages added inside `tagged` are recorded by tag once their
+    chunk is enqueued.
+    """
+
+    def __init__(self, chunk_size=None):
+        if chunk_size is None:
+            chunk_size = get_bulk_chunk_size()
+        self.chunk_size = chunk_size
+        self.pending = {}
+        self.group = None
+        self.group_chunk_sizes = {}
+        self.tag = None
+        self.tags = set()
+        self.enqueued_tags = set()
+        self.message_count = 0
+        self.task_count = 0
+        self.started = time.monotonic()
+        self.finished = None
+
+    @contextmanager
+    def grouped(self, group, chunk_size):
+        """
+        Enqueue messages added in this context in chunks of at most
+        `chunk_size` together with other messages of `group`.
+        """
+        previous = self.group
+        if group is not None:
+            self.group = group
+            self.group_chunk_sizes[group] = chunk_size
+        try:
+            yield self
+        finally:
+            self.group = previous
+
+    @contextmanager
+    def tagged(self, tag):
+        previous = self.tag
+        self.tag = tag
+        try:
+            yield self
+        finally:
+            self.tag = previous
+
+    def is_pending(self, tag):
+        """
+        Returns whether messages with tag were buffered,
+        but not enqueued.
+        """
+        return tag in self.tags and tag not in self.enqueued_tags
+
+    def add(self, messages, queue=None, backend_kwargs=None):
+        backend_kwargs = backend_kwargs or {}
+        key = (queue, repr(sorted(backend_kwargs.items())), self.group)
+        if key not in self.pending:
+            self.pending[key] = (queue, backend_kwargs, [])
+        pending = self.pending[key][2]
+        pending.extend((self.tag, message) for message in messages)
+        if self.tag is not None:
+            self.tags.add(self.tag)
+        self.message_count += len(messages)
+        chunk_size = self.group_chunk_sizes.get(self.group, self.chunk_size)
+        while len(pending) >= chunk_size:
+            chunk = pending[:chunk_size]
+            del pending[:chunk_size]
+            self.enqueue(chunk, queue, backend_kwargs)
+
+    def enqueue(self, pending, queue, backend_kwargs):
+        enqueue_emails(
+            [message for _tag, message in pending],
+            queue=queue,
+            backend_kwargs=backend_kwargs,
+        )
+        self.enqueued_tags.update(tag for tag, _message in pending if tag is not None)
+        self.task_count += 1
+
+    def flush(self):
+        for queue, backend_kwargs, pending in self.pending.values():
+            if pending:
+                self.enqueue(list(pending), queue, backend_kwargs)
+                pending.clear()
+        self.finished = time.monotonic()
+
+    def discard(self):
+        for _queue, _backend_kwargs, pending in self.pending.values():
+            pending.clear()
+        self.finished = time.monotonic()
+
+    @property
+    def duration(self):
+        end = self.finished if self.finished is not None else time.monotonic()
+        return end - self.started
+
+    @property
+    def messages_per_second(self):
+        if not self.duration:
+            return 0.0
+        return self.message_count / self.duration
+
+    @property
+    def tasks_per_thousand(self):
+        if not self.message_count:
+            return 0.0
+        return self.task_count * 1000 / self.message_count
+
+
+def get_bulk_buffer():
+    return getattr(_bulk_state, "buffer", None)
+
+
+@contextmanager
+def bulk_email_sending(chunk_size=None):
+    """
+    Buffer messages sent to the bulk queue in this thread and
+    enqueue them in chunks instead of one task per message.
+    Buffered messages are dropped when the block raises.
+    """
+    buffer = get_bulk_buffer()
+    if buffer is not None:
+        # Already inside bulk sending, outer context flushes
+        yield buffer
+        return
+    buffer = BulkEmailBuffer(chunk_size=chunk_size)
+    _bulk_state.buffer = buffer
+    try:
+        yield buffer
+    except BaseException:
+        _bulk_state.buffer = None
+        buffer.discard()
+        raise
+    _bulk_state.buffer = None
+    buffer.flush()
+
 
 class CustomCeleryEmailBackend(CeleryEmailBackend):
     def __init__(self, fail_silently=False, **kwargs):
@@ -12,17 +175,15 @@ class CustomCeleryEmailBackend(CeleryEmailBackend):
         self.init_kwargs = kwargs
 
     def send_messages(self, email_messages):
-        result_tasks = []
-        task_kwargs = {}
-        if self.queue is not None:
-            task_kwargs["queue"] = self.queue
         messages = [email_to_dict(msg) for msg in email_messages]
+        bulk_buffer = get_bulk_buffer()
+        if bulk_buffer is not None and self.queue == settings.EMAIL_BULK_QUEUE:
+            bulk_buffer.add(messages, queue=self.queue, backend_kwargs=self.init_kwargs)
+            return len(messages)
+
+        result_tasks = []
         for chunk in chunked(messages, settings.CELERY_EMAIL_CHUNK_SIZE):
             result_tasks.append(
-                send_emails.apply_async(
-                    args=[chunk],
-                    kwargs={"backend_kwargs": self.init_kwargs},
-                    **task_kwargs,
-                )
+                enqueue_emails(chunk, queue=self.queue, backend_kwargs=self.init_kwargs)
             )
         return result_tasks
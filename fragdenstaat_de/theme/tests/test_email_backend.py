@@ -0,0 +1,88 @@
+from django.conf import settings
+from django.core.mail import EmailMessage
+
+import pytest
+
+from fragdenstaat_de.theme import email_backend
+from fragdenstaat_de.theme.email_backend import (
+    CustomCeleryEmailBackend,
+    bulk_email_sending,
+)
+
+
+@pytest.fixture
+def enqueued(monkeypatch):
+    calls = []
+
+    def fake_apply_async(args=None, kwargs=None, **options):
+        calls.append((args[0], options.get("queue")))
+
+    monkeypatch.setattr(email_backend.send_emails, "apply_async", fake_apply_async)
+    return calls
+
+
+def make_message(i):
+    return EmailMessage(
+        "Subject {}".format(i), "Body", "from@example.org", ["to@example.org"]
+    )
+
+
+def test_bulk_sending_chunks_messages(enqueued):
+    backend = CustomCeleryEmailBackend(queue=settings.EMAIL_BULK_QUEUE)
+    with bulk_email_sending(chunk_size=3) as buffer:
+        for i in range(7):
+            backend.send_messages([make_message(i)])
+        assert len(enqueued) == 2
+
+    assert [len(messages) for messages, _queue in enqueued] == [3, 3, 1]
+    assert all(queue == settings.EMAIL_BULK_QUEUE for _messages, queue in enqueued)
+    assert buffer.message_count == 7
+    assert buffer.task_count == 3
+    assert buffer.tasks_per_thousand == pytest.approx(3000 / 7)
+
+
+def test_bulk_sending_ignores_other_queues(enqueued):
+    backend = CustomCeleryEmailBackend()
+    with bulk_email_sending(chunk_size=3):
+        for i in range(2):
+            backend.send_messages([make_message(i)])
+        assert len(enqueued) == 2
+
+
+def test_sending_without_bulk_enqueues_per_call(enqueued):
+    backend = CustomCeleryEmailBackend(queue=settings.EMAIL_BULK_QUEUE)
+    for i in range(2):
+        backend.send_messages([make_message(i)])
+    assert len(enqueued) == 2
+
+
+def test_bulk_sending_groups_chunks(enqueued):
+    backend = CustomCeleryEmailBackend(queue=settings.EMAIL_BULK_QUEUE)
+    with bulk_email_sending(chunk_size=3) as buffer:
+        for i in range(6):
+            if i % 2 == 0:
+                backend.send_messages([make_message(i)])
+                continue
+            with buffer.grouped("throttled", 1):
+                backend.send_messages([make_message(i)])
+        # Grouped messages are enqueued alone
+        assert len(enqueued) == 3
+
+    assert sorted(len(messages) for messages, _queue in enqueued) == [1, 1, 1, 3]
+    assert buffer.task_count == 4
+
+
+def test_bulk_sending_drops_buffer_on_error(enqueued):
+    backend = CustomCeleryEmailBackend(queue=settings.EMAIL_BULK_QUEUE)
+    with pytest.raises(ValueError):
+        with bulk_email_sending(chunk_size=2) as buffer:
+            for i in range(3):
+                with buffer.tagged(i):
+                    backend.send_messages([make_message(i)])
+            raise ValueError("broken")
+
+    # Only the first chunk was enqueued
+    assert [len(messages) for messages, _queue in enqueued] == [2]
+    assert not buffer.is_pending(0)
+    assert not buffer.is_pending(1)
+    assert buffer.is_pending(2)
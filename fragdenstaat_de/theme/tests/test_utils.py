@@ -0,0 +1,19 @@
+from django.core.cache import cache
+
+from fragdenstaat_de.theme.utils import cache_lock
+
+
+def test_cache_lock_waits_for_holder():
+    with cache_lock("test:lock", 5) as acquired:
+        assert acquired
+        with cache_lock("test:lock", 5, wait=0) as other:
+            assert not other
+    assert cache.get("test:lock") is None
+
+
+def test_cache_lock_keeps_lock_of_other_holder():
+    with cache_lock("test:lock", 5):
+        # Lock expired and was taken by another worker
+        cache.set("test:lock", "other", 5)
+    assert cache.get("test:lock") == "other"
+    cache.delete("test:lock")
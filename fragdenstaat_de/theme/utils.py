@@ -1,4 +1,9 @@
 import logging
+import time
+import uuid
+from contextlib import contextmanager
+
+from django.core.cache import cache as default_cache
 
 
 class Ignore501Errors(logging.Filter):
@@ -19,3 +24,27 @@ def handler500(request):
     from django.shortcuts import render
 
     return render(request, "500.html", {"request": request}, status=500)
+
+
+@contextmanager
+def cache_lock(key, timeout, wait=None, cache=None):
+    """
+    Lock on a cache key, which expires after `timeout` seconds in case
+    the holder crashed. Yields whether the lock was acquired within
+    `wait` seconds, waits until it is acquired without `wait`. The key
+    holds a unique token, so a holder whose lock expired does not
+    release the lock of another holder.
+    """
+    if cache is None:
+        cache = default_cache
+    token = uuid.uuid4().hex
+    deadline = None if wait is None else time.monotonic() + wait
+    while not (acquired := cache.add(key, token, timeout)):
+        if deadline is not None and time.monotonic() > deadline:
+            break
+        time.sleep(0.005)
+    try:
+        yield acquired
+    finally:
+        if acquired and cache.get(key) == token:
+            cache.delete(key)